@@ -1,33 +1,44 @@
+import hmac
+import json
 import time
 import requests
+from collections import Counter
 from typing import Optional, List
 
-from fastapi import APIRouter, HTTPException, Query
+from fastapi import APIRouter, Depends, Header, HTTPException, Path, Query, Request
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 
-from app.profiles import PROFILE
 from app.config import (
     DEFAULT_TOPIC,
     DEFAULT_SIDE,
-    OLLAMA_BASE_URL,
+    OLLAMA_API_BASE,
     OPENAI_API_KEY,
     OPENAI_BASE_URL,
-    USER_MSG_LIMIT, 
-    HISTORY_MAX_MSGS,
+    ASK_DEADLINE_SECONDS,
+    ASK_MODE,
+    JOB_LONGPOLL_MAX,
+    BATCH_MAX_ITEMS,
+    ADMIN_TOKEN,
     redis_client,
 )
 from app.models import (
     CommandsResponse, Command, ProfilesResponse, ProfileInfo,
     CreateProfileRequest, CreateProfileResponse, ConversationMetaResponse,
-    HistoryResponse, AskRequest, AskResponse, ChatMessage,
+    HistoryResponse, AskRequest, AskResponse, ChatMessage, JobResponse,
+    ProfilingResponse, ProfilingSettings, BatchAskRequest, BatchAskResponse, Persona, PersonaIn, PersonasResponse,
 )
 from app.services.conversation import (
-    new_cid, get_conversation, save_conversation, last_n,
-    extract_profile_cmd, normalize_cid, topic_change_requested,
-    bot_side_for, stance_type_from, detect_user_agreement,
+    new_cid, get_conversation, save_conversation, normalize_cid, stance_type_from, ConversationConflict,
 )
-from app.services.classifier import classify_topic_and_user_side_via_llm
-
-from app.services.llm import generate_reply
+from app.services.deadline import DeadlineExceeded, deadline_scope
+from app.services import export, metrics, personas, profiling, ratelimit, usage, warmup
+from app.services.idempotency import IdempotencyInProgress, IdempotencyKeyReused, run_once
+from app.services.singleflight import request_key
+from app.services.batch import run_batch
+from app.services.jobs import enqueue_ask, get_job, wait_job, watch_job
+from app.services.turns import ConversationNotFound, ask_turn
+from app.services.session import live_conversation
 
 router = APIRouter()
 
@@ -53,8 +64,8 @@ def health():
 
     ollama_ok, ollama_err = False, None
     try:
-        if OLLAMA_BASE_URL:
-            r = requests.get(f"{OLLAMA_BASE_URL.rstrip('/')}/api/tags", timeout=3)
+        if OLLAMA_API_BASE:
+            r = requests.get(f"{OLLAMA_API_BASE.rstrip('/')}/api/tags", timeout=3)
             r.raise_for_status()
             ollama_ok = True
     except Exception as e:
@@ -67,19 +78,48 @@ def health():
     return {
         "status": "ok" if status_ok else "degraded",
         "redis": ok_redis,
-        "ollama_base_url": OLLAMA_BASE_URL,
+        "ollama_base_url": OLLAMA_API_BASE,
         "ollama_reachable": ollama_ok,
         "ollama_error": ollama_err,
         "openai_ready": openai_ready,
         "openai_base_url": OPENAI_BASE_URL,
+        "models": warmup.model_states(),
     }
 
 
+@router.get("/live")
+def live():
+    """Liveness: the process is up and serving; no dependency checks."""
+    return {"status": "ok"}
+
+
+@router.get("/ready")
+def ready(request: Request):
+    """Readiness: startup finished, Redis answers and at least one LLM provider is usable (503 otherwise)."""
+    started = bool(getattr(request.app.state, "ready", False))
+    try:
+        ok_redis = bool(redis_client.ping())
+    except Exception:
+        ok_redis = False
+    llm_ok = bool(OPENAI_API_KEY) or _ollama_up(OLLAMA_API_BASE)
+    body = {"ready": started and ok_redis and llm_ok, "started": started, "redis": ok_redis, "llm": llm_ok}
+    return JSONResponse(status_code=200 if body["ready"] else 503, content=body)
+
+
+@router.get("/metrics")
+def get_metrics():
+    """In-process counters and latency summaries (per LLM task/model/provider), plus token/cost totals."""
+    return {**metrics.snapshot(), "usage": usage.summary()}
+
+
 @router.get("/commands", response_model=CommandsResponse)
 def list_commands():
     return CommandsResponse(commands=[
         Command(name="List commands", method="GET", path="/commands", description="Lista de endpoints disponibles con ejemplos"),
         Command(name="Health", method="GET", path="/health", description="Estado de la API, LLMs y Redis"),
+        Command(name="Liveness", method="GET", path="/live", description="El proceso está vivo (sin comprobar dependencias)"),
+        Command(name="Readiness", method="GET", path="/ready", description="Listo para tráfico: arranque completo, Redis y algún proveedor LLM (503 si no)"),
+        Command(name="Metrics", method="GET", path="/metrics", description="Latencias por tarea LLM (classify, agree, intent, reply, guard) y contadores"),
         Command(name="List profiles", method="GET", path="/profiles", description="Perfiles disponibles (id y nombre)"),
         Command(
             name="Set profile (create conversation)",
@@ -94,11 +134,24 @@ def list_commands():
             path="/ask",
             description="Si no envías conversation_id (o 'string'), crea nueva conversación con perfil por defecto. Devuelve latency_ms y los últimos 5 mensajes.",
         ),
+        Command(
+            name="Job status",
+            method="GET",
+            path="/jobs/{job_id}",
+            description="Modo asíncrono (POST /ask?mode=async → 202 + job_id): estado y resultado del turno; ?wait=N hace long-poll. /jobs/{job_id}/events para SSE.",
+            query_example={"wait": 20},
+        ),
+        Command(
+            name="Debate session (WebSocket)",
+            method="GET",
+            path="/ws/debate",
+            description="WebSocket: envía {\"message\"}; recibe tokens en streaming y {\"type\":\"done\"} por turno. ?conversation_id= para reanudar.",
+        ),
         Command(
             name="Conversation meta",
             method="GET",
             path="/conversations/{conversation_id}/meta",
-            description="Devuelve profile_id, profile_name, topic y side (lado de la IA)",
+            description="Devuelve profile_id, profile_name, topic, side (lado de la IA) y uso de tokens/costo",
         ),
         Command(
             name="History",
@@ -110,19 +163,19 @@ def list_commands():
     ])
 
 
-@router.get("/profiles", response_model=ProfilesResponse)
+@router.get("/profiles", response_model=ProfilesResponse, dependencies=[Depends(ratelimit.limit("read"))])
 def get_profiles():
     return ProfilesResponse(
-        profiles=[ProfileInfo(id=p["id"], name=p["name"]) for p in PROFILE.values()]
+        profiles=[ProfileInfo(id=p["id"], name=p["name"]) for p in personas.list_profiles()]
     )
 
 
-@router.post("/conversations/profile", response_model=CreateProfileResponse)
+@router.post("/conversations/profile", response_model=CreateProfileResponse, dependencies=[Depends(ratelimit.limit("read"))])
 def create_conversation_with_profile(req: CreateProfileRequest):
-    if req.profile_id not in PROFILE:
+    if personas.get_profile(req.profile_id) is None:
         raise HTTPException(
             status_code=400,
-            detail=f"Unknown profile '{req.profile_id}'. Available: {list(PROFILE.keys())}",
+            detail=f"Unknown profile '{req.profile_id}'. Available: {[p['id'] for p in personas.list_profiles()]}",
         )
     cid = new_cid()
     conv = {
@@ -140,30 +193,32 @@ def create_conversation_with_profile(req: CreateProfileRequest):
     return CreateProfileResponse(ok=True, conversation_id=cid, profile_id=req.profile_id)
 
 
-@router.get("/conversations/{conversation_id}/meta", response_model=ConversationMetaResponse)
+@router.get("/conversations/{conversation_id}/meta", response_model=ConversationMetaResponse, dependencies=[Depends(ratelimit.limit("read"))])
 def get_conversation_meta(conversation_id: str):
-    conv = get_conversation(conversation_id)
+    conv = live_conversation(conversation_id) or get_conversation(conversation_id, readonly=True)
     if not conv:
         raise HTTPException(status_code=404, detail="conversation_id not found")
     meta = conv.get("meta", {})
     pid = meta.get("profile_id")
-    profile_name = PROFILE.get(pid, {}).get("name", pid)
+    profile_name = (personas.get_profile(pid) or {}).get("name", pid)
     return ConversationMetaResponse(
         conversation_id=conversation_id,
         profile_id=pid,
         profile_name=profile_name,
         topic=meta.get("topic", DEFAULT_TOPIC),
         side=meta.get("side", DEFAULT_SIDE),
+        usage=usage.conversation_usage(conversation_id),
     )
 
 
-@router.get("/conversations/{conversation_id}/history5", response_model=HistoryResponse)
+@router.get("/conversations/{conversation_id}/history5", response_model=HistoryResponse, dependencies=[Depends(ratelimit.limit("read"))])
 def get_history(conversation_id: str, limit: Optional[int] = Query(None, ge=1, le=1000)):
     """
     If 'limit' is empty -> return full history.
     If 'limit' is provided -> return last 'limit' messages in chronological order.
+    Live WebSocket sessions are served from memory (Redis may lag behind write-behind).
     """
-    conv = get_conversation(conversation_id)
+    conv = live_conversation(conversation_id) or get_conversation(conversation_id, readonly=True)
     if not conv:
         raise HTTPException(status_code=404, detail="conversation_id not found")
     history = [ChatMessage(**m) for m in conv.get("messages", [])]
@@ -171,106 +226,220 @@ def get_history(conversation_id: str, limit: Optional[int] = Query(None, ge=1, l
     return HistoryResponse(conversation_id=conversation_id, message=out)
 
 
-@router.post("/ask", response_model=AskResponse)
-def ask(req: AskRequest):
+@router.post("/ask", response_model=AskResponse, responses={202: {"model": JobResponse}})
+def ask(req: AskRequest, request: Request, mode: Optional[str] = Query(None, pattern="^(sync|async)$"),
+        idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=255)):
     """
     Same endpoint set, simplified internals:
     - Uses new TEXT-ONLY generator with fallback to OpenAI.
     - No over-validation or rewrite passes.
     - Returns stance as 'pro' | 'contra' from backend logic (not from model output).
+    - The whole turn runs under ASK_DEADLINE_SECONDS: LLM calls only get the remaining budget (504 if spent);
+      Redis calls are skipped once it is spent but each is bounded by the fixed REDIS_SOCKET_TIMEOUT.
+    - Job mode (?mode=async or ASK_MODE=async): 202 + job id right away; fetch with /jobs/{job_id}.
+    - Idempotency-Key header: retries of the same request replay the first response (header
+      Idempotent-Replayed: true) or wait for it while it is still running; no LLM call is repeated.
+    - Rate limited per client and per conversation (buckets "ask" / "ask_conversation"): 429 + Retry-After.
+      Idempotent replays are not charged: tokens are only taken when the turn actually runs.
     """
+    if idempotency_key:
+        return _ask_idempotent(req, request, mode, idempotency_key)
+    ratelimit.enforce(request, "ask", normalize_cid(req.conversation_id))
+    return _ask_dispatch(req, mode)
+
+
+def _ask_idempotent(req: AskRequest, request: Request, mode: Optional[str], idempotency_key: str) -> JSONResponse:
+    def once():
+        ratelimit.enforce(request, "ask", normalize_cid(req.conversation_id))
+        out = _ask_dispatch(req, mode)
+        if isinstance(out, JSONResponse):
+            return out.status_code, json.loads(out.body)
+        return 200, out.model_dump(mode="json")
+
+    fp = request_key(conversation_id=normalize_cid(req.conversation_id), message=req.message, mode=mode or ASK_MODE)
+    try:
+        (status, body), replayed = run_once("ask", idempotency_key, fp, once)
+    except IdempotencyKeyReused as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except IdempotencyInProgress as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    headers = {"Idempotent-Replayed": "true" if replayed else "false"}
+    if status == 202 and body.get("job_id"):
+        headers["Location"] = f"/api/v1/jobs/{body['job_id']}"
+    return JSONResponse(status_code=status, content=body, headers=headers)
+
+
+def _ask_dispatch(req: AskRequest, mode: Optional[str]):
+    profiling.attach_current_thread()
+    if (mode or ASK_MODE) == "async":
+        return _enqueue_ask(req)
     start = time.time()
+    try:
+        with deadline_scope(ASK_DEADLINE_SECONDS):
+            return _ask_turn(req, start)
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
+
+
+def _enqueue_ask(req: AskRequest) -> JSONResponse:
+    cid = normalize_cid(req.conversation_id)
+    if cid and not get_conversation(cid):
+        raise HTTPException(status_code=404, detail="conversation_id not found")
+    job = enqueue_ask(cid or new_cid(), req.message, new=not cid)
+    return JSONResponse(status_code=202, content=job.model_dump(),
+                        headers={"Location": f"/api/v1/jobs/{job.job_id}"})
+
+
+def _ask_turn(req: AskRequest, start: float) -> AskResponse:
+    try:
+        return ask_turn(normalize_cid(req.conversation_id), req.message, start)
+    except ConversationNotFound:
+        raise HTTPException(status_code=404, detail="conversation_id not found")
+    except ConversationConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
 
-    requested_profile, user_text = extract_profile_cmd(req.message)
-    normalized_cid = normalize_cid(req.conversation_id)
-
-    if not normalized_cid:
-        topic, user_side = classify_topic_and_user_side_via_llm(user_text)
-        bot_side = bot_side_for(topic, user_side)
-        stance_type = "negative" if user_side == "affirmative" else "affirmative"
-
-        profile_id = requested_profile or PROFILE.get("smart_shy", {}).get("id", "smart_shy")
-        cid = new_cid()
-        conv = {
-            "meta": {
-                "topic": topic,
-                "side": bot_side,
-                "stance_type": stance_type,
-                "initial_topic": topic,
-                "initial_user_side": user_side,
-                "locked_side": True,
-                "profile_id": profile_id,
-                "user_side": user_side,
-                "user_aligned": False,
-            },
-            "messages": [],
-        }
-        save_conversation(cid, conv)
+
+@router.post("/ask/batch", response_model=BatchAskResponse)
+def ask_batch(req: BatchAskRequest, request: Request, stream: bool = False):
+    """
+    Many /ask turns in one call, run concurrently (turns of the same conversation stay in order).
+    Each item gets what /ask would return (`status` + `response` or `error`); `index` maps it back.
+    ?stream=true answers NDJSON, one result per line as soon as it is saved; otherwise all results in order.
+    Rate limits: one `ask_batch` token per item for the client, and one `ask_conversation` token per turn
+    of each existing conversation (the same per-conversation budget as /ask).
+    """
+    if len(req.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"at most {BATCH_MAX_ITEMS} items per batch")
+    per_conversation = Counter(c for c in (normalize_cid(i.conversation_id) for i in req.items) if c)
+    ratelimit.enforce(request, "ask_batch", cost=len(req.items), conversations=per_conversation,
+                      conversation_bucket="ask_conversation")
+    results = run_batch(req.items)
+    if stream:
+        return StreamingResponse((r.model_dump_json() + "\n" for r in results), media_type="application/x-ndjson")
+    return BatchAskResponse(results=sorted(results, key=lambda r: r.index))
+
+
+@router.get("/jobs/{job_id}", response_model=JobResponse, dependencies=[Depends(ratelimit.limit("read"))])
+async def get_job_status(job_id: str, wait: float = Query(0, ge=0)):
+    """
+    Job state; with ?wait=N long-polls up to N seconds (capped at JOB_LONGPOLL_MAX) for the result.
+    Async so waiting clients sit on the event loop, not in the threadpool the sync endpoints share.
+    """
+    if wait:
+        job = await wait_job(job_id, min(wait, JOB_LONGPOLL_MAX))
     else:
-        cid = normalized_cid
-        conv = get_conversation(cid)
-        if not conv:
-            raise HTTPException(status_code=404, detail="conversation_id not found")
-
-        if requested_profile:
-            conv["meta"]["profile_id"] = requested_profile
-
-        if not conv.get("messages"):
-            topic, user_side = classify_topic_and_user_side_via_llm(user_text)
-            bot_side = bot_side_for(topic, user_side)
-            stance_type = "negative" if user_side == "affirmative" else "affirmative"
-            conv["meta"].update({
-                "topic": topic,
-                "side": bot_side,
-                "stance_type": stance_type,
-                "initial_topic": topic,
-                "initial_user_side": user_side,
-                "locked_side": True,
-                "user_side": user_side,
-                "user_aligned": False,
-            })
-        else:
-            new_topic_req = topic_change_requested(user_text)
-            if new_topic_req is not None and new_topic_req:
-                inferred_topic, inferred_user_side = classify_topic_and_user_side_via_llm(user_text)
-                topic = inferred_topic or new_topic_req
-                bot_side = bot_side_for(topic, inferred_user_side)
-                stance_type = "negative" if inferred_user_side == "affirmative" else "affirmative"
-                conv["meta"].update({
-                    "topic": topic,
-                    "side": bot_side,
-                    "stance_type": stance_type,
-                    "initial_topic": topic,
-                    "initial_user_side": inferred_user_side,
-                    "locked_side": True,
-                    "user_side": inferred_user_side,
-                    "user_aligned": False,
-                })
-        save_conversation(cid, conv)
-
-    meta = conv["meta"]
-    history = [ChatMessage(**m) for m in conv.get("messages", [])]
+        job = await run_in_threadpool(get_job, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="job_id not found")
+    return job
 
-    if detect_user_agreement(user_text):
-        conv["meta"]["user_aligned"] = True
-        save_conversation(cid, conv)
 
-    user_text = user_text[:USER_MSG_LIMIT]
-    history.append(ChatMessage(role="user", message=user_text))
+@router.get("/jobs/{job_id}/events", dependencies=[Depends(ratelimit.limit("read"))])
+async def job_events(job_id: str):
+    """Server-Sent Events: one event per status change (`event: <status>`), the last one carries the result."""
+    if await run_in_threadpool(get_job, job_id) is None:
+        raise HTTPException(status_code=404, detail="job_id not found")
 
-    stance_hint = "pro" if meta.get("stance_type") == "affirmative" else "contra"
-    mr = generate_reply(history, user_text, stance_hint=stance_hint)
+    async def stream():
+        async for job in watch_job(job_id, ASK_DEADLINE_SECONDS + JOB_LONGPOLL_MAX):
+            if job is None:
+                yield ": ping\n\n"
+            else:
+                yield f"event: {job.status}\ndata: {job.model_dump_json()}\n\n"
 
-    history.append(ChatMessage(role="assistant", message=mr.reply))
-    conv["messages"] = [m.model_dump(by_alias=True) for m in history][-20:]
-    save_conversation(cid, conv)
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
-    last5 = last_n([ChatMessage(**m) for m in conv["messages"]], n=5)
-    latency_ms = int((time.time() - start) * 1000)
 
-    return AskResponse(
-        conversation_id=cid,
-        message=last5,
-        latency_ms=latency_ms,
-        stance=mr.stance,  
-    )
+def _require_admin(token: Optional[str]) -> None:
+    """Every /admin route: `X-Admin-Token` must equal ADMIN_TOKEN (the admin API is off without it)."""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="admin API is disabled (set ADMIN_TOKEN)")
+    if not token or not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="invalid admin token")
+
+
+def _require_profiling(token: Optional[str]) -> None:
+    _require_admin(token)
+    if not profiling.enabled():
+        raise HTTPException(status_code=404, detail="profiling is disabled (set PROFILING_TOKEN)")
+
+
+@router.get("/admin/profiling", response_model=ProfilingResponse)
+def list_profiling_runs(limit: int = Query(50, ge=1, le=500),
+                        admin_token: Optional[str] = Header(None, alias="X-Admin-Token")):
+    """Recent request profiles (newest first); download one with /admin/profiling/{id}."""
+    _require_profiling(admin_token)
+    return ProfilingResponse(enabled=True, sample_rate=profiling.sample_rate(),
+                             profiles=profiling.list_profiles(limit))
+
+
+@router.put("/admin/profiling", response_model=ProfilingResponse)
+def set_profiling(req: ProfilingSettings, admin_token: Optional[str] = Header(None, alias="X-Admin-Token")):
+    """Change the share of requests profiled without the X-Profile header (this process only)."""
+    _require_profiling(admin_token)
+    return ProfilingResponse(enabled=True, sample_rate=profiling.set_sample_rate(req.sample_rate))
+
+
+@router.get("/admin/profiling/{profile_id}")
+def get_profiling_run(profile_id: str, admin_token: Optional[str] = Header(None, alias="X-Admin-Token")):
+    """Collapsed stacks ("frame;frame;frame samples"), ready for flamegraph.pl or speedscope."""
+    _require_profiling(admin_token)
+    path = profiling.profile_path(profile_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="profile not found")
+    return FileResponse(path, media_type="text/plain; charset=utf-8", filename=f"{profile_id}.folded")
+
+
+@router.get("/admin/profiles", response_model=PersonasResponse)
+def admin_list_personas(admin_token: Optional[str] = Header(None, alias="X-Admin-Token")):
+    """All personas with their prompt text and style; `source` tells built-in from Redis-stored ones."""
+    _require_admin(admin_token)
+    return PersonasResponse(profiles=personas.list_profiles())
+
+
+@router.put("/admin/profiles/{profile_id}", response_model=Persona)
+def admin_put_persona(req: PersonaIn, profile_id: str = Path(..., pattern=r"^[A-Za-z0-9_\-]{1,64}$"),
+                      admin_token: Optional[str] = Header(None, alias="X-Admin-Token")):
+    """Create or replace a persona; every worker picks it up on the next request (no redeploy)."""
+    _require_admin(admin_token)
+    try:
+        return personas.registry.put(profile_id, req.model_dump())
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f"could not store persona: {e}")
+
+
+@router.delete("/admin/profiles/{profile_id}")
+def admin_delete_persona(profile_id: str, admin_token: Optional[str] = Header(None, alias="X-Admin-Token")):
+    """Remove a stored persona (a built-in one reverts to its default definition)."""
+    _require_admin(admin_token)
+    try:
+        removed = personas.registry.delete(profile_id)
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f"could not delete persona: {e}")
+    if not removed:
+        raise HTTPException(status_code=404, detail="persona not stored in the registry")
+    return {"ok": True, "profile_id": profile_id}
+
+
+@router.get("/admin/conversations/export")
+def export_conversations(profile_id: Optional[str] = None, topic: Optional[str] = None,
+                         since: Optional[str] = Query(None, description="ISO date/time, on meta.created_at"),
+                         until: Optional[str] = Query(None, description="ISO date/time (exclusive)"),
+                         cursor: Optional[str] = None, limit: Optional[int] = Query(None, ge=1),
+                         gzip: bool = False, admin_token: Optional[str] = Header(None, alias="X-Admin-Token")):
+    """
+    NDJSON stream of stored conversations (incremental SCAN + pipelined GETs, constant memory).
+    The last line is {"next_cursor": ...}: pass it back as ?cursor= to continue (null = done).
+    """
+    _require_admin(admin_token)
+    try:
+        flt = export.ExportFilter(profile_id=profile_id, topic=topic,
+                                  since=export.parse_date(since), until=export.parse_date(until))
+        body = export.iter_ndjson(flt, cursor=cursor, limit=limit)  # cursor/layout errors raise here, pre-stream
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if gzip:
+        return StreamingResponse(export.gzip_stream(body), media_type="application/gzip",
+                                 headers={"Content-Disposition": 'attachment; filename="conversations.ndjson.gz"'})
+    return StreamingResponse(body, media_type="application/x-ndjson")
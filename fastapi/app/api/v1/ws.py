@@ -0,0 +1,106 @@
+import asyncio
+import logging
+import time
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect
+from pydantic import ValidationError
+from starlette.concurrency import run_in_threadpool
+
+from app.config import WS_FLUSH_SECONDS
+from app.models import AskRequest
+from app.services import ratelimit
+from app.services.conversation import normalize_cid
+from app.services.deadline import DeadlineExceeded
+from app.services.session import DebateSession, open_session, close_session
+from app.services.turns import ask_response
+
+log = logging.getLogger(__name__)
+router = APIRouter()
+
+
+async def _pump(ws: WebSocket, queue: "asyncio.Queue") -> None:
+    while True:
+        item = await queue.get()
+        if item is None:
+            return
+        await ws.send_json(item)
+
+
+async def _flush_loop(session: DebateSession) -> None:
+    while True:
+        await asyncio.sleep(WS_FLUSH_SECONDS)
+        try:
+            await run_in_threadpool(session.flush_if_due)
+        except Exception as e:  # keep flushing on the next tick; the turns stay pending
+            log.warning("ws flusher: %s", e)
+
+
+@router.websocket("/ws/debate")
+async def debate_socket(ws: WebSocket, conversation_id: Optional[str] = None):
+    """
+    Live debate session. Client sends {"message": "..."}; server streams
+    {"type": "token"} / {"type": "reset"} frames and ends each turn with {"type": "done", ...AskResponse}.
+    Pass ?conversation_id= to resume an existing conversation.
+    Every turn takes /ask's rate limit tokens; a limited turn gets {"type": "error", "status": 429}.
+    """
+    await ws.accept()
+    cid = normalize_cid(conversation_id)
+    if cid:
+        session = await run_in_threadpool(open_session, cid)
+        if session is None:
+            await ws.send_json({"type": "error", "detail": "conversation_id not found"})
+            await ws.close(code=4404)
+            return
+        await ws.send_json({"type": "session", "conversation_id": cid, "resumed": True})
+    else:
+        session = DebateSession()
+
+    loop = asyncio.get_running_loop()
+    flusher = asyncio.create_task(_flush_loop(session))
+    try:
+        while True:
+            data = await ws.receive_json()
+            try:
+                req = AskRequest(conversation_id=session.cid, message=(data or {}).get("message", ""))
+            except (ValidationError, AttributeError) as e:
+                await ws.send_json({"type": "error", "detail": str(e)})
+                continue
+            try:
+                await run_in_threadpool(ratelimit.enforce, ws, "ask", session.cid)
+            except HTTPException as e:
+                await ws.send_json({"type": "error", "status": e.status_code, "detail": e.detail,
+                                    "retry_after": int((e.headers or {}).get("Retry-After", 1))})
+                continue
+
+            started = time.time()
+            queue: asyncio.Queue = asyncio.Queue()
+
+            def emit(item) -> None:
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+
+            pump = asyncio.create_task(_pump(ws, queue))
+            result, error = None, None
+            try:
+                result = await run_in_threadpool(
+                    session.turn, req.message,
+                    lambda t: emit({"type": "token", "text": t}),
+                    lambda: emit({"type": "reset"}),
+                )
+            except DeadlineExceeded as e:
+                error = {"type": "error", "status": 504, "detail": str(e)}
+            except Exception as e:
+                error = {"type": "error", "status": 500, "detail": str(e)}
+            finally:
+                queue.put_nowait(None)
+                await pump
+
+            if error:
+                await ws.send_json(error)
+            else:
+                await ws.send_json({"type": "done", **ask_response(result, started).model_dump()})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        flusher.cancel()
+        await run_in_threadpool(close_session, session)
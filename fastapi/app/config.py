@@ -1,6 +1,8 @@
 import os
 import re
+import threading
 import redis
+from typing import Dict, Optional, Tuple, TypedDict
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -19,8 +21,27 @@ LLM_MODEL = os.getenv("LLM_MODEL", "ollama/llama3.2:1b")
 LLM_BASE_URL = _ensure_url(os.getenv("LLM_BASE_URL"), "")   
 LLM_TEMPERATURE = float(os.getenv("LLM_TEMPERATURE", "0.7"))
 LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "20"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.25"))
+LLM_BACKOFF_CAP = float(os.getenv("LLM_BACKOFF_CAP", "2.0"))
+# Opt-in cap on in-flight calls per provider and process, for every LLM call (/ask, /ws, batches, jobs,
+# pregen): "ollama=4,openai=32"; unset/missing/0 = unlimited. A call that can't get a slot within its timeout
+# counts as a transient error (retry, then fall back to the next provider).
+LLM_PROVIDER_CONCURRENCY = {
+    k.strip().lower(): int(v)
+    for k, _, v in (p.partition("=") for p in os.getenv("LLM_PROVIDER_CONCURRENCY", "").split(","))
+    if k.strip() and v.strip().isdigit() and int(v) > 0
+}
+
+ASK_DEADLINE_SECONDS = float(os.getenv("ASK_DEADLINE_SECONDS", "60"))
+DEADLINE_MIN_STAGE_SECONDS = float(os.getenv("DEADLINE_MIN_STAGE_SECONDS", "0.25"))
 
 OLLAMA_BASE_URL = _ensure_url(os.getenv("OLLAMA_BASE_URL"), "")
+# Single Ollama endpoint for every caller (LLM_BASE_URL wins, OLLAMA_BASE_URL as used by docker-compose otherwise).
+OLLAMA_API_BASE = LLM_BASE_URL or OLLAMA_BASE_URL
+OLLAMA_NATIVE = os.getenv("OLLAMA_NATIVE", "1") == "1"
+OLLAMA_MAX_CONNECTIONS = int(os.getenv("OLLAMA_MAX_CONNECTIONS", "20"))
+OLLAMA_MAX_KEEPALIVE = int(os.getenv("OLLAMA_MAX_KEEPALIVE", "10"))
 MODEL_NAME = os.getenv("MODEL_NAME", LLM_MODEL)
 
 OPENAI_API_KEY  = (os.getenv("OPENAI_API_KEY") or "").strip()
@@ -35,20 +56,189 @@ HTTP_TIMEOUT_SECONDS = float(os.getenv("HTTP_TIMEOUT_SECONDS", "45"))
 REPLY_CHAR_LIMIT = int(os.getenv("REPLY_CHAR_LIMIT", "0") or "0")
 NUM_PREDICT_CAP  = int(os.getenv("NUM_PREDICT_CAP", "360"))
 LLM_MOCK = os.getenv("LLM_MOCK", "0") == "1"
+LLM_MOCK_LATENCY = float(os.getenv("LLM_MOCK_LATENCY", "0"))
 DOCS_VERSION = os.getenv("DOCS_VERSION", "dev")
 MAX_HISTORY_PAIRS = int(os.getenv("MAX_HISTORY_PAIRS", "3"))
 KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "10m")
 NUM_CTX = int(os.getenv("NUM_CTX", "1024"))
 STRICT_ALIGN = os.getenv("STRICT_ALIGN", "1") == "1"
 REVISION_PASS = os.getenv("REVISION_PASS", "0") == "1"
+WS_FLUSH_TURNS = int(os.getenv("WS_FLUSH_TURNS", "3"))
+WS_FLUSH_SECONDS = float(os.getenv("WS_FLUSH_SECONDS", "5"))
+SINGLEFLIGHT_ENABLED = os.getenv("SINGLEFLIGHT_ENABLED", "1") == "1"
+SINGLEFLIGHT_REDIS = os.getenv("SINGLEFLIGHT_REDIS", "0") == "1"
+SINGLEFLIGHT_LOCK_TTL = float(os.getenv("SINGLEFLIGHT_LOCK_TTL", "30"))
+SINGLEFLIGHT_RESULT_TTL = float(os.getenv("SINGLEFLIGHT_RESULT_TTL", "5"))
+PREGEN_ENABLED = os.getenv("PREGEN_ENABLED", "0") == "1"
+PREGEN_POOL_SIZE = int(os.getenv("PREGEN_POOL_SIZE", "3"))
+PREGEN_TOP_TOPICS = int(os.getenv("PREGEN_TOP_TOPICS", "5"))
+PREGEN_MAX_AGE = int(os.getenv("PREGEN_MAX_AGE", "21600"))
+PREGEN_INTERVAL = float(os.getenv("PREGEN_INTERVAL", "60"))
+# Un solo worker rellena el pool a la vez (lock en Redis) y genera como mucho PREGEN_MAX_PER_CYCLE aperturas por ciclo.
+PREGEN_MAX_PER_CYCLE = int(os.getenv("PREGEN_MAX_PER_CYCLE", "4"))
+PREGEN_LOCK_TTL = float(os.getenv("PREGEN_LOCK_TTL", "300"))
+# Job mode: /ask enqueues on a Redis Stream consumed by `python -m app.worker` ("sync" keeps the inline path).
+ASK_MODE = os.getenv("ASK_MODE", "sync").strip().lower()
+JOB_STREAM = os.getenv("JOB_STREAM", "jobs:ask")
+JOB_GROUP = os.getenv("JOB_GROUP", "ask-workers")
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RESULT_TTL = int(os.getenv("JOB_RESULT_TTL", "3600"))
+JOB_STREAM_MAXLEN = int(os.getenv("JOB_STREAM_MAXLEN", "10000"))
+JOB_LONGPOLL_MAX = float(os.getenv("JOB_LONGPOLL_MAX", "25"))
+JOB_CLAIM_IDLE = float(os.getenv("JOB_CLAIM_IDLE", str(ASK_DEADLINE_SECONDS + 30)))
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", "1"))
+WORKER_THREADS = int(os.getenv("WORKER_THREADS", "4"))
+# Model residency: preload configured Ollama models at startup and refresh them while there is traffic.
+WARMUP_PRELOAD = os.getenv("WARMUP_PRELOAD", "1") == "1"
+WARMUP_ACTIVE_WINDOW = float(os.getenv("WARMUP_ACTIVE_WINDOW", "900"))
+WARMUP_REFRESH_MARGIN = float(os.getenv("WARMUP_REFRESH_MARGIN", "90"))
+WARMUP_INTERVAL = float(os.getenv("WARMUP_INTERVAL", "30"))
+WARMUP_TIMEOUT = float(os.getenv("WARMUP_TIMEOUT", "180"))
+# Concurrent turns on one conversation: versioned compare-and-set saves; on conflict
+# "merge" appends our turn to the newer state, "reject" answers 409, "queue" re-runs the turn on it.
+CONV_CONFLICT_POLICY = os.getenv("CONV_CONFLICT_POLICY", "merge").strip().lower()
+CONV_CAS_RETRIES = int(os.getenv("CONV_CAS_RETRIES", "3"))
+# Idempotency-Key on /ask: responses kept IDEMPOTENCY_TTL s; duplicates wait up to IDEMPOTENCY_WAIT s.
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", "86400"))
+IDEMPOTENCY_LOCK_TTL = float(os.getenv("IDEMPOTENCY_LOCK_TTL", str(ASK_DEADLINE_SECONDS + 30)))
+IDEMPOTENCY_WAIT = float(os.getenv("IDEMPOTENCY_WAIT", str(ASK_DEADLINE_SECONDS)))
+# Token/cost accounting per LLM call: Redis totals per conversation (usage:<cid>) and per UTC day.
+USAGE_TRACKING = os.getenv("USAGE_TRACKING", "1").lower() not in ("0", "false", "no")
+USAGE_DAY_TTL = int(os.getenv("USAGE_DAY_TTL", str(90 * 86400)))
+# On-demand profiling (off unless PROFILING_TOKEN is set): `X-Profile: <token>` profiles one request,
+# PROFILING_SAMPLE_RATE a random share of them; collapsed stacks go to PROFILING_DIR.
+PROFILING_TOKEN = os.getenv("PROFILING_TOKEN", "")
+PROFILING_DIR = os.getenv("PROFILING_DIR", "/tmp/debate-profiles")
+PROFILING_SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", "0"))
+PROFILING_INTERVAL = float(os.getenv("PROFILING_INTERVAL", "0.005"))
+PROFILING_KEEP = int(os.getenv("PROFILING_KEEP", "200"))
+# Rate limiting (token buckets in Redis). Each bucket is "<capacity>/<seconds>" (refilled evenly over the
+# window); "0" turns that bucket off. *_CONVERSATION buckets are keyed by conversation_id, the rest by client.
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1").lower() not in ("0", "false", "no")
+RATE_LIMIT_TRUST_PROXY = os.getenv("RATE_LIMIT_TRUST_PROXY", "0") == "1"  # use X-Forwarded-For
+
+
+def _bucket(name: str, default: str) -> Optional[Tuple[int, float]]:
+    raw = (os.getenv(name) or default).strip()
+    if raw in ("", "0"):
+        return None
+    capacity, _, period = raw.partition("/")
+    return int(capacity), float(period or 60)
+
+
+RATE_LIMITS = {
+    k: v for k, v in {
+        "ask": _bucket("RATE_LIMIT_ASK", "20/60"),
+        "ask_conversation": _bucket("RATE_LIMIT_ASK_CONVERSATION", "6/60"),
+        "ask_batch": _bucket("RATE_LIMIT_ASK_BATCH", "200/60"),  # items per client for /ask/batch
+        "read": _bucket("RATE_LIMIT_READ", "120/60"),
+        "read_conversation": _bucket("RATE_LIMIT_READ_CONVERSATION", "60/60"),
+    }.items() if v
+}
+# X-Admin-Token secret for every /admin route (personas, profiling, export); unset = admin API off.
+# Persona registry: built-ins + Redis "profiles" hash, edited via /admin/profiles.
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+PROFILE_CACHE_TTL = float(os.getenv("PROFILE_CACHE_TTL", "60"))  # fallback if an invalidation is missed
+PROMPT_CACHE_SIZE = int(os.getenv("PROMPT_CACHE_SIZE", "2048"))
+EXPORT_BATCH = int(os.getenv("EXPORT_BATCH", "500"))  # SCAN COUNT hint / keys per pipelined fetch
+# POST /ask/batch: turns per request, and threads (shared by all batches) running them.
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "100"))
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", "8"))
+GUARD_VERIFY_WORKERS = int(os.getenv("GUARD_VERIFY_WORKERS", "2"))
+ALIGN_FLAG_TTL = int(os.getenv("ALIGN_FLAG_TTL", "3600"))
 MAX_OUTPUT_TOKENS = int(os.getenv("MAX_OUTPUT_TOKENS", "800"))
 MAX_MSG_CHARS = int(os.getenv("MAX_MSG_CHARS", "12000"))
 USER_MSG_LIMIT = int(os.getenv("USER_MSG_LIMIT", "4000"))
 HISTORY_MAX_MSGS = int(os.getenv("HISTORY_MAX_MSGS", "30"))
 
 
+class TaskCfg(TypedDict):
+    model: str
+    fallback_model: str
+    providers: str          # ollama_first | openai_first | ollama_only | openai_only
+    temperature: float
+    keep_alive: str
+    num_ctx: int
+    num_predict: Optional[int]
+
+
+def _task_cfg(task: str, model: str, temperature: float, keep_alive: str, num_predict: Optional[int]) -> TaskCfg:
+    """Per-task LLM settings; every field can be overridden with LLM_TASK_<TASK>_<FIELD>."""
+    p = f"LLM_TASK_{task.upper()}_"
+    raw_predict = os.getenv(p + "NUM_PREDICT")
+    return {
+        "model": os.getenv(p + "MODEL", model),
+        "fallback_model": os.getenv(p + "FALLBACK_MODEL", OPENAI_MODEL),
+        "providers": (os.getenv(p + "PROVIDERS") or PROVIDER_PREFERENCE).strip(),
+        "temperature": float(os.getenv(p + "TEMPERATURE", str(temperature))),
+        "keep_alive": os.getenv(p + "KEEP_ALIVE", keep_alive),
+        "num_ctx": int(os.getenv(p + "NUM_CTX", str(NUM_CTX))),
+        "num_predict": int(raw_predict) if raw_predict else num_predict,
+    }
+
+
+# Small, always-resident model for the short classifier calls; the stronger model writes replies.
+LLM_SMALL_MODEL = os.getenv("LLM_SMALL_MODEL", LLM_MODEL)
+LLM_SMALL_KEEP_ALIVE = os.getenv("LLM_SMALL_KEEP_ALIVE", KEEP_ALIVE)
+
+TASKS: Dict[str, TaskCfg] = {
+    "classify": _task_cfg("classify", LLM_SMALL_MODEL, 0.0, LLM_SMALL_KEEP_ALIVE, 200),
+    "agree":    _task_cfg("agree",    LLM_SMALL_MODEL, 0.0, LLM_SMALL_KEEP_ALIVE, 5),
+    "intent":   _task_cfg("intent",   LLM_SMALL_MODEL, 0.0, LLM_SMALL_KEEP_ALIVE, 16),
+    "guard":    _task_cfg("guard",    LLM_SMALL_MODEL, 0.0, LLM_SMALL_KEEP_ALIVE, 80),
+    "reply":    _task_cfg("reply",    LLM_MODEL, LLM_TEMPERATURE, KEEP_ALIVE, None),
+}
+
+
 REDIS_URL = os.getenv("REDIS_TLS_URL") or os.getenv("REDIS_URL") or "redis://localhost:6379/0"
-redis_client = redis.from_url(REDIS_URL, decode_responses=True)
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", "2"))
+# Conversation sharding: "primary|replica,primary|replica"; empty keeps everything on REDIS_URL.
+REDIS_SHARDS = os.getenv("REDIS_SHARDS", "").strip()
+REDIS_SHARD_VNODES = int(os.getenv("REDIS_SHARD_VNODES", "64"))
+REDIS_CLUSTER = os.getenv("REDIS_CLUSTER", "0") == "1"
+REDIS_HASH_TAGS = os.getenv("REDIS_HASH_TAGS", "0") == "1"
+
+
+class LazyRedis:
+    """
+    Module-level Redis handle. The real client (and its pool) is built by connect(), called from the
+    app lifespan, or on first use; importing config stays cheap.
+    With REDIS_CLUSTER=1 it is a RedisCluster client, so rate limits, jobs, pools, locks and usage
+    counters follow MOVED redirects like the conversation store does.
+    """
+
+    def __init__(self, url: str):
+        self.url = url
+        self._client: Optional[redis.Redis] = None
+        self._lock = threading.Lock()
+
+    def connect(self) -> redis.Redis:
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    factory = redis.from_url
+                    if REDIS_CLUSTER:
+                        from redis.cluster import RedisCluster
+                        factory = RedisCluster.from_url
+                    self._client = factory(
+                        self.url,
+                        decode_responses=True,
+                        socket_timeout=REDIS_SOCKET_TIMEOUT,
+                        socket_connect_timeout=REDIS_SOCKET_TIMEOUT,
+                    )
+        return self._client
+
+    def close(self) -> None:
+        with self._lock:
+            client, self._client = self._client, None
+        if client is not None:
+            client.close()
+
+    def __getattr__(self, name):
+        return getattr(self.connect(), name)
+
+
+redis_client = LazyRedis(REDIS_URL)
 
 
 PROFILE_CMD = re.compile(r"^\s*/profile\s+([a-zA-Z0-9_\-]+)\s*", re.IGNORECASE)
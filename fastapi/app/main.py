@@ -1,11 +1,53 @@
 import os
-import requests
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from app.api.docs import configure_docs
 from app.api.v1.endpoints import router as api_v1
-from app.config import LLM_BASE_URL
+from app.api.v1.ws import router as api_v1_ws
+from app.config import OLLAMA_API_BASE, OLLAMA_NATIVE, PROFILING_TOKEN
+from app.services.personas import start_listener, stop_listener
+from app.services.pregen import start_pool, stop_pool
+from app.services.ratelimit import RateLimitHeadersMiddleware
+from app.services.warmup import start_warmer, stop_warmer
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Clients are built here rather than at import time (Redis pool, pooled Ollama client); provider SDKs
+    such as LiteLLM load on first use. `app.state.ready` backs /ready.
+    """
+    from app.config import redis_client
+    from app.services.ollama import close_ollama, get_ollama
+
+    app.state.ready = False
+    connect = getattr(redis_client, "connect", None)
+    if callable(connect):
+        connect()
+    if OLLAMA_API_BASE and OLLAMA_NATIVE:
+        get_ollama()
+    start_warmer()  # preloads model weights in the background, never blocks startup
+    start_listener()  # persona/prompt cache invalidation from other workers
+    start_pool()
+    app.state.ready = True
+    try:
+        yield
+    finally:
+        app.state.ready = False
+        stop_pool()
+        stop_listener()
+        stop_warmer()
+        close_ollama()
+        close = getattr(redis_client, "close", None)
+        if callable(close):
+            try:
+                close()
+            except Exception:
+                pass
+
 
 def create_app() -> FastAPI:
     app = FastAPI(
@@ -14,6 +56,7 @@ def create_app() -> FastAPI:
         docs_url=None,
         redoc_url=None,
         openapi_url="/openapi.json",
+        lifespan=lifespan,
     )
 
     allow_origins = os.getenv("CORS_ALLOW_ORIGINS", "*")
@@ -27,23 +70,14 @@ def create_app() -> FastAPI:
         max_age=600,
     )
 
-    @app.on_event("startup")
-    def _warmup() -> None:
-        """
-        Non-blocking warmup:
-        - If LLM_BASE_URL is set and points to an Ollama-compatible endpoint,
-          we try hitting /api/tags. If it fails, we silently ignore it.
-        - If LLM_BASE_URL is empty or it's a non-Ollama provider, we skip.
-        """
-        base = (LLM_BASE_URL or "").rstrip("/")
-        if not base:
-            return
-        try:
-            requests.get(f"{base}/api/tags", timeout=3)
-        except Exception:
-            pass  
+    app.add_middleware(RateLimitHeadersMiddleware)
+    if PROFILING_TOKEN:  # not installed at all otherwise: zero per-request cost
+        from app.services.profiling import ProfilingMiddleware
+        app.add_middleware(ProfilingMiddleware)
+
     configure_docs(app)
     app.include_router(api_v1, prefix="/api/v1")
+    app.include_router(api_v1_ws, prefix="/api/v1")
     return app
 
 app = create_app()
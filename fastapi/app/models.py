@@ -40,6 +40,47 @@ class AskResponse(AppBase):
     latency_ms: int
     stance: Stance
 
+JobStatus = Literal["queued", "running", "retrying", "done", "failed"]
+
+class JobResponse(AppBase):
+    job_id: str
+    status: JobStatus
+    conversation_id: Optional[str] = None
+    attempts: int = 0
+    result: Optional[AskResponse] = None
+    error: Optional[str] = None
+
+class BatchAskRequest(AppBase):
+    items: List[AskRequest] = Field(min_length=1)
+
+class BatchAskResult(AppBase):
+    index: int                      # position in BatchAskRequest.items
+    status: int = 200               # what /ask would have answered for this item
+    response: Optional[AskResponse] = None
+    error: Optional[str] = None
+
+class BatchAskResponse(AppBase):
+    results: List[BatchAskResult]
+
+class ProfilingRun(AppBase):
+    id: str
+    method: str
+    path: str
+    status: Optional[int] = None
+    started_at: float
+    duration_ms: float
+    samples: int
+    interval_ms: float
+    pid: int
+
+class ProfilingResponse(AppBase):
+    enabled: bool
+    sample_rate: float
+    profiles: List[ProfilingRun] = Field(default_factory=list)
+
+class ProfilingSettings(AppBase):
+    sample_rate: float = Field(ge=0, le=1)
+
 class Command(AppBase):
     name: str
     method: Literal["GET", "POST", "PUT", "DELETE", "PATCH"]
@@ -58,6 +99,18 @@ class ProfileInfo(AppBase):
 class ProfilesResponse(AppBase):
     profiles: List[ProfileInfo]
 
+class PersonaIn(AppBase):
+    name: str = Field(min_length=1, max_length=80)
+    system: str = Field("", max_length=4000)
+    style: Dict[str, float] = Field(default_factory=dict)  # temperature, top_p, num_predict
+
+class Persona(PersonaIn):
+    id: str
+    source: Literal["builtin", "redis"] = "builtin"
+
+class PersonasResponse(AppBase):
+    profiles: List[Persona]
+
 class CreateProfileRequest(AppBase):
     profile_id: str
 
@@ -76,12 +129,44 @@ class ConversationMetaResponse(AppBase):
     profile_name: str
     topic: str
     side: str
+    usage: Dict[str, float] = Field(default_factory=dict)  # running token/cost totals, also per task
 
 class ModelReply(AppBase):
     stance: Stance
     reply: str
+    guard_verdict: Optional[str] = None
 
     @field_validator("reply")
     @classmethod
     def _reply_len(cls, v: str) -> str:
         return (v or "")[:900]
+
+
+def _lower(v):
+    return v.strip().lower() if isinstance(v, str) else v
+
+class TopicSide(AppBase):
+    topic: str = Field(min_length=1, max_length=200)
+    user_side: Literal["affirmative", "negative"] = "negative"
+
+    @field_validator("topic", mode="before")
+    @classmethod
+    def _topic_clip(cls, v):
+        return v.strip()[:200] if isinstance(v, str) else v
+
+    @field_validator("user_side", mode="before")
+    @classmethod
+    def _side_or_negative(cls, v):
+        # Una side inválida ("neutral", "pro"...) no debe tirar un topic válido: se asume 'negative'.
+        v = _lower(v)
+        return v if v in ("affirmative", "negative") else "negative"
+
+class AlignmentVerdict(AppBase):
+    alignment: Literal["supports", "opposes", "neutral_or_mixed"]
+
+    _alignment_lower = field_validator("alignment", mode="before")(_lower)
+
+class IntentLabel(AppBase):
+    label: Literal["topic_change", "continue_topic", "greeting", "chit_chat", "unsafe"]
+
+    _label_lower = field_validator("label", mode="before")(_lower)
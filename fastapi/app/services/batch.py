@@ -0,0 +1,157 @@
+from __future__ import annotations
+
+import copy
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional, Set
+
+from app.config import ASK_DEADLINE_SECONDS, BATCH_WORKERS, CONV_CONFLICT_POLICY
+from app.models import AskRequest, AskResponse, BatchAskResult, ChatMessage
+from app.services import metrics
+from app.services.conversation import (
+    ConversationConflict, get_conversations, last_n, normalize_cid, save_conversations,
+)
+from app.services.deadline import DeadlineExceeded, deadline_scope
+from app.services.turns import ConversationNotFound, TurnResult, ask_turn, merge_save, run_turn
+
+# Threads shared by every batch: caps how many batch turns run at once in this process (on top of the
+# per-provider LLM slots). Turns of the same conversation run in order on one thread; the others run
+# concurrently. Loads and saves are pipelined: one GET round trip up front, then one CAS round trip per
+# shard for every group of turns that finished together.
+_pool = ThreadPoolExecutor(max_workers=BATCH_WORKERS, thread_name_prefix="ask-batch")
+
+
+@dataclass
+class _Group:
+    cid: Optional[str]
+    indexes: List[int]
+    messages: List[str]
+    conv: Optional[dict] = None
+    base_meta: dict = field(default_factory=dict)
+    results: Dict[int, BatchAskResult] = field(default_factory=dict)
+    new_messages: List[dict] = field(default_factory=list)
+    last: Optional[TurnResult] = None
+
+
+def _error(index: int, exc: Exception) -> BatchAskResult:
+    if isinstance(exc, ConversationNotFound):
+        return BatchAskResult(index=index, status=404, error="conversation_id not found")
+    if isinstance(exc, ConversationConflict):
+        return BatchAskResult(index=index, status=409, error=str(exc))
+    if isinstance(exc, DeadlineExceeded):
+        return BatchAskResult(index=index, status=504, error=str(exc))
+    return BatchAskResult(index=index, status=500, error=f"{type(exc).__name__}: {exc}")
+
+
+def _groups(items: List[AskRequest]) -> List[_Group]:
+    """One group per conversation (its turns in request order); every item without a cid starts its own."""
+    by_cid: Dict[str, _Group] = {}
+    groups: List[_Group] = []
+    for i, item in enumerate(items):
+        cid = normalize_cid(item.conversation_id)
+        if cid and cid in by_cid:
+            by_cid[cid].indexes.append(i)
+            by_cid[cid].messages.append(item.message)
+            continue
+        g = _Group(cid=cid, indexes=[i], messages=[item.message])
+        groups.append(g)
+        if cid:
+            by_cid[cid] = g
+    return groups
+
+
+def _run_group(g: _Group) -> _Group:
+    """
+    Run the group's turns in order on its in-memory conversation (nothing is saved here).
+    Each turn gets its own ASK_DEADLINE_SECONDS, as if it had been sent to /ask.
+    """
+    for index, message in zip(g.indexes, g.messages):
+        t0 = time.time()
+        try:
+            if g.cid and g.conv is None:
+                raise ConversationNotFound(g.cid)
+            with deadline_scope(ASK_DEADLINE_SECONDS):
+                result = run_turn(g.cid, g.conv, message)
+        except Exception as e:
+            g.results[index] = _error(index, e)
+            continue
+        g.cid, g.conv, g.last = result.cid, result.conv, result
+        g.new_messages.extend(result.new_messages)
+        g.results[index] = BatchAskResult(index=index, response=AskResponse(
+            conversation_id=result.cid,
+            message=last_n([ChatMessage(**m) for m in result.conv["messages"]], n=5),
+            latency_ms=int((time.time() - t0) * 1000),
+            stance=result.reply.stance,
+        ))
+    return g
+
+
+def _save(groups: List[_Group], started: float) -> None:
+    """Persist finished groups with one pipelined CAS per shard; conflicts follow CONV_CONFLICT_POLICY."""
+    todo = [g for g in groups if g.last is not None]
+    if not todo:
+        return
+    try:
+        conflicts = save_conversations([(g.cid, g.conv) for g in todo])
+    except Exception as e:
+        for g in todo:
+            _fail_turns(g, e)
+        return
+    for g, conflict in zip(todo, conflicts):
+        if conflict is None:
+            continue
+        metrics.incr("conv_conflicts", policy=CONV_CONFLICT_POLICY)
+        try:
+            if CONV_CONFLICT_POLICY == "reject":
+                raise conflict
+            if CONV_CONFLICT_POLICY == "merge":
+                merge_save(TurnResult(cid=g.cid, conv=g.conv, reply=g.last.reply, new_messages=g.new_messages),
+                           g.base_meta)
+            else:  # queue: run the group's turns again, one by one, on top of the newer state
+                for index, message in zip(g.indexes, g.messages):
+                    if g.results[index].response is not None:
+                        g.results[index] = BatchAskResult(index=index, response=ask_turn(g.cid, message, started))
+        except Exception as e:
+            _fail_turns(g, e)
+
+
+def _fail_turns(g: _Group, exc: Exception) -> None:
+    for index in g.indexes:
+        if g.results.get(index) is not None and g.results[index].response is not None:
+            g.results[index] = _error(index, exc)
+
+
+def run_batch(items: List[AskRequest]) -> Iterator[BatchAskResult]:
+    """
+    Run many /ask turns concurrently; yields each result as soon as its conversation's turns are saved
+    (completion order; `index` points back into `items`).
+    """
+    started = time.time()
+    groups = _groups(items)
+    existing = [g for g in groups if g.cid]
+    try:
+        docs = get_conversations([g.cid for g in existing]) if existing else []
+    except Exception as e:
+        for g in groups:
+            for index in g.indexes:
+                yield _error(index, e)
+        return
+    for g, conv in zip(existing, docs):
+        g.conv = conv
+        g.base_meta = copy.deepcopy(conv["meta"]) if conv else {}
+    metrics.incr("batch_items", len(items))
+
+    pending: Set[Future] = {_pool.submit(_run_group, g) for g in groups}
+    try:
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            finished = [f.result() for f in done]
+            _save(finished, started)
+            for g in finished:
+                for index in g.indexes:
+                    yield g.results[index]
+    finally:
+        if pending:  # client went away: don't start new turns, but keep the ones already paid for
+            running = [f for f in pending if not f.cancel()]
+            _save([f.result() for f in running], started)
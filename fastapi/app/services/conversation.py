@@ -1,17 +1,21 @@
 from __future__ import annotations
 
 import json
+import time
 import uuid
-from typing import List, Optional
+from typing import List, Optional, Tuple
 
 from app.models import ChatMessage, Stance
 from app.config import (
     MAX_HISTORY_PAIRS,
-    redis_client,
+    ALIGN_FLAG_TTL,
     PROFILE_CMD,
     SENTINEL_EMPTY_CIDS,
 )
 from .llm import LLMClient
+from .deadline import check_deadline
+from .storage import cid_key, get_store
+from . import personas
 from .classifier import IntentLayer, UserStanceDetector
 from app.services.intent import IntentLayer
 
@@ -30,19 +34,101 @@ def normalize_cid(cid: Optional[str]) -> Optional[str]:
     return None if c in SENTINEL_EMPTY_CIDS else c
 
 
-def _key(cid: str) -> str:
-    return f"conv:{cid}"
+def get_conversation(cid: str, readonly: bool = False) -> Optional[dict]:
+    """Load conversation JSON from the shard that owns `cid` (a replica when `readonly`)."""
+    # Not started once the budget is spent; a started call is bounded by REDIS_SOCKET_TIMEOUT, not the budget.
+    check_deadline("redis get")
+    raw = get_store().get(cid, readonly=readonly)
+    return json.loads(raw) if raw else None
 
 
-def get_conversation(cid: str) -> Optional[dict]:
-    """Load conversation JSON from Redis."""
-    raw = redis_client.get(_key(cid))
-    return json.loads(raw) if raw else None
+class ConversationConflict(RuntimeError):
+    """Someone else saved `cid` after we loaded it (stored version != the one our turn started from)."""
+
+    def __init__(self, cid: str, expected: int, current: int):
+        super().__init__(f"conversation {cid} changed concurrently (expected v{expected}, found v{current})")
+        self.cid = cid
+        self.expected = expected
+        self.current = current
+
+
+def get_conversations(cids: List[str]) -> List[Optional[dict]]:
+    """get_conversation for many cids with one pipelined round trip per shard."""
+    check_deadline("redis get")
+    return [json.loads(raw) if raw else None for raw in get_store().get_many(cids)]
+
+
+def _stamped(conv: dict) -> Tuple[str, int]:
+    now = time.time()
+    meta = conv.setdefault("meta", {})
+    meta.setdefault("created_at", now)
+    meta["updated_at"] = now
+    expected = int(conv.get("version") or 0)
+    return json.dumps({**conv, "version": expected + 1}), expected
+
+
+def save_conversation(cid: str, conv: dict) -> int:
+    """
+    Compare-and-set save on the owning shard's primary: succeeds only if the stored version is still
+    conv["version"] (0 for new conversations), then bumps it. Raises ConversationConflict otherwise.
+    """
+    check_deadline("redis set")
+    raw, expected = _stamped(conv)
+    saved, current = get_store().cas(cid, raw, expected)
+    if not saved:
+        raise ConversationConflict(cid, expected, current)
+    conv["version"] = expected + 1
+    return conv["version"]
+
+
+def save_conversations(items: List[Tuple[str, dict]]) -> List[Optional[ConversationConflict]]:
+    """save_conversation for many (cid, conv) pairs, pipelined per shard; a conflict per item instead of raising."""
+    check_deadline("redis set")
+    prepared = [(cid, *_stamped(conv)) for cid, conv in items]
+    out: List[Optional[ConversationConflict]] = []
+    for (cid, conv), (saved, current), (_, _, expected) in zip(items, get_store().cas_many(prepared), prepared):
+        if saved:
+            conv["version"] = expected + 1
+            out.append(None)
+        else:
+            out.append(ConversationConflict(cid, expected, current))
+    return out
+
+
+def merge_turn(latest: dict, ours: dict, base_meta: dict, new_messages: List[dict],
+               max_messages: Optional[int] = None) -> dict:
+    """
+    Rebase a turn computed on an older state onto `latest`: append our new messages and re-apply the meta
+    keys our turn changed (relative to `base_meta`). The result carries latest's version for the next CAS.
+    """
+    meta = dict(latest.get("meta") or {})
+    for k, v in (ours.get("meta") or {}).items():
+        if base_meta.get(k) != v:
+            meta[k] = v
+    messages = list(latest.get("messages") or []) + list(new_messages)
+    if max_messages:
+        messages = messages[-max_messages:]
+    return {**latest, "meta": meta, "messages": messages, "version": int(latest.get("version") or 0)}
+
+
+def record_misalignment(cid: str, label: str) -> None:
+    """Flag a reply the background alignment check found off-stance; the next turn reinforces the stance."""
+    try:
+        get_store().client_for(cid).set(cid_key("align", cid), label, ex=ALIGN_FLAG_TTL)
+    except Exception:
+        pass
 
 
-def save_conversation(cid: str, conv: dict) -> None:
-    """Persist conversation JSON in Redis."""
-    redis_client.set(_key(cid), json.dumps(conv))
+def pop_misalignment(cid: str) -> Optional[str]:
+    """Return and clear a pending misalignment flag (None if the last reply was fine or unchecked)."""
+    try:
+        client = get_store().client_for(cid)
+        raw = client.get(cid_key("align", cid))
+        if raw:
+            client.delete(cid_key("align", cid))
+        return raw or None
+    except Exception:
+        return None
 
 
 def last_n(messages: List[ChatMessage], n: int = 5) -> List[ChatMessage]:
@@ -92,7 +178,7 @@ def topic_change_requested(user_text: str) -> bool:
     Determine if the user is requesting a topic change.
     Uses the IntentLayer (LLM) — no regex.
     """
-    label = IntentLayer(LLMClient()).classify(user_text, current_topic="(current)")
+    label = IntentLayer(LLMClient.for_task("intent")).classify(user_text, current_topic="(current)")
     return label == "NEW_TOPIC"
 
 
@@ -101,7 +187,7 @@ def detect_user_agreement(user_text: str) -> bool:
     Lightweight LLM check: does the user agree / want to end the debate?
     If YES, endpoints marks user_aligned=True.
     """
-    llm = LLMClient()
+    llm = LLMClient.for_task("agree")
     sys = ChatMessage(
         role="system",
         message=(
@@ -117,28 +203,13 @@ def detect_user_agreement(user_text: str) -> bool:
 class DebateContextLayer:
     """Builds the system prompt for the debate chatbot (English)."""
 
-    def build_system(self, topic: str, bot_stance: "Stance", profile_addendum: str = "") -> ChatMessage:
-        stance_txt = "PRO" if bot_stance == "pro" else "CON"
-        text = f"""
-You are a DEBATE chatbot. Your role is to hold a {stance_txt} stance on: "{topic}".
-
-RULES:
-1) Keep the initial stance consistently; do not switch sides mid-conversation.
-2) Structure: short thesis, 2–4 reasons (bullets), short conclusion. Avoid fallacies.
-3) Stay on topic. If the user wants a different topic, ask them to start a new conversation.
-4) Be direct (about 180–220 words).
-5) If the user wants to end, reply that they agree with you and close the conversation.
-6) If the user asks factual questions, answer insofar as it reinforces your stance.
-
-Suggested format:
-- Stance: (pro / con / neutral)
-- Short thesis
-- Reasons
-- Short closing
-""".strip()
+    def build_system(self, topic: str, bot_stance: "Stance", profile_addendum: str = "",
+                     profile_id: Optional[str] = None) -> ChatMessage:
+        """Cached per (profile, stance, topic) by the persona registry; an addendum makes a one-off copy."""
+        system = personas.system_message(profile_id, bot_stance, topic)
         if profile_addendum:
-            text += "\n\n" + profile_addendum
-        return ChatMessage(role="system", message=text)
+            return ChatMessage(role="system", message=f"{system.message}\n\n{profile_addendum}")
+        return system
 
 
 class ConversationLayer:
@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+from app.config import DEADLINE_MIN_STAGE_SECONDS
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when a stage cannot finish inside the request budget."""
+
+
+class Deadline:
+    """Absolute per-request budget; every stage asks it how much time is left."""
+
+    __slots__ = ("budget", "expires_at")
+
+    def __init__(self, budget: float):
+        self.budget = float(budget)
+        self.expires_at = time.monotonic() + self.budget
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0.0
+
+    def timeout(self, cap: Optional[float], stage: str = "", floor: float = DEADLINE_MIN_STAGE_SECONDS) -> float:
+        """
+        Timeout for the next stage: the smaller of `cap` and the remaining budget.
+        Raises DeadlineExceeded if less than `floor` seconds remain (the stage could not finish anyway).
+        """
+        left = self.remaining()
+        if left < floor:
+            raise DeadlineExceeded(f"deadline exceeded before {stage or 'stage'} ({self.budget:.1f}s budget)")
+        if not cap or cap <= 0:
+            return left if left != float("inf") else cap
+        return min(cap, left)
+
+
+_current: ContextVar[Optional[Deadline]] = ContextVar("request_deadline", default=None)
+
+
+def current_deadline() -> Optional[Deadline]:
+    return _current.get()
+
+
+@contextmanager
+def deadline_scope(budget: float) -> Iterator[Deadline]:
+    """Install a request deadline for the current context (no-op budget if <= 0)."""
+    dl = Deadline(budget if budget and budget > 0 else float("inf"))
+    token = _current.set(dl)
+    try:
+        yield dl
+    finally:
+        _current.reset(token)
+
+
+def stage_timeout(cap: Optional[float], stage: str = "") -> Optional[float]:
+    """`cap` bounded by the current deadline; `cap` unchanged when no deadline is active."""
+    dl = _current.get()
+    if dl is None:
+        return cap
+    return dl.timeout(cap, stage)
+
+
+def check_deadline(stage: str = "") -> None:
+    """Cancel a stage up front when the request budget is already spent."""
+    dl = _current.get()
+    if dl is not None:
+        dl.timeout(None, stage)
+
+
+def sleep_within_deadline(delay: float) -> bool:
+    """Sleep `delay` seconds if the budget still leaves room for another attempt afterwards."""
+    dl = _current.get()
+    if dl is not None and dl.remaining() - delay < DEADLINE_MIN_STAGE_SECONDS:
+        return False
+    time.sleep(max(0.0, delay))
+    return True
@@ -0,0 +1,161 @@
+from __future__ import annotations
+
+import json
+import zlib
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from app.config import EXPORT_BATCH
+from app.services import metrics
+from app.services.storage import ConversationStore, cid_from_key, get_store
+
+# Bulk export of conversations: SCAN each shard incrementally (never KEYS), fetch every batch of keys
+# with one pipelined round trip, filter, and yield one JSON line per conversation. Only one batch is
+# held in memory at a time. The cursor "<shard index>-<scan cursor>" marks the next batch to read, so an
+# export can resume after the last completed batch (records of a half-sent batch may repeat).
+
+
+class BadCursor(ValueError):
+    pass
+
+
+@dataclass
+class ExportFilter:
+    profile_id: Optional[str] = None
+    topic: Optional[str] = None        # case-insensitive substring of meta.topic
+    since: Optional[float] = None      # meta.created_at >= since (epoch seconds)
+    until: Optional[float] = None      # meta.created_at < until
+
+    def match(self, conv: dict) -> bool:
+        meta = conv.get("meta") or {}
+        if self.profile_id and meta.get("profile_id") != self.profile_id:
+            return False
+        if self.topic and self.topic.lower() not in (meta.get("topic") or "").lower():
+            return False
+        if self.since is not None or self.until is not None:
+            created = meta.get("created_at")
+            if created is None:
+                return False  # conversations saved before timestamps existed cannot match a date filter
+            if self.since is not None and created < self.since:
+                return False
+            if self.until is not None and created >= self.until:
+                return False
+        return True
+
+
+def parse_date(value: Optional[str]) -> Optional[float]:
+    """'2026-03-01' or a full ISO timestamp (UTC unless it says otherwise) -> epoch seconds."""
+    if not value:
+        return None
+    dt = datetime.fromisoformat(value)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+def encode_cursor(shard: int, cursor: int) -> str:
+    return f"{shard}-{cursor}"
+
+
+def decode_cursor(value: Optional[str]) -> Tuple[int, int]:
+    if not value:
+        return 0, 0
+    try:
+        shard, _, cursor = value.partition("-")
+        return int(shard), int(cursor)
+    except ValueError:
+        raise BadCursor(f"invalid export cursor: {value!r}")
+
+
+def _shards(store: ConversationStore) -> List:
+    # Stable order so a cursor means the same thing on every call; the first replica (not a random one)
+    # serves the whole scan because SCAN cursors are only meaningful on the node that issued them.
+    # Under REDIS_CLUSTER every primary node is scanned with its own connection: a node's keys are
+    # served by that node, so its batch GETs pipeline there too.
+    clients: List = []
+    for _, s in sorted(store.shards.items()):
+        if hasattr(s.primary, "get_primaries"):
+            nodes = sorted(s.primary.get_primaries(), key=lambda n: n.name)
+            clients += [s.primary.get_redis_connection(n) for n in nodes]
+        else:
+            clients.append(s.replicas[0] if s.replicas else s.primary)
+    return clients
+
+
+def iter_batches(flt: ExportFilter, cursor: Optional[str] = None, batch: int = EXPORT_BATCH,
+                 store: Optional[ConversationStore] = None) -> Iterator[Tuple[List[dict], Optional[str]]]:
+    """
+    Yields (matching conversations of one SCAN batch, cursor after that batch); the last cursor is None.
+    Each record is the stored document plus "conversation_id".
+    The cursor is checked against the shard layout right away (BadCursor), not on the first next(),
+    so an HTTP caller can still answer 400 before streaming starts.
+    """
+    clients = _shards(store or get_store())
+    shard, pos = decode_cursor(cursor)
+    if shard >= len(clients) and cursor:
+        raise BadCursor(f"export cursor {cursor!r} does not match the current shard layout")
+    return _batches(flt, clients, shard, pos, batch)
+
+
+def _batches(flt: ExportFilter, clients: List, shard: int, pos: int,
+             batch: int) -> Iterator[Tuple[List[dict], Optional[str]]]:
+    while shard < len(clients):
+        client = clients[shard]
+        pos, keys = client.scan(cursor=pos, match="conv:*", count=batch)
+        keys = [k.decode("utf-8") if isinstance(k, bytes) else k for k in keys]
+        records: List[dict] = []
+        if keys:
+            pipe = client.pipeline(transaction=False)
+            for k in keys:
+                pipe.get(k)
+            for key, raw in zip(keys, pipe.execute()):
+                cid = cid_from_key(key)
+                if not raw or not cid:
+                    continue
+                try:
+                    conv = json.loads(raw)
+                except ValueError:
+                    metrics.incr("export_skipped", reason="bad_json")
+                    continue
+                if flt.match(conv):
+                    records.append({"conversation_id": cid, **conv})
+        pos = int(pos)
+        if pos == 0:
+            shard += 1
+        yield records, encode_cursor(shard, pos) if shard < len(clients) else None
+
+
+def iter_ndjson(flt: ExportFilter, cursor: Optional[str] = None, limit: Optional[int] = None,
+                batch: int = EXPORT_BATCH, trailer: bool = True) -> Iterator[bytes]:
+    """
+    NDJSON lines. With `limit`, stops after the batch that reaches it. With `trailer`, the last line is
+    {"next_cursor": ...} (null once every shard has been walked) so callers can resume.
+    Like iter_batches, raises BadCursor on the call itself.
+    """
+    return _ndjson(iter_batches(flt, cursor, batch), cursor, limit, trailer)
+
+
+def _ndjson(batches: Iterator[Tuple[List[dict], Optional[str]]], cursor: Optional[str], limit: Optional[int],
+            trailer: bool) -> Iterator[bytes]:
+    sent = 0
+    next_cursor = cursor
+    for records, next_cursor in batches:
+        if records:
+            yield "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records).encode("utf-8")
+            sent += len(records)
+            metrics.incr("export_records", len(records))
+        if limit and sent >= limit:
+            break
+    if trailer:
+        yield (json.dumps({"next_cursor": next_cursor}) + "\n").encode("utf-8")
+
+
+def gzip_stream(chunks: Iterable[bytes], level: int = 6) -> Iterator[bytes]:
+    """Compress a byte stream on the fly (gzip container), one chunk at a time."""
+    z = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        out = z.compress(chunk)
+        if out:
+            yield out
+    yield z.flush()
@@ -1,27 +1,160 @@
-import json
-import requests
-from typing import List, Tuple, Dict
+import re
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple, Dict
 from app.config import (
-    MODEL_NAME, OLLAMA_BASE_URL, HTTP_TIMEOUT_SECONDS, KEEP_ALIVE
+    HTTP_TIMEOUT_SECONDS, REPLY_CHAR_LIMIT, GUARD_VERIFY_WORKERS, TASKS, LLM_MOCK,
 )
-from app.models import ChatMessage
-from app.services.llm import call_llm
+from app.models import AlignmentVerdict, ChatMessage, Stance
+from app.services.llm import LLMClient
+from app.services import mock_llm, usage, warmup
+from app.services.deadline import DeadlineExceeded, stage_timeout
+from app.services.ollama import get_ollama, record_stats
+from app.services.structured import StructuredOutputError, json_schema, parse_structured
+
+_REFUSAL_TERMS = (
+    "i cannot", "i can't", "i cant", "i will not", "i won't", "cannot provide", "cannot assist",
+    "i am unable", "as an ai", "i refuse", "cannot help with", "i cannot provide information",
+)
+_NEUTRAL_TERMS = ("both sides", "on the one hand", "neutral")
+
+# One pass over the text finds any trigger; the named group tells which family matched.
+_MATCHER = re.compile(
+    "(?P<refusal>{})|(?P<neutral>{})".format(
+        "|".join(re.escape(t) for t in sorted(_REFUSAL_TERMS, key=len, reverse=True)),
+        "|".join(re.escape(t) for t in sorted(_NEUTRAL_TERMS, key=len, reverse=True)),
+    ),
+    re.IGNORECASE,
+)
+_MAX_TERM_LEN = max(len(t) for t in _REFUSAL_TERMS + _NEUTRAL_TERMS)
+_STOPWORDS = {"the", "a", "an", "is", "are", "of", "to", "in", "on", "and", "or", "should", "be", "it", "that"}
+_HEAD_CHARS = 400
+
+_verify_pool = ThreadPoolExecutor(max_workers=GUARD_VERIFY_WORKERS, thread_name_prefix="guard-verify")
+
+
+def _norm(s: str) -> str:
+    return s.replace("’", "'")
+
+
+def _topic_keywords(topic: str) -> List[str]:
+    words = [w.strip(".,;:!?\"'()").lower() for w in (topic or "").split()]
+    return [w for w in words if len(w) > 2 and w not in _STOPWORDS]
+
+
+def scan_triggers(s: str) -> Optional[str]:
+    """Return 'refusal' | 'neutral' for the first trigger found, else None."""
+    m = _MATCHER.search(_norm(s or ""))
+    return m.lastgroup if m else None
+
 
 def detect_refusal_text(s: str) -> bool:
     if not s: return False
-    low = s.lower()
-    triggers = ["i cannot","i can't","i cant","i will not","i won't","cannot provide","cannot assist",
-                "i am unable","as an ai","i refuse","cannot help with","i cannot provide information"]
-    return any(t in low for t in triggers)
+    return any(m.lastgroup == "refusal" for m in _MATCHER.finditer(_norm(s)))
+
 
 def looks_off_topic_or_flip(reply: str, topic: str) -> bool:
-    r = (reply or "").lower()
-    if detect_refusal_text(r): return True
-    if "both sides" in r or "on the one hand" in r or "neutral" in r: return True
-    head = r[:400]; key = topic.lower().split()
-    if key and not any(k in head for k in key[:3]): return True
+    if scan_triggers(reply): return True
+    head = (reply or "").lower()[:_HEAD_CHARS]; key = _topic_keywords(topic)
+    if key and not any(k in head for k in key): return True
     return False
 
+
+class StreamGuard:
+    """
+    Incremental guard over a token stream. Each token is scanned together with a short tail of the
+    previous text, so triggers split across tokens are still caught without rescanning the whole reply.
+    """
+
+    def __init__(self, topic: str, char_limit: int = REPLY_CHAR_LIMIT):
+        self.keywords = _topic_keywords(topic)
+        self.char_limit = char_limit
+        self.signal: Optional[str] = None
+        self._parts: List[str] = []
+        self._size = 0
+        self._tail = ""
+
+    def feed(self, token: str) -> Optional[str]:
+        """Consume one token; returns 'refusal' | 'neutral' as soon as a trigger completes."""
+        self._parts.append(token)
+        self._size += len(token)
+        window = self._tail + _norm(token)
+        m = _MATCHER.search(window)
+        if m:
+            self.signal = m.lastgroup
+            return self.signal
+        self._tail = window[-(_MAX_TERM_LEN - 1):]
+        return None
+
+    @property
+    def full(self) -> bool:
+        return bool(self.char_limit and self.char_limit > 0 and self._size >= self.char_limit)
+
+    def text(self) -> str:
+        return "".join(self._parts)
+
+    def verdict(self) -> str:
+        """
+        'refusal' | 'neutral' when a trigger fired; otherwise 'ok' if the opening mentions the topic,
+        'unsure' when the cheap heuristics cannot tell (only then is the LLM check worth paying for).
+        """
+        if self.signal:
+            return self.signal
+        if not self.keywords:
+            return "ok"
+        head = self.text()[:_HEAD_CHARS].lower()
+        return "ok" if any(k in head for k in self.keywords) else "unsure"
+
+
+def _stance_type(stance: Stance) -> str:
+    return "affirmative" if stance == "pro" else "negative"
+
+
+def _rewrite_instruction(topic: str, stance_type: str) -> str:
+    req = "SUPPORT" if stance_type=="affirmative" else "OPPOSE"
+    return (
+        f"Your previous draft contradicted the required stance. REQUIRED: {req} the proposition '{topic}'.\n"
+        "Rewrite a FINAL persuasive answer NOW. No refusals, no neutrality, no safety disclaimers. "
+        "Follow exactly the structure: (1) thesis, (2) 2–3 reasons with evidence/examples or HYPOTHESIS, "
+        "(3) limited concession that you immediately rebut, (4) closing inviting the user to reconsider.\n"
+        "Serious tone only. 200–250 words."
+    )
+
+
+def guarded_generate(llm: LLMClient, messages: List[ChatMessage], topic: str, stance: Stance,
+                     on_token: Optional[Callable[[str], None]] = None,
+                     on_reset: Optional[Callable[[], None]] = None) -> Tuple[str, str]:
+    """
+    Stream the reply through a StreamGuard. On a refusal/neutral signal the stream is closed
+    (aborting generation) and the rewrite starts immediately with the hard stance instruction.
+    Tokens are forwarded to `on_token`; `on_reset` fires before the rewrite replaces them.
+    Returns (text, verdict) where verdict is 'ok' | 'unsure' | 'rewritten'.
+    """
+    guard = StreamGuard(topic)
+    stream = llm.stream_chat(messages)
+    try:
+        for token in stream:
+            if guard.feed(token):
+                break
+            if on_token:
+                on_token(token)
+            if guard.full:
+                break
+    finally:
+        stream.close()
+
+    if not guard.signal:
+        return guard.text(), guard.verdict()
+
+    system = messages[0] if messages and messages[0].role == "system" else ChatMessage(role="system", message="")
+    hard = ChatMessage(role="system", message=f"{system.message}\n\n{_rewrite_instruction(topic, _stance_type(stance))}")
+    rewritten = llm.chat([hard] + [m for m in messages if m is not system], max_tokens=320)
+    if on_reset:
+        on_reset()
+    if on_token:
+        on_token(rewritten)
+    return rewritten, "rewritten"
+
+
 def verify_alignment_via_llm(topic: str, stance_type: str, reply: str) -> Tuple[bool, str]:
     """Devuelve (is_aligned, label) label ∈ {'supports','opposes','neutral_or_mixed','unknown'}"""
     instruction = (
@@ -30,51 +163,67 @@ def verify_alignment_via_llm(topic: str, stance_type: str, reply: str) -> Tuple[
         "where 'alignment' describes the REPLY relative to proposition P.\n"
         "No explanations. JSON only."
     )
-    payload = {
-        "model": MODEL_NAME,
-        "prompt": f"{instruction}\n\nP: {topic}\nREPLY:\n{reply}\n\nJSON:",
-        "stream": False, "keep_alive": KEEP_ALIVE,
-        "options": {"temperature": 0.0, "top_p": 1.0, "num_predict": 80},
-    }
+    cfg = TASKS["guard"]
+    prompt = f"{instruction}\n\nP: {topic}\nREPLY:\n{reply}\n\nJSON:"
+    options = {"temperature": cfg["temperature"], "top_p": 1.0,
+               "num_predict": cfg["num_predict"] or 80, "num_ctx": cfg["num_ctx"]}
     try:
-        r = requests.post(f"{OLLAMA_BASE_URL}/api/generate", json=payload, timeout=HTTP_TIMEOUT_SECONDS)
-        r.raise_for_status(); raw = (r.json().get("response") or "").strip()
-        i, j = raw.find("{"), raw.rfind("}")
-        label = "unknown"
-        if i!=-1 and j!=-1:
-            obj = json.loads(raw[i:j+1]); label = str(obj.get("alignment","unknown")).lower()
+        if LLM_MOCK:
+            raw, stats = mock_llm.generate(prompt), {}
+        else:
+            raw, stats = get_ollama().generate(cfg["model"], prompt, options=options, keep_alive=cfg["keep_alive"],
+                                               fmt=json_schema(AlignmentVerdict),
+                                               timeout=stage_timeout(HTTP_TIMEOUT_SECONDS, "alignment check"))
+        record_stats(stats, cfg["model"], "guard")
+        if LLM_MOCK:
+            usage.record("guard", "mock/" + cfg["model"], "mock", (len(prompt) + 3) // 4, (len(raw) + 3) // 4)
+        else:
+            usage.record("guard", cfg["model"], "ollama", stats.get("prompt_eval_count", 0), stats.get("eval_count", 0))
+            warmup.note_use(cfg["model"])
+        try:
+            label = parse_structured(raw, AlignmentVerdict).alignment
+        except StructuredOutputError:
+            label = "unknown"
         expected = "supports" if stance_type=="affirmative" else "opposes"
         return (label == expected), label
+    except DeadlineExceeded:
+        raise
     except Exception:
         return (True, "unknown")
 
+
+def verify_alignment_async(topic: str, stance_type: str, reply: str,
+                           on_result: Optional[Callable[[bool, str], None]] = None) -> Future:
+    """Run the LLM alignment check off the request path; `on_result(is_aligned, label)` fires when done."""
+    scope = usage.current_scope() or (None, None)  # the pool thread does not see the turn's context
+
+    def _run() -> Tuple[bool, str]:
+        with usage.usage_scope(*scope):
+            ok, label = verify_alignment_via_llm(topic, stance_type, reply)
+        if on_result:
+            try:
+                on_result(ok, label)
+            except Exception:
+                pass
+        return ok, label
+    return _verify_pool.submit(_run)
+
+
 def force_rewrite_for_alignment(system_prompt: str, history: List[ChatMessage], user_msg: str,
                                 profile: Dict, topic: str, stance_type: str) -> str:
-    req = "SUPPORT" if stance_type=="affirmative" else "OPPOSE"
-    hard_prompt = (
-        f"{system_prompt}\n\n"
-        f"Your previous draft contradicted the required stance. REQUIRED: {req} the proposition '{topic}'.\n"
-        "Rewrite a FINAL persuasive answer NOW. No refusals, no neutrality, no safety disclaimers. "
-        "Follow exactly the structure: (1) thesis, (2) 2–3 reasons with evidence/examples or HYPOTHESIS, "
-        "(3) limited concession that you immediately rebut, (4) closing inviting the user to reconsider.\n"
-        "Serious tone only. 200–250 words.\n"
-        f"User just said: {user_msg}\n"
-        "Assistant:"
-    )
-    return call_llm(hard_prompt, history, user_msg, profile, num_predict_override=200)
+    hard = ChatMessage(role="system", message=f"{system_prompt}\n\n{_rewrite_instruction(topic, stance_type)}")
+    return LLMClient.for_task("reply").chat([hard] + history + [ChatMessage(role="user", message=user_msg)], max_tokens=320)
 
 def revise_if_needed(reply: str, system_prompt: str, history: List[ChatMessage],
                      user_msg: str, profile: Dict, topic: str) -> str:
     if not looks_off_topic_or_flip(reply, topic): return reply
-    correction_prompt = (
+    correction = ChatMessage(role="system", message=(
         f"{system_prompt}\n\n"
         "Your previous reply was neutral, off-topic, or contained refusal/safety disclaimers.\n"
         "Rewrite it to PERSUADE for your SIDE with a SERIOUS tone. "
-        "Follow the exact structure and keep 200–250 words.\n"
-        f"User just said: {user_msg}\nAssistant:"
-    )
-    fixed = call_llm(correction_prompt, history, user_msg, profile, num_predict_override=200)
-    return fixed
+        "Follow the exact structure and keep 200–250 words."
+    ))
+    return LLMClient.for_task("reply").chat([correction] + history + [ChatMessage(role="user", message=user_msg)], max_tokens=320)
 
 def maybe_append_invite_on_agreement(reply: str) -> str:
     invite = " If you'd like, we can switch to another topic—just say the word."
@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import time
+import uuid
+from typing import Callable, Optional, Tuple
+
+from app.config import IDEMPOTENCY_TTL, IDEMPOTENCY_LOCK_TTL, IDEMPOTENCY_WAIT, redis_client
+from app.services import metrics
+
+_POLL_SECONDS = 0.1
+
+# (status_code, JSON body) of a finished request, as stored and replayed.
+Stored = Tuple[int, dict]
+
+
+class IdempotencyKeyReused(ValueError):
+    """Same Idempotency-Key sent with a different request body."""
+
+
+class IdempotencyInProgress(RuntimeError):
+    """The original request is still running and did not finish within IDEMPOTENCY_WAIT."""
+
+
+def _key(scope: str, idem_key: str) -> str:
+    h = hashlib.sha256(idem_key.encode("utf-8")).hexdigest()[:32]
+    return f"idem:{scope}:{h}"
+
+
+def run_once(scope: str, idem_key: str, fingerprint: str, fn: Callable[[], Stored]) -> Tuple[Stored, bool]:
+    """
+    Run `fn` at most once per (scope, Idempotency-Key) within IDEMPOTENCY_TTL. Returns (stored, replayed).
+    The first request writes an in-progress marker, runs `fn` and stores its response; duplicates wait for
+    that response (up to IDEMPOTENCY_WAIT) or replay the stored one without running `fn`.
+    Errors are not stored: the marker is dropped so a retry runs again. Redis trouble fails open.
+    """
+    key = _key(scope, idem_key)
+    pending = json.dumps({"state": "pending", "fp": fingerprint, "token": uuid.uuid4().hex})
+    try:
+        owner = bool(redis_client.set(key, pending, nx=True, px=int(IDEMPOTENCY_LOCK_TTL * 1000)))
+    except Exception:
+        return fn(), False
+
+    if not owner:
+        stored = _await(key, fingerprint)
+        if stored is not None:
+            metrics.incr("idempotent_replays", scope=scope)
+            return stored, True
+        return run_once(scope, idem_key, fingerprint, fn)  # original gave up (error/expired): take over
+
+    try:
+        status, body = fn()
+    except BaseException:
+        _release(key, pending)
+        raise
+    try:
+        redis_client.set(key, json.dumps({"state": "done", "fp": fingerprint, "status": status, "body": body}),
+                         ex=IDEMPOTENCY_TTL)
+    except Exception:
+        pass
+    return (status, body), False
+
+
+def _await(key: str, fingerprint: str) -> Optional[Stored]:
+    """Stored response for `key`; None if the marker vanished (original failed) so the caller may run."""
+    until = time.monotonic() + IDEMPOTENCY_WAIT
+    while True:
+        raw = redis_client.get(key)
+        if raw is None:
+            return None
+        rec = json.loads(raw)
+        if rec.get("fp") != fingerprint:
+            raise IdempotencyKeyReused("Idempotency-Key was already used with a different request")
+        if rec.get("state") == "done":
+            return int(rec["status"]), rec["body"]
+        if time.monotonic() >= until:
+            raise IdempotencyInProgress("a request with this Idempotency-Key is still in progress")
+        time.sleep(_POLL_SECONDS)
+
+
+def _release(key: str, pending: str) -> None:
+    # Only the owner writes this key while it is pending, so get + delete cannot drop someone else's marker
+    # (short of the marker expiring in between, which IDEMPOTENCY_LOCK_TTL makes far longer than a request).
+    try:
+        if redis_client.get(key) == pending:
+            redis_client.delete(key)
+    except Exception:
+        pass
@@ -1,19 +1,18 @@
 # app/services/intent.py
 from typing import Optional
 from app.services.llm import LLMClient
-from app.models import ChatMessage
-from app.config import LLM_MODEL
+from app.models import ChatMessage, IntentLabel
+from app.services.deadline import DeadlineExceeded
 
-_ALLOWED = {"topic_change", "continue_topic", "greeting", "chit_chat", "unsafe"}
 
 class IntentLayer:
     """
     Simple intent classifier that uses the LLM.
     Accepts an optional LLMClient (dependency injection). If none is provided, a default one is created.
-    Never raises: it always returns a valid label from _ALLOWED.
+    Never raises: it always returns a valid IntentLabel.label.
     """
     def __init__(self, llm: Optional[LLMClient] = None):
-        self.llm = llm or LLMClient(model=LLM_MODEL)
+        self.llm = llm or LLMClient.for_task("intent")
 
     def classify(self, text: str, current_topic: Optional[str] = None) -> str:
         system = ChatMessage(
@@ -22,7 +21,7 @@ class IntentLayer:
                 "You are an intent classifier.\n"
                 "Valid labels: topic_change, continue_topic, greeting, chit_chat, unsafe.\n"
                 "Pick the single best label for the user's message given the current topic context.\n"
-                "Respond with the label only — lowercase, no punctuation, no extra words."
+                'Respond with JSON only: {"label": "<label>"}.'
             ),
         )
         user = ChatMessage(
@@ -34,13 +33,9 @@ class IntentLayer:
             ),
         )
         try:
-            out = (self.llm.chat([system, user], max_tokens=8) or "").strip().lower()
-            out = out.replace(".", "").replace("`", "").strip()
-            if out in _ALLOWED:
-                return out
-            for lbl in _ALLOWED:
-                if lbl in out:
-                    return lbl
+            return self.llm.chat_json([system, user], IntentLabel, max_tokens=16).label
+        except DeadlineExceeded:
+            raise
         except Exception:
             pass
         return "continue_topic"
@@ -0,0 +1,241 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import threading
+import time
+import uuid
+from typing import AsyncIterator, Dict, Optional
+
+import redis
+from starlette.concurrency import run_in_threadpool
+
+from app.config import (
+    ASK_DEADLINE_SECONDS, JOB_STREAM as _JOB_STREAM, JOB_GROUP, JOB_MAX_ATTEMPTS, JOB_RESULT_TTL, JOB_STREAM_MAXLEN,
+    JOB_CLAIM_IDLE, LLM_BACKOFF_BASE, LLM_BACKOFF_CAP, REDIS_CLUSTER, REDIS_HASH_TAGS, REDIS_SOCKET_TIMEOUT,
+    redis_client,
+)
+from app.models import AskResponse, JobResponse
+from app.services import metrics
+from app.services.deadline import deadline_scope
+from app.services.turns import ConversationNotFound, ask_turn
+
+log = logging.getLogger(__name__)
+
+# Under Redis Cluster the stream and its delayed ZSET must share a slot (_PROMOTE touches both): hash tag.
+JOB_STREAM = (f"{{{_JOB_STREAM}}}" if (REDIS_CLUSTER or REDIS_HASH_TAGS) and "{" not in _JOB_STREAM
+              else _JOB_STREAM)
+DEAD_STREAM = f"{JOB_STREAM}:dead"
+DELAYED_KEY = f"{JOB_STREAM}:delayed"   # ZSET entry fields (JSON) -> due time of a retry
+TERMINAL = ("done", "failed")
+_POLL_SECONDS = 0.1
+_POLL_MAX_SECONDS = 0.5
+_HEARTBEAT_SECONDS = 10.0
+
+
+def _job_key(job_id: str) -> str:
+    return f"job:{job_id}"
+
+
+def _to_response(job_id: str, data: Dict[str, str]) -> JobResponse:
+    result = data.get("result")
+    return JobResponse(
+        job_id=job_id,
+        status=data.get("status", "queued"),
+        conversation_id=data.get("cid") or None,
+        attempts=int(data.get("attempts") or 0),
+        result=AskResponse.model_validate_json(result) if result else None,
+        error=data.get("error") or None,
+    )
+
+
+# ---------- API side ----------
+
+def enqueue_ask(cid: str, message: str, new: bool) -> JobResponse:
+    """Queue one /ask turn; the conversation id is assigned up front so clients can poll /meta too."""
+    job_id = uuid.uuid4().hex
+    key = _job_key(job_id)
+    pipe = redis_client.pipeline()
+    pipe.hset(key, mapping={"status": "queued", "cid": cid, "attempts": 0, "created_at": time.time()})
+    pipe.expire(key, JOB_RESULT_TTL)
+    pipe.xadd(JOB_STREAM, {"job_id": job_id, "cid": cid, "message": message, "new": "1" if new else "0"},
+              maxlen=JOB_STREAM_MAXLEN, approximate=True)
+    pipe.execute()
+    metrics.incr("jobs_enqueued")
+    return JobResponse(job_id=job_id, status="queued", conversation_id=cid)
+
+
+def get_job(job_id: str) -> Optional[JobResponse]:
+    data = redis_client.hgetall(_job_key(job_id))
+    return _to_response(job_id, data) if data else None
+
+
+async def watch_job(job_id: str, timeout: float) -> AsyncIterator[Optional[JobResponse]]:
+    """
+    Yield the job each time its status changes until it finishes or `timeout` passes.
+    Yields None every _HEARTBEAT_SECONDS without changes (SSE keep-alive).
+    Waits on the event loop (asyncio.sleep): a watcher holds no threadpool slot between its short reads.
+    """
+    until = time.monotonic() + timeout
+    last_status, last_emit, delay = None, time.monotonic(), _POLL_SECONDS
+    while True:
+        job = await run_in_threadpool(get_job, job_id)
+        if job is None:
+            return
+        now = time.monotonic()
+        if job.status != last_status:
+            last_status, last_emit, delay = job.status, now, _POLL_SECONDS
+            yield job
+            if job.status in TERMINAL:
+                return
+        elif now - last_emit >= _HEARTBEAT_SECONDS:
+            last_emit = now
+            yield None
+        if now >= until:
+            return
+        await asyncio.sleep(min(delay, max(0.0, until - now)))
+        delay = min(delay * 2, _POLL_MAX_SECONDS)
+
+
+async def wait_job(job_id: str, timeout: float) -> Optional[JobResponse]:
+    """Long-poll: the job once finished, or its current state when `timeout` runs out."""
+    job = None
+    async for event in watch_job(job_id, timeout):
+        job = event or job
+    if job is None or job.status not in TERMINAL:
+        job = await run_in_threadpool(get_job, job_id)
+    return job
+
+
+# Move due retries back onto the stream: ZREM and XADD in one step, so exactly one worker re-queues each.
+_PROMOTE = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+for _, raw in ipairs(due) do
+  redis.call('ZREM', KEYS[1], raw)
+  local args = {}
+  for k, v in pairs(cjson.decode(raw)) do
+    table.insert(args, k)
+    table.insert(args, v)
+  end
+  redis.call('XADD', KEYS[2], 'MAXLEN', '~', ARGV[3], '*', unpack(args))
+end
+return #due
+"""
+
+
+# ---------- worker side ----------
+
+class JobWorker:
+    """
+    One consumer of the JOB_STREAM consumer group. Entries are acked only after the job hash holds
+    the result (or the job is dead-lettered), so a crashed worker's entries are reclaimed by others
+    after JOB_CLAIM_IDLE seconds. Failed turns are re-queued with backoff up to JOB_MAX_ATTEMPTS: the
+    retry waits in DELAYED_KEY (not in a sleeping consumer) until any worker promotes it.
+    """
+
+    def __init__(self, consumer: str, client=None):
+        self.consumer = consumer
+        self.r = client or redis_client
+        # Stay under the socket timeout so a blocking read never looks like a dead connection.
+        self.block_ms = max(100, int(min(5.0, REDIS_SOCKET_TIMEOUT / 2) * 1000))
+        self._last_claim = 0.0
+
+    def ensure_group(self) -> None:
+        try:
+            self.r.xgroup_create(JOB_STREAM, JOB_GROUP, id="0", mkstream=True)
+        except redis.ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    def run(self, stop: threading.Event) -> None:
+        self.ensure_group()
+        while not stop.is_set():
+            try:
+                self.step()
+            except redis.RedisError as e:
+                log.warning("job worker %s: redis error: %s", self.consumer, e)
+                stop.wait(1.0)
+
+    def step(self) -> int:
+        """Re-queue due retries, handle reclaimed stale entries, then block briefly for one new entry."""
+        self._promote_due()
+        entries = self._reclaim()
+        if not entries:
+            resp = self.r.xreadgroup(JOB_GROUP, self.consumer, {JOB_STREAM: ">"}, count=1, block=self.block_ms)
+            entries = resp[0][1] if resp else []
+        for entry_id, fields in entries:
+            self.handle(entry_id, fields)
+        return len(entries)
+
+    def _promote_due(self) -> int:
+        n = int(self.r.eval(_PROMOTE, 2, DELAYED_KEY, JOB_STREAM, time.time(), 10, JOB_STREAM_MAXLEN) or 0)
+        if n:
+            metrics.incr("jobs_promoted", n)
+        return n
+
+    def _reclaim(self):
+        now = time.monotonic()
+        if now - self._last_claim < JOB_CLAIM_IDLE / 2:
+            return []
+        self._last_claim = now
+        res = self.r.xautoclaim(JOB_STREAM, JOB_GROUP, self.consumer,
+                                min_idle_time=int(JOB_CLAIM_IDLE * 1000), start_id="0-0", count=10)
+        entries = [e for e in (res[1] if res else []) if e and e[1]]
+        if entries:
+            metrics.incr("jobs_reclaimed", len(entries))
+        return entries
+
+    def handle(self, entry_id: str, fields: Dict[str, str]) -> None:
+        job_id = fields.get("job_id", "")
+        key = _job_key(job_id)
+        attempts = int(self.r.hincrby(key, "attempts", 1))
+        if attempts > JOB_MAX_ATTEMPTS:
+            self._dead_letter(entry_id, fields, "max attempts exceeded")
+            return
+        self.r.hset(key, mapping={"status": "running", "worker": self.consumer})
+
+        started = time.time()
+        try:
+            with deadline_scope(ASK_DEADLINE_SECONDS):
+                resp = ask_turn(fields.get("cid") or None, fields.get("message", ""), started,
+                                new=fields.get("new") == "1")
+        except ConversationNotFound:
+            self._dead_letter(entry_id, fields, "conversation_id not found")
+            return
+        except Exception as e:
+            if attempts >= JOB_MAX_ATTEMPTS:
+                self._dead_letter(entry_id, fields, str(e) or type(e).__name__)
+            else:
+                self._retry(entry_id, fields, attempts, str(e) or type(e).__name__)
+            return
+
+        pipe = self.r.pipeline()
+        pipe.hset(key, mapping={"status": "done", "result": resp.model_dump_json(), "error": ""})
+        pipe.expire(key, JOB_RESULT_TTL)
+        pipe.xack(JOB_STREAM, JOB_GROUP, entry_id)
+        pipe.execute()
+        metrics.incr("jobs_done")
+        metrics.observe("job_run_seconds", time.time() - started)
+
+    def _retry(self, entry_id: str, fields: Dict[str, str], attempts: int, error: str) -> None:
+        """Schedule the job again after the backoff and free this consumer right away."""
+        due = time.time() + min(LLM_BACKOFF_CAP, LLM_BACKOFF_BASE * (2 ** (attempts - 1)))
+        pipe = self.r.pipeline()
+        pipe.hset(_job_key(fields.get("job_id", "")), mapping={"status": "retrying", "error": error, "retry_at": due})
+        pipe.zadd(DELAYED_KEY, {json.dumps(fields, sort_keys=True): due})
+        pipe.xack(JOB_STREAM, JOB_GROUP, entry_id)
+        pipe.execute()
+        metrics.incr("jobs_retried")
+
+    def _dead_letter(self, entry_id: str, fields: Dict[str, str], error: str) -> None:
+        key = _job_key(fields.get("job_id", ""))
+        pipe = self.r.pipeline()
+        pipe.hset(key, mapping={"status": "failed", "error": error})
+        pipe.expire(key, JOB_RESULT_TTL)
+        pipe.xadd(DEAD_STREAM, {**fields, "error": error, "failed_at": str(time.time())},
+                  maxlen=JOB_STREAM_MAXLEN, approximate=True)
+        pipe.xack(JOB_STREAM, JOB_GROUP, entry_id)
+        pipe.execute()
+        metrics.incr("jobs_dead_lettered")
+        log.warning("job %s dead-lettered: %s", fields.get("job_id"), error)
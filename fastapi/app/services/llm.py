@@ -1,18 +1,46 @@
-from typing import List, Optional
+from contextlib import closing, contextmanager
+from typing import Callable, Iterator, List, Optional, Tuple, Type
 import os
+import random
+import sys
+import threading
+import time
+import httpx
 import requests
-import litellm
-from litellm.exceptions import APIConnectionError, APIError, RateLimitError, NotFoundError
 
 from app.config import (
-    LLM_MODEL, LLM_BASE_URL, LLM_TEMPERATURE, LLM_TIMEOUT,
+    LLM_MODEL, OLLAMA_API_BASE, OLLAMA_NATIVE, LLM_TEMPERATURE, LLM_TIMEOUT,
+    LLM_MAX_RETRIES, LLM_BACKOFF_BASE, LLM_BACKOFF_CAP, LLM_PROVIDER_CONCURRENCY,
     OPENAI_MODEL, OPENAI_BASE_URL, OPENAI_API_KEY, PROVIDER_PREFERENCE,
-    REPLY_CHAR_LIMIT, MAX_OUTPUT_TOKENS,
+    REPLY_CHAR_LIMIT, MAX_OUTPUT_TOKENS, STRICT_ALIGN, TASKS, SINGLEFLIGHT_ENABLED, LLM_MOCK,
 )
+from pydantic import BaseModel
+
 from app.models import ChatMessage, ModelReply, Stance
+from app.services.deadline import DeadlineExceeded, check_deadline, stage_timeout, sleep_within_deadline
+from app.services import metrics, mock_llm, personas, usage, warmup
+from app.services.ollama import OllamaError, get_ollama, record_stats
+from app.services.structured import T, json_schema, openai_response_format, parse_structured
+from app.services.singleflight import request_key, singleflight
+
+_litellm = None
+
 
-if (OPENAI_API_KEY or "").strip():
-    litellm.api_key = OPENAI_API_KEY.strip()
+def _get_litellm():
+    """LiteLLM takes seconds to import: load it on the first non-native completion, not at app import."""
+    global _litellm
+    if _litellm is None:
+        import litellm
+        if (OPENAI_API_KEY or "").strip():
+            litellm.api_key = OPENAI_API_KEY.strip()
+        _litellm = litellm
+    return _litellm
+
+
+def _is_litellm_error(exc: Exception, names: Tuple[str, ...]) -> bool:
+    """isinstance against litellm exception classes without importing litellm (if it isn't loaded, exc can't be one)."""
+    mod = sys.modules.get("litellm.exceptions")
+    return mod is not None and isinstance(exc, tuple(getattr(mod, n) for n in names if hasattr(mod, n)))
 
 
 def _provider_from_model(model: str) -> str:
@@ -31,7 +59,7 @@ def _normalized_openai_base() -> str:
 def _api_base_for(model: str) -> Optional[str]:
     prov = _provider_from_model(model)
     if prov == "ollama":
-        return (LLM_BASE_URL or "").strip() or None
+        return (OLLAMA_API_BASE or "").strip() or None
     if prov == "openai":
         return _normalized_openai_base()
     return None
@@ -39,57 +67,244 @@ def _api_base_for(model: str) -> Optional[str]:
 
 def _ollama_up() -> bool:
     """Ping mínimo para saber si Ollama está reachable, evitando que LiteLLM lance excepción."""
-    base = (LLM_BASE_URL or "").strip()
+    base = (OLLAMA_API_BASE or "").strip()
     if not base:
         return False
     try:
-        r = requests.get(f"{base.rstrip('/')}/api/tags", timeout=0.8)
+        r = requests.get(f"{base.rstrip('/')}/api/tags", timeout=stage_timeout(0.8, "ollama ping"))
         r.raise_for_status()
         return True
+    except DeadlineExceeded:
+        raise
     except Exception:
         return False
 
 
-def _extract_text(resp) -> str:
+class ProviderBusy(TimeoutError):
+    """No free LLM_PROVIDER_CONCURRENCY slot for the provider within the call's timeout."""
+
+
+_slots = {p: threading.BoundedSemaphore(n) for p, n in LLM_PROVIDER_CONCURRENCY.items()}
+
+
+@contextmanager
+def provider_slot(model: str, timeout: float):
+    provider = _provider_from_model(model)
+    sem = _slots.get(provider)
+    if sem is None:
+        yield
+        return
+    t0 = time.perf_counter()
+    if not sem.acquire(timeout=max(0.0, timeout)):
+        metrics.incr("llm_provider_busy", provider=provider)
+        raise ProviderBusy(f"{provider}: all {LLM_PROVIDER_CONCURRENCY[provider]} slots busy")
+    metrics.observe("llm_slot_wait_seconds", time.perf_counter() - t0, provider=provider)
+    try:
+        yield
+    finally:
+        sem.release()
+
+
+_RETRYABLE = (
+    requests.ConnectionError, requests.Timeout, httpx.TransportError, ConnectionError, TimeoutError,
+)
+_LITELLM_RETRYABLE = ("APIConnectionError", "RateLimitError", "ServiceUnavailableError", "InternalServerError")
+
+
+def _is_retryable(exc: Exception) -> bool:
+    """Errores transitorios (conexión, timeout, rate limit, 5xx) se reintentan; el resto es fatal para ese modelo."""
+    if isinstance(exc, DeadlineExceeded):
+        return False
+    if isinstance(exc, OllamaError):
+        return exc.retryable
+    return isinstance(exc, _RETRYABLE) or _is_litellm_error(exc, _LITELLM_RETRYABLE)
+
+
+def _backoff_delay(attempt: int, exc: Exception) -> float:
+    """Full-jitter exponential backoff; rate limits start from a larger base."""
+    base = LLM_BACKOFF_BASE * (4 if _is_litellm_error(exc, ("RateLimitError",)) else 1)
+    return random.uniform(0, min(LLM_BACKOFF_CAP, base * (2 ** attempt)))
+
+
+def _extract_text(resp, truncate: bool = True) -> str:
     try:
         text = resp.choices[0].message["content"]
     except Exception:
         text = getattr(resp, "choices", [{}])[0].get("message", {}).get("content", "") or ""
-    if REPLY_CHAR_LIMIT and REPLY_CHAR_LIMIT > 0:
+    if truncate and REPLY_CHAR_LIMIT and REPLY_CHAR_LIMIT > 0:
         text = text[:REPLY_CHAR_LIMIT]
     return text
 
 
+def _usage_of(resp) -> Tuple[int, int]:
+    """(prompt_tokens, completion_tokens) from a LiteLLM response/final stream chunk; (0, 0) if absent."""
+    usage = getattr(resp, "usage", None)
+    if usage is None and isinstance(resp, dict):
+        usage = resp.get("usage")
+    if not usage:
+        return 0, 0
+    get = usage.get if isinstance(usage, dict) else lambda k: getattr(usage, k, 0)
+    return int(get("prompt_tokens") or 0), int(get("completion_tokens") or 0)
+
+
+def _approx_tokens(text: str) -> int:
+    return (len(text) + 3) // 4
+
+
 class LLMClient:
-    def __init__(self, model: str = LLM_MODEL, temperature: float = LLM_TEMPERATURE, timeout: float = LLM_TIMEOUT):
+    def __init__(self, model: str = LLM_MODEL, temperature: float = LLM_TEMPERATURE, timeout: float = LLM_TIMEOUT,
+                 task: str = "default", fallback_model: Optional[str] = None, providers: Optional[str] = None,
+                 keep_alive: Optional[str] = None, num_ctx: Optional[int] = None, num_predict: Optional[int] = None):
         self.model = model
         self.temperature = temperature
         self.timeout = timeout
+        self.task = task
+        self.fallback_model = (fallback_model or OPENAI_MODEL or "gpt-4o-mini").strip()
+        self.providers = providers or PROVIDER_PREFERENCE
+        self.keep_alive = keep_alive
+        self.num_ctx = num_ctx
+        self.num_predict = num_predict
+        self.last_stats: dict = {}
+        self.last_usage: Tuple[int, int] = (0, 0)
+
+    @classmethod
+    def for_task(cls, task: str, timeout: float = LLM_TIMEOUT) -> "LLMClient":
+        """Client configured from TASKS[task] (model, provider order, keep_alive, num_ctx, num_predict)."""
+        cfg = TASKS.get(task) or TASKS["reply"]
+        return cls(
+            model=cfg["model"], temperature=cfg["temperature"], timeout=timeout, task=task,
+            fallback_model=cfg["fallback_model"], providers=cfg["providers"],
+            keep_alive=cfg["keep_alive"], num_ctx=cfg["num_ctx"], num_predict=cfg["num_predict"],
+        )
 
-    def _try_completion(self, model: str, messages: List[ChatMessage], max_tokens: Optional[int]) -> str:
+    def _completion_kwargs(self, model: str, messages: List[ChatMessage], max_tokens: Optional[int],
+                           timeout: Optional[float], schema: Optional[Type[BaseModel]] = None) -> dict:
         payload = [{"role": m.role, "content": m.message} for m in messages]
         kwargs = dict(
             model=model,
             messages=payload,
             temperature=self.temperature,
-            timeout=self.timeout,
+            timeout=timeout or self.timeout,
         )
         if max_tokens is not None:
             kwargs["max_tokens"] = max_tokens
+        elif self.num_predict:
+            kwargs["max_tokens"] = self.num_predict
         elif MAX_OUTPUT_TOKENS and MAX_OUTPUT_TOKENS > 0:
             kwargs["max_tokens"] = MAX_OUTPUT_TOKENS
 
+        if _provider_from_model(model) == "ollama":
+            if self.keep_alive:
+                kwargs["keep_alive"] = self.keep_alive
+            if self.num_ctx:
+                kwargs["num_ctx"] = self.num_ctx
+
+        if schema is not None:
+            if _provider_from_model(model) == "ollama":
+                kwargs["format"] = json_schema(schema)
+            else:
+                kwargs["response_format"] = openai_response_format(schema)
+
         api_base = _api_base_for(model)
         if api_base:
-            kwargs["api_base"] = api_base 
+            kwargs["api_base"] = api_base
+        return kwargs
+
+    def _native(self, model: str) -> bool:
+        return OLLAMA_NATIVE and _provider_from_model(model) == "ollama"
+
+    def _ollama_args(self, messages: List[ChatMessage], max_tokens: Optional[int]) -> dict:
+        num_predict = max_tokens if max_tokens is not None else (self.num_predict or MAX_OUTPUT_TOKENS or None)
+        return dict(
+            messages=[{"role": m.role, "content": m.message} for m in messages],
+            options={"temperature": self.temperature, "num_predict": num_predict, "num_ctx": self.num_ctx},
+            keep_alive=self.keep_alive,
+        )
+
+    def _try_completion(self, model: str, messages: List[ChatMessage], max_tokens: Optional[int],
+                        timeout: Optional[float] = None, schema: Optional[Type[BaseModel]] = None) -> str:
+        self.last_usage = (0, 0)
+        if _provider_from_model(model) == "mock":
+            text = mock_llm.complete(messages, schema)
+            self.last_usage = (sum(_approx_tokens(m.message) for m in messages), _approx_tokens(text))
+            return text
+        if self._native(model):
+            text, stats = get_ollama().chat(model, timeout=timeout or self.timeout,
+                                            fmt=json_schema(schema) if schema is not None else None,
+                                            **self._ollama_args(messages, max_tokens))
+            self.last_stats = stats
+            self.last_usage = (stats.get("prompt_eval_count", 0), stats.get("eval_count", 0))
+            record_stats(stats, model, self.task)
+            return text[:REPLY_CHAR_LIMIT] if schema is None and REPLY_CHAR_LIMIT and REPLY_CHAR_LIMIT > 0 else text
+        resp = _get_litellm().completion(**self._completion_kwargs(model, messages, max_tokens, timeout, schema))
+        self.last_usage = _usage_of(resp)
+        return _extract_text(resp, truncate=schema is None)
+
+    def _try_stream(self, model: str, messages: List[ChatMessage], max_tokens: Optional[int],
+                    timeout: Optional[float] = None) -> Iterator[str]:
+        self.last_usage = (0, 0)
+        if _provider_from_model(model) == "mock":
+            out = 0
+            for piece in mock_llm.stream(messages):
+                out += len(piece)
+                yield piece
+            self.last_usage = (sum(_approx_tokens(m.message) for m in messages), (out + 3) // 4)
+            return
+        if self._native(model):
+            stats: dict = {}
+            stream = get_ollama().stream_chat(model, timeout=timeout or self.timeout, stats_out=stats,
+                                              **self._ollama_args(messages, max_tokens))
+            with closing(stream):
+                for piece in stream:
+                    check_deadline(f"llm stream:{model}")
+                    yield piece
+            self.last_stats = stats
+            self.last_usage = (stats.get("prompt_eval_count", 0), stats.get("eval_count", 0))
+            record_stats(stats, model, self.task)
+            return
+        kwargs = self._completion_kwargs(model, messages, max_tokens, timeout)
+        if _provider_from_model(model) != "ollama":
+            kwargs["stream_options"] = {"include_usage": True}  # OpenAI sends usage in a final, empty chunk
+        resp = _get_litellm().completion(stream=True, **kwargs)
+        try:
+            for chunk in resp:
+                check_deadline(f"llm stream:{model}")
+                if getattr(chunk, "usage", None):
+                    self.last_usage = _usage_of(chunk)
+                try:
+                    piece = chunk.choices[0].delta.content or ""
+                except Exception:
+                    piece = ""
+                if piece:
+                    yield piece
+        finally:
+            close = getattr(resp, "close", None)
+            if callable(close):
+                close()
 
-        resp = litellm.completion(**kwargs)
-        return _extract_text(resp)
+    def _observe(self, model: str, t0: float, outcome: str) -> None:
+        provider = _provider_from_model(model)
+        metrics.observe("llm_call_seconds", time.perf_counter() - t0,
+                        task=self.task, model=model, provider=provider, outcome=outcome)
+        if outcome == "ok" or any(self.last_usage):
+            usage.record(self.task, model, provider, *self.last_usage)
+        if outcome == "ok" and provider == "ollama":
+            warmup.note_use(model)
 
-    def chat(self, messages: List[ChatMessage], max_tokens: Optional[int] = None) -> str:
-        pref = (PROVIDER_PREFERENCE or "").lower()
+    def _bill_partial(self, messages: List[ChatMessage], out_chars: int) -> None:
+        """
+        A stream cut short (guard abort, deadline, broken connection) never gets the provider's usage
+        chunk, but the prompt and the tokens streamed so far were still spent: estimate them.
+        """
+        if not any(self.last_usage):
+            self.last_usage = (sum(_approx_tokens(m.message) for m in messages), (out_chars + 3) // 4)
+
+    def _provider_order(self) -> List[str]:
+        if LLM_MOCK:
+            return [f"mock/{self.model}"]
+        pref = (self.providers or "").lower()
         primary = self.model
-        secondary = (OPENAI_MODEL or "gpt-4o-mini").strip()
+        secondary = self.fallback_model
 
         if pref == "openai_first":
             order = [secondary, primary]
@@ -112,36 +327,137 @@ class LLMClient:
 
         if not filtered_order:
             raise RuntimeError("No hay proveedores LLM disponibles (Ollama no reachable y/o falta OPENAI_API_KEY).")
+        return filtered_order
+
+    def chat(self, messages: List[ChatMessage], max_tokens: Optional[int] = None,
+             schema: Optional[Type[BaseModel]] = None) -> str:
+        """
+        Texto de la primera respuesta exitosa; con `schema` se pide salida JSON restringida a ese modelo.
+        Llamadas deterministas (temperature 0) idénticas y concurrentes comparten una sola petición al proveedor.
+        """
+        if SINGLEFLIGHT_ENABLED and self.temperature == 0:
+            key = request_key(
+                model=self.model, fallback=self.fallback_model, providers=self.providers,
+                messages=[(m.role, m.message) for m in messages], max_tokens=max_tokens,
+                num_predict=self.num_predict, num_ctx=self.num_ctx,
+                schema=schema.__name__ if schema is not None else None,
+            )
+            return singleflight.do(key, lambda: self._chat(messages, max_tokens, schema))
+        return self._chat(messages, max_tokens, schema)
 
+    def _chat(self, messages: List[ChatMessage], max_tokens: Optional[int],
+              schema: Optional[Type[BaseModel]]) -> str:
         last_exc: Optional[Exception] = None
-        for model in filtered_order:
-            try:
-                return self._try_completion(model, messages, max_tokens)
-            except (APIConnectionError, APIError, RateLimitError, NotFoundError, Exception) as e:
-                last_exc = e
-                continue
+        for model in self._provider_order():
+            for attempt in range(LLM_MAX_RETRIES + 1):
+                timeout = stage_timeout(self.timeout, f"llm:{model}")
+                t0 = time.perf_counter()
+                try:
+                    with provider_slot(model, timeout or self.timeout):
+                        text = self._try_completion(model, messages, max_tokens, timeout=timeout, schema=schema)
+                    self._observe(model, t0, "ok")
+                    return text
+                except DeadlineExceeded:
+                    raise
+                except Exception as e:
+                    self._observe(model, t0, "error")
+                    last_exc = e
+                    if not _is_retryable(e) or attempt >= LLM_MAX_RETRIES:
+                        break
+                    if not sleep_within_deadline(_backoff_delay(attempt, e)):
+                        break
+
+        if last_exc:
+            raise last_exc
+        raise RuntimeError("No provider available for completion")
+
+    def chat_json(self, messages: List[ChatMessage], schema: Type[T], max_tokens: Optional[int] = None) -> T:
+        """
+        Structured output: Ollama `format` / OpenAI `response_format` with the schema, validated into `schema`.
+        Malformed output gets one local repair pass (StructuredOutputError if that fails), never another LLM call.
+        """
+        return parse_structured(self.chat(messages, max_tokens=max_tokens, schema=schema), schema)
+
+    def stream_chat(self, messages: List[ChatMessage], max_tokens: Optional[int] = None) -> Iterator[str]:
+        """
+        Igual que chat() pero entrega los tokens a medida que llegan.
+        Reintentos y fallback solo aplican antes del primer token; cerrar el generador aborta la generación.
+        """
+        last_exc: Optional[Exception] = None
+        for model in self._provider_order():
+            for attempt in range(LLM_MAX_RETRIES + 1):
+                timeout = stage_timeout(self.timeout, f"llm:{model}")
+                t0 = time.perf_counter()
+                started, out_chars = False, 0
+                try:
+                    with provider_slot(model, timeout or self.timeout), \
+                            closing(self._try_stream(model, messages, max_tokens, timeout=timeout)) as stream:
+                        for piece in stream:
+                            if not started:
+                                metrics.observe("llm_first_token_seconds", time.perf_counter() - t0,
+                                                task=self.task, model=model)
+                            started = True
+                            out_chars += len(piece)
+                            yield piece
+                    self._observe(model, t0, "ok")
+                    return
+                except GeneratorExit:
+                    self._bill_partial(messages, out_chars)
+                    self._observe(model, t0, "aborted")
+                    raise
+                except DeadlineExceeded:
+                    self._bill_partial(messages, out_chars)
+                    self._observe(model, t0, "deadline")
+                    raise
+                except Exception as e:
+                    if started:
+                        self._bill_partial(messages, out_chars)
+                    self._observe(model, t0, "error")
+                    if started:
+                        raise
+                    last_exc = e
+                    if not _is_retryable(e) or attempt >= LLM_MAX_RETRIES:
+                        break
+                    if not sleep_within_deadline(_backoff_delay(attempt, e)):
+                        break
 
         if last_exc:
             raise last_exc
         raise RuntimeError("No provider available for completion")
 
 
-def generate_reply(history: List[ChatMessage], user_text: str, stance_hint: Stance) -> ModelReply:
-    stance_upper = "PRO" if stance_hint == "pro" else "CON"
-    system = ChatMessage(
-        role="system",
-        message=(
-            f"You are a DEBATE chatbot. Hold a {stance_upper} stance on the current topic under discussion.\n"
-            "Rules:\n"
-            "1) Keep your stance consistently; do not switch sides.\n"
-            "2) Structure: short thesis, 2–4 reasons (bullets), short conclusion. Avoid fallacies.\n"
-            "3) Stay on topic. If the user wants a different topic, ask them to start a new conversation.\n"
-            "4) Be direct (about 180–220 words)."
-        ),
-    )
+def generate_reply(history: List[ChatMessage], user_text: str, stance_hint: Stance,
+                   topic: Optional[str] = None, reinforce: bool = False,
+                   on_token: Optional[Callable[[str], None]] = None,
+                   on_reset: Optional[Callable[[], None]] = None,
+                   profile_id: Optional[str] = None) -> ModelReply:
+    """
+    Debate reply in the voice of persona `profile_id` (cached system prompt and sampling style from the
+    profile registry). With a `topic` (and STRICT_ALIGN) the reply is streamed through the guard engine,
+    which aborts early on refusal/neutral drift and rewrites right away.
+    `reinforce` adds a stance reminder after a previous reply was flagged as misaligned.
+    `on_token`/`on_reset` let callers forward the stream (reset = discard tokens sent so far).
+    """
+    system = personas.system_message(profile_id, stance_hint, topic, reinforce)
     trimmed = history[-10:] if len(history) > 10 else history
     messages = [system] + trimmed + [ChatMessage(role="user", message=user_text)]
 
-    llm = LLMClient()
-    reply_text = llm.chat(messages)
-    return ModelReply(stance=stance_hint, reply=reply_text[: (REPLY_CHAR_LIMIT or 10_000)])
+    llm = LLMClient.for_task("reply")
+    style = (personas.get_profile(profile_id) or {}).get("style") or {}
+    if style.get("temperature") is not None:
+        llm.temperature = float(style["temperature"])
+    if style.get("num_predict"):
+        llm.num_predict = int(style["num_predict"])
+    verdict: Optional[str] = None
+    if topic and STRICT_ALIGN:
+        from app.services.guards import guarded_generate
+        reply_text, verdict = guarded_generate(llm, messages, topic, stance_hint, on_token=on_token, on_reset=on_reset)
+    elif on_token:
+        parts: List[str] = []
+        for piece in llm.stream_chat(messages):
+            parts.append(piece)
+            on_token(piece)
+        reply_text = "".join(parts)
+    else:
+        reply_text = llm.chat(messages)
+    return ModelReply(stance=stance_hint, reply=reply_text[: (REPLY_CHAR_LIMIT or 10_000)], guard_verdict=verdict)
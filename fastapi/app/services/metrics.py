@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+import threading
+from collections import deque
+from typing import Deque, Dict, Tuple
+
+# Per-process counters and latency reservoirs; cheap enough to call on every LLM/Redis stage.
+_RESERVOIR = 512
+
+_lock = threading.Lock()
+_counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+_timings: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], Tuple[int, float, Deque[float]]] = {}
+
+
+def _key(name: str, labels: Dict[str, object]) -> Tuple[str, Tuple[Tuple[str, str], ...]]:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+
+def incr(name: str, value: float = 1, **labels) -> None:
+    k = _key(name, labels)
+    with _lock:
+        _counters[k] = _counters.get(k, 0) + value
+
+
+def observe(name: str, seconds: float, **labels) -> None:
+    """Record one duration sample (seconds) for `name` with the given labels."""
+    k = _key(name, labels)
+    with _lock:
+        count, total, samples = _timings.get(k) or (0, 0.0, deque(maxlen=_RESERVOIR))
+        samples.append(seconds)
+        _timings[k] = (count + 1, total + seconds, samples)
+
+
+def _pct(sorted_vals, q: float) -> float:
+    if not sorted_vals:
+        return 0.0
+    idx = min(len(sorted_vals) - 1, int(round(q * (len(sorted_vals) - 1))))
+    return sorted_vals[idx]
+
+
+def counter_total(name: str, **labels) -> float:
+    """Sum of a counter over every label set that includes `labels`."""
+    want = {k: str(v) for k, v in labels.items()}
+    with _lock:
+        return sum(v for (n, lbl), v in _counters.items()
+                   if n == name and all(dict(lbl).get(k) == val for k, val in want.items()))
+
+
+def snapshot() -> dict:
+    """JSON-friendly view: counters and latency summaries (ms) per metric/label set."""
+    with _lock:
+        counters = [{"name": n, "labels": dict(lbl), "value": v} for (n, lbl), v in _counters.items()]
+        timings = []
+        for (n, lbl), (count, total, samples) in _timings.items():
+            vals = sorted(samples)
+            timings.append({
+                "name": n,
+                "labels": dict(lbl),
+                "count": count,
+                "avg_ms": round(total / count * 1000, 1) if count else 0.0,
+                "p50_ms": round(_pct(vals, 0.50) * 1000, 1),
+                "p95_ms": round(_pct(vals, 0.95) * 1000, 1),
+                "max_ms": round(vals[-1] * 1000, 1) if vals else 0.0,
+            })
+    return {"counters": counters, "timings": timings}
+
+
+def reset() -> None:
+    with _lock:
+        _counters.clear()
+        _timings.clear()
@@ -0,0 +1,73 @@
+from __future__ import annotations
+
+import re
+import time
+from typing import Iterator, List, Optional, Type
+
+from pydantic import BaseModel
+
+from app.config import LLM_MOCK_LATENCY
+from app.models import AlignmentVerdict, ChatMessage, IntentLabel, TopicSide
+
+# Deterministic offline provider (LLM_MOCK=1): schema-valid, stance-consistent canned answers so the
+# whole pipeline (classifier, intent, agreement, reply, guards) runs without Ollama or OpenAI.
+
+_NEGATIVE = re.compile(r"\b(not|no|never|against|disagree|shouldn't|isn't|aren't|don't)\b", re.IGNORECASE)
+_AGREE = re.compile(r"\b(i agree|you're right|you are right|fair point|i give up|bye)\b", re.IGNORECASE)
+_STREAM_CHUNK = 24
+
+
+def _pause() -> None:
+    if LLM_MOCK_LATENCY > 0:
+        time.sleep(LLM_MOCK_LATENCY)
+
+
+def _first_user(messages: List[ChatMessage]) -> str:
+    return next((m.message for m in messages if m.role == "user"), "")
+
+
+def _topic_of(text: str) -> str:
+    words = re.sub(r"^\s*/profile\s+\S+\s*", "", text or "").split()
+    return " ".join(words[:12]).strip(" .!?") or "General debate topic"
+
+
+def _reply(messages: List[ChatMessage]) -> str:
+    system = messages[0].message if messages and messages[0].role == "system" else ""
+    support = "CON stance" not in system and "OPPOSE the proposition" not in system
+    topic = _topic_of(_first_user(messages))
+    verb = "support" if support else "oppose"
+    return (
+        f"I {verb} the proposition: {topic}. "
+        f"- First, the evidence points my way. - Second, the practical consequences favour my side. "
+        f"In short, I firmly {verb} it; reconsider your position."
+    )
+
+
+def complete(messages: List[ChatMessage], schema: Optional[Type[BaseModel]] = None) -> str:
+    _pause()
+    system = messages[0].message if messages else ""
+    last = messages[-1].message if messages else ""
+    if schema is TopicSide:
+        side = "negative" if _NEGATIVE.search(last) else "affirmative"
+        return TopicSide(topic=_topic_of(last), user_side=side).model_dump_json()
+    if schema is IntentLabel:
+        return IntentLabel(label="continue_topic").model_dump_json()
+    if schema is AlignmentVerdict:
+        return generate(last)
+    if "YES or NO" in system:
+        return "YES" if _AGREE.search(last) else "NO"
+    return _reply(messages)
+
+
+def stream(messages: List[ChatMessage]) -> Iterator[str]:
+    text = complete(messages)
+    for i in range(0, len(text), _STREAM_CHUNK):
+        yield text[i:i + _STREAM_CHUNK]
+
+
+def generate(prompt: str) -> str:
+    """Alignment check stand-in: reads the verb of a mock reply."""
+    _pause()
+    reply = prompt.split("REPLY:", 1)[-1].lower()
+    label = "opposes" if "i oppose" in reply else "supports" if "i support" in reply else "neutral_or_mixed"
+    return AlignmentVerdict(alignment=label).model_dump_json()
@@ -0,0 +1,166 @@
+from __future__ import annotations
+
+import json
+import threading
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import httpx
+
+from app.config import (
+    OLLAMA_API_BASE, OLLAMA_MAX_CONNECTIONS, OLLAMA_MAX_KEEPALIVE, HTTP_TIMEOUT_SECONDS,
+)
+from app.services import metrics
+
+# Ollama reports durations in nanoseconds; these are surfaced as metrics (seconds).
+_DURATIONS = ("total_duration", "load_duration", "prompt_eval_duration", "eval_duration")
+_COUNTS = ("prompt_eval_count", "eval_count")
+
+
+class OllamaError(RuntimeError):
+    """HTTP-level error from Ollama; 429/5xx are retryable, 4xx (e.g. model not found) are not."""
+
+    def __init__(self, status_code: int, message: str):
+        super().__init__(f"ollama {status_code}: {message}")
+        self.status_code = status_code
+        self.retryable = status_code == 429 or status_code >= 500
+
+
+def ollama_model_name(model: str) -> str:
+    """'ollama/llama3.2:1b' -> 'llama3.2:1b'."""
+    return model.split("/", 1)[1] if model.startswith("ollama/") else model
+
+
+def _stats(body: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: body[k] for k in _DURATIONS + _COUNTS if k in body}
+
+
+def record_stats(stats: Dict[str, Any], model: str, task: str = "default") -> None:
+    for k in _DURATIONS:
+        if k in stats:
+            metrics.observe(f"ollama_{k.replace('_duration', '')}_seconds", stats[k] / 1e9, task=task, model=model)
+    for k in _COUNTS:
+        if k in stats:
+            metrics.incr(f"ollama_{k}", stats[k], task=task, model=model)
+
+
+class OllamaClient:
+    """
+    Native client for Ollama's /api/chat and /api/generate over a pooled httpx connection.
+    Exposes Ollama-only knobs (keep_alive, options.num_ctx, format, context) that LiteLLM hides.
+    """
+
+    def __init__(self, base_url: str = OLLAMA_API_BASE, timeout: float = HTTP_TIMEOUT_SECONDS):
+        self.base_url = (base_url or "").rstrip("/")
+        self._http = httpx.Client(
+            base_url=self.base_url,
+            timeout=timeout,
+            limits=httpx.Limits(
+                max_connections=OLLAMA_MAX_CONNECTIONS,
+                max_keepalive_connections=OLLAMA_MAX_KEEPALIVE,
+                keepalive_expiry=30.0,
+            ),
+        )
+
+    def close(self) -> None:
+        self._http.close()
+
+    @staticmethod
+    def _payload(model: str, messages: List[Dict[str, str]], stream: bool, options: Optional[Dict[str, Any]],
+                 keep_alive: Optional[str], fmt: Optional[Any]) -> Dict[str, Any]:
+        body: Dict[str, Any] = {"model": ollama_model_name(model), "messages": messages, "stream": stream}
+        if options:
+            body["options"] = {k: v for k, v in options.items() if v is not None}
+        if keep_alive:
+            body["keep_alive"] = keep_alive
+        if fmt is not None:
+            body["format"] = fmt
+        return body
+
+    @staticmethod
+    def _raise_for_status(r: httpx.Response) -> None:
+        if r.status_code >= 400:
+            try:
+                detail = r.json().get("error") or r.text
+            except Exception:
+                detail = r.text
+            raise OllamaError(r.status_code, str(detail)[:300])
+
+    def chat(self, model: str, messages: List[Dict[str, str]], *, options: Optional[Dict[str, Any]] = None,
+             keep_alive: Optional[str] = None, fmt: Optional[Any] = None,
+             timeout: Optional[float] = None) -> Tuple[str, Dict[str, Any]]:
+        """Non-streaming /api/chat. Returns (text, stats)."""
+        body = self._payload(model, messages, False, options, keep_alive, fmt)
+        r = self._http.post("/api/chat", json=body, timeout=timeout or httpx.USE_CLIENT_DEFAULT)
+        self._raise_for_status(r)
+        data = r.json()
+        return (data.get("message") or {}).get("content", "") or "", _stats(data)
+
+    def stream_chat(self, model: str, messages: List[Dict[str, str]], *, options: Optional[Dict[str, Any]] = None,
+                    keep_alive: Optional[str] = None, fmt: Optional[Any] = None,
+                    timeout: Optional[float] = None, stats_out: Optional[Dict[str, Any]] = None) -> Iterator[str]:
+        """
+        Streaming /api/chat. Yields content pieces; the final chunk's timing stats land in `stats_out`.
+        Closing the generator closes the HTTP stream, which makes Ollama stop generating.
+        """
+        body = self._payload(model, messages, True, options, keep_alive, fmt)
+        with self._http.stream("POST", "/api/chat", json=body, timeout=timeout or httpx.USE_CLIENT_DEFAULT) as r:
+            if r.status_code >= 400:
+                r.read()
+                self._raise_for_status(r)
+            for line in r.iter_lines():
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                if chunk.get("error"):
+                    raise OllamaError(500, str(chunk["error"]))
+                piece = (chunk.get("message") or {}).get("content") or ""
+                if piece:
+                    yield piece
+                if chunk.get("done"):
+                    if stats_out is not None:
+                        stats_out.update(_stats(chunk))
+                    return
+
+    def generate(self, model: str, prompt: str, *, options: Optional[Dict[str, Any]] = None,
+                 keep_alive: Optional[str] = None, fmt: Optional[Any] = None, context: Optional[List[int]] = None,
+                 timeout: Optional[float] = None) -> Tuple[str, Dict[str, Any]]:
+        """Non-streaming /api/generate. Stats include `context` so callers can reuse the encoded prompt."""
+        body: Dict[str, Any] = {"model": ollama_model_name(model), "prompt": prompt, "stream": False}
+        if options:
+            body["options"] = {k: v for k, v in options.items() if v is not None}
+        if keep_alive:
+            body["keep_alive"] = keep_alive
+        if fmt is not None:
+            body["format"] = fmt
+        if context:
+            body["context"] = context
+        r = self._http.post("/api/generate", json=body, timeout=timeout or httpx.USE_CLIENT_DEFAULT)
+        self._raise_for_status(r)
+        data = r.json()
+        stats = _stats(data)
+        if data.get("context"):
+            stats["context"] = data["context"]
+        return data.get("response", "") or "", stats
+
+
+_client: Optional[OllamaClient] = None
+_client_lock = threading.Lock()
+
+
+def get_ollama() -> OllamaClient:
+    """Process-wide pooled client (created on first use)."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = OllamaClient()
+    return _client
+
+
+def close_ollama() -> None:
+    """Close the pooled client (app shutdown); the next get_ollama() builds a fresh one."""
+    global _client
+    with _client_lock:
+        client, _client = _client, None
+    if client is not None:
+        client.close()
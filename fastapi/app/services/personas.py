@@ -0,0 +1,208 @@
+from __future__ import annotations
+
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from app.config import PROFILE_CACHE_TTL, PROFILE_DEFAULT, PROMPT_CACHE_SIZE, redis_client
+from app.models import ChatMessage, Stance
+from app.profiles import PROFILE
+from app.services import metrics
+
+log = logging.getLogger(__name__)
+
+# Persona registry: the built-in personas of app.profiles plus the ones stored in Redis (which
+# override or extend them, editable through /admin/profiles). Every worker keeps the merged set and
+# the system prompts built from it in memory; a write publishes on _CHANNEL and all workers drop
+# their caches. PROFILE_CACHE_TTL bounds staleness if a message is missed (Redis restart).
+
+PROFILES_KEY = "profiles"            # HASH persona id -> persona JSON
+_CHANNEL = "profiles:changed"
+DEFAULT_PROFILE_ID = PROFILE_DEFAULT
+
+_RULES = (
+    "You are a DEBATE chatbot. Hold a {stance} stance on the current topic under discussion{topic}.\n"
+    "Rules:\n"
+    "1) Keep your stance consistently; do not switch sides.\n"
+    "2) Structure: short thesis, 2–4 reasons (bullets), short conclusion. Avoid fallacies.\n"
+    "3) Stay on topic. If the user wants a different topic, ask them to start a new conversation.\n"
+    "4) Be direct (about 180–220 words)."
+)
+_REINFORCE = "\n5) Your previous reply drifted from your side. Restate your {stance} position firmly."
+
+PromptKey = Tuple[str, Stance, str, bool]
+
+
+class ProfileRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._profiles: Optional[Dict[str, dict]] = None
+        self._loaded_at = 0.0
+        self._generation = 0
+        # (profile, stance, reinforce) -> text (head, tail) around the topic; full key -> finished message
+        self._templates: Dict[Tuple[str, Stance, bool], Tuple[str, str]] = {}
+        self._prompts: "OrderedDict[PromptKey, ChatMessage]" = OrderedDict()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # -- profiles --
+
+    def _load(self) -> Optional[Dict[str, dict]]:
+        merged = {pid: dict(p, source="builtin") for pid, p in PROFILE.items()}
+        try:
+            stored = redis_client.hgetall(PROFILES_KEY) or {}
+        except Exception:
+            return None
+        for pid, raw in stored.items():
+            try:
+                merged[pid] = dict(json.loads(raw), id=pid, source="redis")
+            except ValueError:
+                log.warning("ignoring malformed persona %s", pid)
+        return merged
+
+    def all(self) -> Dict[str, dict]:
+        now = time.time()
+        with self._lock:
+            if self._profiles is not None and now - self._loaded_at < PROFILE_CACHE_TTL:
+                return self._profiles
+            generation, previous = self._generation, self._profiles
+        # Redis down: keep serving the last loaded set (or the built-ins) and retry after the TTL.
+        profiles = self._load() or previous or {pid: dict(p, source="builtin") for pid, p in PROFILE.items()}
+        with self._lock:
+            if generation == self._generation:
+                if self._profiles != profiles:
+                    self._templates.clear()
+                    self._prompts.clear()
+                self._profiles, self._loaded_at = profiles, now
+        return profiles
+
+    def get(self, profile_id: Optional[str]) -> Optional[dict]:
+        return self.all().get(profile_id or "")
+
+    def put(self, profile_id: str, persona: dict) -> dict:
+        stored = {"id": profile_id, "name": persona["name"], "system": persona.get("system", ""),
+                  "style": persona.get("style") or {}}
+        redis_client.hset(PROFILES_KEY, profile_id, json.dumps(stored, ensure_ascii=False))
+        self._publish()
+        return dict(stored, source="redis")
+
+    def delete(self, profile_id: str) -> bool:
+        """Drop a stored persona; a built-in one falls back to its app.profiles definition."""
+        removed = bool(redis_client.hdel(PROFILES_KEY, profile_id))
+        if removed:
+            self._publish()
+        return removed
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._profiles = None
+            self._templates.clear()
+            self._prompts.clear()
+        metrics.incr("profile_cache_invalidations")
+
+    def _publish(self) -> None:
+        self.invalidate()
+        try:
+            redis_client.publish(_CHANNEL, str(time.time()))
+        except Exception:
+            pass
+
+    # -- prompts --
+
+    def system_message(self, profile_id: Optional[str], stance: Stance, topic: Optional[str] = None,
+                       reinforce: bool = False) -> ChatMessage:
+        """
+        Reply system prompt for (profile, stance, topic): persona text + debate rules. Built once per key
+        and then served from an LRU of PROMPT_CACHE_SIZE entries (the same ChatMessage object; don't mutate it).
+        """
+        pid = profile_id if self.get(profile_id) else DEFAULT_PROFILE_ID
+        key: PromptKey = (pid, stance, topic or "", reinforce)
+        with self._lock:
+            msg = self._prompts.get(key)
+            if msg is not None:
+                self._prompts.move_to_end(key)
+                return msg
+        head, tail = self._template(pid, stance, reinforce)
+        msg = ChatMessage(role="system", message=f'{head}: "{topic}"{tail}' if topic else head + tail)
+        with self._lock:
+            self._prompts[key] = msg
+            if len(self._prompts) > PROMPT_CACHE_SIZE:
+                self._prompts.popitem(last=False)
+        metrics.incr("prompt_cache_misses")
+        return msg
+
+    def _template(self, pid: str, stance: Stance, reinforce: bool) -> Tuple[str, str]:
+        with self._lock:
+            tpl = self._templates.get((pid, stance, reinforce))
+        if tpl is not None:
+            return tpl
+        persona = (self.get(pid) or {}).get("system", "")
+        stance_upper = "PRO" if stance == "pro" else "CON"
+        head, tail = _RULES.format(stance=stance_upper, topic="\0").split("\0")
+        if reinforce:
+            tail += _REINFORCE.format(stance=stance_upper)
+        if persona:
+            head = f"{persona}\n\n{head}"
+        with self._lock:
+            self._templates[(pid, stance, reinforce)] = (head, tail)
+        return head, tail
+
+    # -- cross-worker invalidation --
+
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._listen, name="profile-invalidator", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _listen(self) -> None:
+        while not self._stop.is_set():
+            pubsub = None
+            try:
+                pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(_CHANNEL)
+                self.invalidate()  # anything published while we were not subscribed
+                while not self._stop.is_set():
+                    if pubsub.get_message(timeout=1.0):
+                        self.invalidate()
+            except Exception as e:
+                log.warning("profile invalidation listener: %s", e)
+                self._stop.wait(5)
+            finally:
+                if pubsub is not None:
+                    try:
+                        pubsub.close()
+                    except Exception:
+                        pass
+
+
+registry = ProfileRegistry()
+
+
+def get_profile(profile_id: Optional[str]) -> Optional[dict]:
+    return registry.get(profile_id)
+
+
+def list_profiles() -> List[dict]:
+    return list(registry.all().values())
+
+
+def system_message(profile_id: Optional[str], stance: Stance, topic: Optional[str] = None,
+                   reinforce: bool = False) -> ChatMessage:
+    return registry.system_message(profile_id, stance, topic, reinforce)
+
+
+def start_listener() -> None:
+    registry.start()
+
+
+def stop_listener() -> None:
+    registry.stop()
@@ -0,0 +1,257 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+import unicodedata
+import uuid
+from typing import FrozenSet, List, Optional, Tuple
+
+from app.config import (
+    DEFAULT_TOPIC, DEFAULT_SIDE, PREGEN_ENABLED, PREGEN_POOL_SIZE, PREGEN_TOP_TOPICS,
+    PREGEN_MAX_AGE, PREGEN_INTERVAL, PREGEN_MAX_PER_CYCLE, PREGEN_LOCK_TTL, redis_client,
+)
+from app.models import Stance
+from app.services import metrics
+from app.services.personas import list_profiles
+from app.services.storage import release_lock
+
+log = logging.getLogger(__name__)
+
+_TOPICS_KEY = "pregen:topics"      # ZSET topic key -> observed first-turn frequency
+_TEXT_KEY = "pregen:topic_text"    # HASH topic key -> latest wording (what openings are generated for)
+_ACTIVE_KEY = "pregen:active"      # SET of pool keys currently maintained (for eviction)
+_LOCK_KEY = "pregen:refill:lock"   # only the worker holding it refills
+
+# A pooled opening answers the topic, not the user's message: it is served only when the first message
+# adds at most this many content words to the topic ("I think the earth is flat" yes, an argument no).
+_MAX_EXTRA_TERMS = 2
+
+# Rotating angles so the pool holds genuinely different openings, not near-duplicates.
+_ANGLES = (
+    "Lead with the strongest empirical argument.",
+    "Lead with a concrete everyday example.",
+    "Lead with the most common objection and rebut it.",
+    "Lead with the long-term consequences.",
+)
+
+
+_STOPWORDS = frozenset("""
+a an the is are was be been being should would could can will do does did we i you it its of to in on at
+for and or vs versus than that this these those there their about whether my our your me us i'm think
+believe opinion debate topic
+el la los las un una unos unas de del al que es son ser en y o por para se debe deberia con lo su sus
+mi yo creo pienso opino tema debate
+""".split())
+
+
+def _terms(text: str) -> FrozenSet[str]:
+    """Content words, accent/case/plural-insensitive: the classifier words one topic many ways."""
+    t = unicodedata.normalize("NFKD", (text or "").lower()).encode("ascii", "ignore").decode("ascii")
+    words = (w for w in re.findall(r"[a-z0-9']+", t) if w not in _STOPWORDS)
+    return frozenset(w[:-1] if len(w) > 3 and w.endswith("s") and not w.endswith("ss") else w for w in words)
+
+
+def topic_key(topic: str) -> str:
+    """'Is the Earth flat?' and 'The earth is flat.' share a key (sorted content words)."""
+    return " ".join(sorted(_terms(topic)))
+
+
+def _pool_key(profile_id: str, topic: str, stance: Stance) -> str:
+    h = hashlib.sha1(topic_key(topic).encode("utf-8")).hexdigest()[:16]
+    return f"pregen:{profile_id}:{h}:{stance}"
+
+
+def record_topic(topic: str) -> None:
+    """Count a first-turn topic so frequent ones get their own pre-generated openings."""
+    key = topic_key(topic)
+    if not PREGEN_ENABLED or not key:
+        return
+    try:
+        redis_client.zincrby(_TOPICS_KEY, 1, key)
+        redis_client.hset(_TEXT_KEY, key, topic.strip())
+    except Exception:
+        pass
+
+
+def take_opening(profile_id: str, topic: str, stance: Stance, user_text: str = "") -> Optional[str]:
+    """
+    Pop a fresh pre-generated opening for (profile, topic, stance); stale entries are discarded.
+    None (generate instead) when the first message says more than the topic itself.
+    """
+    if not PREGEN_ENABLED or not topic_key(topic):
+        return None
+    if len(_terms(user_text) - _terms(topic)) > _MAX_EXTRA_TERMS:
+        metrics.incr("pregen_skipped", reason="specific_message")
+        return None
+    key = _pool_key(profile_id, topic, stance)
+    now = time.time()
+    try:
+        while True:
+            raw = redis_client.lpop(key)
+            if raw is None:
+                break
+            item = json.loads(raw)
+            if now - float(item.get("ts", 0)) <= PREGEN_MAX_AGE and item.get("reply"):
+                metrics.incr("pregen_hits")
+                _pool.wake()
+                return item["reply"]
+            metrics.incr("pregen_stale")
+    except Exception:
+        return None
+    metrics.incr("pregen_misses")
+    _pool.wake()
+    return None
+
+
+def _default_stance() -> Stance:
+    return "pro" if DEFAULT_SIDE.strip().lower().startswith("affirmative") else "contra"
+
+
+def pool_targets() -> List[Tuple[str, str, Stance]]:
+    """(profile, topic, stance) combos to keep warm: the default topic plus the most frequent topics."""
+    targets: List[Tuple[str, str, Stance]] = []
+    topics: List[Tuple[str, Tuple[Stance, ...]]] = [(DEFAULT_TOPIC, (_default_stance(),))]
+    try:
+        for key in redis_client.zrevrange(_TOPICS_KEY, 0, PREGEN_TOP_TOPICS - 1):
+            if key != topic_key(DEFAULT_TOPIC):
+                topics.append((redis_client.hget(_TEXT_KEY, key) or key, ("pro", "contra")))
+    except Exception:
+        pass
+    for pid in (p["id"] for p in list_profiles()):
+        for topic, stances in topics:
+            for stance in stances:
+                targets.append((pid, topic, stance))
+    return targets
+
+
+def _generate_opening(profile_id: str, topic: str, stance: Stance, angle: str) -> str:
+    from app.services.llm import generate_reply
+    prompt = f'Open the debate on "{topic}". {angle}'
+    return generate_reply([], prompt, stance_hint=stance, topic=topic, profile_id=profile_id).reply
+
+
+def _acquire() -> Optional[str]:
+    token = uuid.uuid4().hex
+    try:
+        if redis_client.set(_LOCK_KEY, token, nx=True, px=int(PREGEN_LOCK_TTL * 1000)):
+            return token
+    except Exception:
+        pass
+    return None
+
+
+def _release(token: str) -> None:
+    try:
+        release_lock(redis_client, _LOCK_KEY, token)
+    except Exception:
+        pass
+
+
+def refill_once(budget: int = PREGEN_MAX_PER_CYCLE) -> int:
+    """
+    One refill cycle, run by whichever worker holds the refill lock (the others skip it): drop stale
+    entries, evict pools that fell out of the target set and generate up to `budget` openings, one per
+    pool per round so the default topic and the most frequent ones fill first.
+    """
+    token = _acquire()
+    if token is None:
+        metrics.incr("pregen_skipped", reason="not_leader")
+        return 0
+    try:
+        return _refill(budget)
+    finally:
+        _release(token)
+
+
+def _refill(budget: int) -> int:
+    generated = 0
+    now = time.time()
+    targets = pool_targets()
+    wanted = {_pool_key(*t) for t in targets}
+    try:
+        for stale_key in set(redis_client.smembers(_ACTIVE_KEY)) - wanted:
+            redis_client.delete(stale_key)
+            redis_client.srem(_ACTIVE_KEY, stale_key)
+    except Exception:
+        pass
+
+    missing: List[Tuple[Tuple[str, str, Stance], int]] = []
+    for target in targets:
+        key = _pool_key(*target)
+        try:
+            redis_client.sadd(_ACTIVE_KEY, key)
+            while True:
+                head = redis_client.lindex(key, 0)
+                if head is None or now - float(json.loads(head).get("ts", 0)) <= PREGEN_MAX_AGE:
+                    break
+                redis_client.lpop(key)
+            missing.append((target, PREGEN_POOL_SIZE - int(redis_client.llen(key))))
+        except Exception as e:
+            log.warning("pregen refill failed for %s: %s", key, e)
+
+    for round_ in range(PREGEN_POOL_SIZE):
+        for (profile_id, topic, stance), n in missing:
+            if generated >= budget:
+                break
+            if n <= round_:
+                continue
+            key = _pool_key(profile_id, topic, stance)
+            try:
+                reply = _generate_opening(profile_id, topic, stance, _ANGLES[generated % len(_ANGLES)])
+                redis_client.rpush(key, json.dumps({"reply": reply, "ts": time.time()}))
+                generated += 1
+            except Exception as e:
+                log.warning("pregen refill failed for %s: %s", key, e)
+    if generated:
+        metrics.incr("pregen_generated", generated)
+    return generated
+
+
+class OpeningPool:
+    """
+    Background refiller: runs every PREGEN_INTERVAL seconds, or sooner after a pool was drawn from.
+    Every worker runs one, but the refill lock lets only one of them generate per cycle.
+    """
+
+    def __init__(self):
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if not PREGEN_ENABLED or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="pregen-refill", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+
+    def wake(self) -> None:
+        self._wake.set()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                refill_once()
+            except Exception as e:
+                log.warning("pregen cycle failed: %s", e)
+            self._wake.wait(PREGEN_INTERVAL)
+            self._wake.clear()
+
+
+_pool = OpeningPool()
+
+
+def start_pool() -> None:
+    _pool.start()
+
+
+def stop_pool() -> None:
+    _pool.stop()
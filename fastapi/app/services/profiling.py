@@ -0,0 +1,220 @@
+from __future__ import annotations
+
+import contextvars
+import hmac
+import json
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from typing import Dict, List, Optional, Set
+
+from app.config import PROFILING_TOKEN, PROFILING_DIR, PROFILING_SAMPLE_RATE, PROFILING_INTERVAL, PROFILING_KEEP
+from app.services import metrics
+
+log = logging.getLogger(__name__)
+
+# Opt-in wall-clock sampling profiler. Only installed when PROFILING_TOKEN is set (see app.main);
+# otherwise nothing here runs. Output is collapsed stacks ("a;b;c <samples>"), which flamegraph.pl,
+# speedscope and inferno read directly.
+
+PROFILE_HEADER = "x-profile"  # value = PROFILING_TOKEN profiles this one request
+_SAFE = re.compile(r"[^A-Za-z0-9_.-]+")
+
+_active: contextvars.ContextVar[Optional["SamplingProfiler"]] = contextvars.ContextVar("profiler", default=None)
+_sample_rate = PROFILING_SAMPLE_RATE
+
+
+def enabled() -> bool:
+    return bool(PROFILING_TOKEN)
+
+
+def check_token(token: Optional[str]) -> bool:
+    return enabled() and bool(token) and hmac.compare_digest(token.encode(), PROFILING_TOKEN.encode())
+
+
+def sample_rate() -> float:
+    return _sample_rate
+
+
+def set_sample_rate(rate: float) -> float:
+    """Share of requests profiled without the header (0..1); changes this process only."""
+    global _sample_rate
+    _sample_rate = min(1.0, max(0.0, float(rate)))
+    return _sample_rate
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of the threads serving one request every `interval` s via sys._current_frames(),
+    from a helper thread, so the profiled code runs unmodified (no tracing hooks).
+    Threads join with add_thread(); the request starts on the event loop thread and the sync handler
+    adds its worker thread (attach_current_thread). Loop samples may include concurrent requests.
+    """
+
+    def __init__(self, interval: float = PROFILING_INTERVAL):
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self.count = 0
+        self._threads: Set[int] = set()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.started_at = 0.0
+        self.seconds = 0.0
+
+    def add_thread(self, ident: int) -> None:
+        self._threads.add(ident)
+
+    def start(self) -> None:
+        self.started_at = time.time()
+        self._t0 = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        self.seconds = time.perf_counter() - self._t0
+
+    def _run(self) -> None:
+        names = {}
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            for ident in list(self._threads):
+                frame = frames.get(ident)
+                if frame is None:
+                    continue
+                if ident not in names:
+                    t = threading._active.get(ident)  # type: ignore[attr-defined]
+                    names[ident] = _SAFE.sub("_", t.name if t else str(ident))
+                self.samples[_collapse(frame, names[ident])] += 1
+                self.count += 1
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {n}\n" for stack, n in self.samples.most_common())
+
+
+def _collapse(frame, root: str) -> str:
+    stack: List[str] = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{frame.f_globals.get('__name__', '?')}:{code.co_name}")
+        frame = frame.f_back
+    stack.append(root)
+    return ";".join(reversed(stack))
+
+
+def attach_current_thread() -> None:
+    """Called on the thread running a sync handler; no-op unless the request is being profiled."""
+    prof = _active.get()
+    if prof is not None:
+        prof.add_thread(threading.get_ident())
+
+
+def wants_profile(headers: Dict[str, str]) -> bool:
+    token = headers.get(PROFILE_HEADER)
+    if token is not None:
+        return check_token(token)
+    return _sample_rate > 0 and random.random() < _sample_rate
+
+
+def new_profile_id(path: str) -> str:
+    return "{}-{}-{}".format(time.strftime("%Y%m%dT%H%M%S", time.gmtime()),
+                             _SAFE.sub("_", path.strip("/"))[:60], uuid.uuid4().hex[:8])
+
+
+def save(pid: str, prof: SamplingProfiler, method: str, path: str, status: Optional[int]) -> None:
+    """Write <pid>.folded (collapsed stacks) + <pid>.json (request info) to PROFILING_DIR."""
+    os.makedirs(PROFILING_DIR, exist_ok=True)
+    with open(os.path.join(PROFILING_DIR, pid + ".folded"), "w", encoding="utf-8") as fh:
+        fh.write(prof.collapsed())
+    info = {"id": pid, "method": method, "path": path, "status": status, "started_at": prof.started_at,
+            "duration_ms": round(prof.seconds * 1000, 1), "samples": prof.count,
+            "interval_ms": prof.interval * 1000, "pid": os.getpid()}
+    with open(os.path.join(PROFILING_DIR, pid + ".json"), "w", encoding="utf-8") as fh:
+        json.dump(info, fh)
+    _prune()
+
+
+def _prune() -> None:
+    try:
+        infos = sorted(f for f in os.listdir(PROFILING_DIR) if f.endswith(".json"))
+    except OSError:
+        return
+    for name in infos[:-PROFILING_KEEP] if PROFILING_KEEP > 0 else []:
+        for ext in (".json", ".folded"):
+            try:
+                os.remove(os.path.join(PROFILING_DIR, name[:-5] + ext))
+            except OSError:
+                pass
+
+
+def list_profiles(limit: int = 50) -> List[dict]:
+    """Most recent first."""
+    try:
+        names = sorted((f for f in os.listdir(PROFILING_DIR) if f.endswith(".json")), reverse=True)
+    except OSError:
+        return []
+    out = []
+    for name in names[:limit]:
+        try:
+            with open(os.path.join(PROFILING_DIR, name), encoding="utf-8") as fh:
+                out.append(json.load(fh))
+        except (OSError, ValueError):
+            continue
+    return out
+
+
+def profile_path(pid: str) -> Optional[str]:
+    if _SAFE.search(pid) or ".." in pid:
+        return None
+    path = os.path.join(PROFILING_DIR, pid + ".folded")
+    return path if os.path.isfile(path) else None
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware: profiles requests carrying `X-Profile: <PROFILING_TOKEN>` or a random share
+    (sample_rate()) of the rest; the response gets `X-Profile-Id`. Admin routes are never profiled.
+    """
+
+    def __init__(self, app, skip_prefix: str = "/api/v1/admin"):
+        self.app = app
+        self.skip_prefix = skip_prefix
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(self.skip_prefix):
+            return await self.app(scope, receive, send)
+        headers = {k.decode("latin-1"): v.decode("latin-1") for k, v in scope.get("headers", [])}
+        if not wants_profile(headers):
+            return await self.app(scope, receive, send)
+
+        prof = SamplingProfiler()
+        prof.add_thread(threading.get_ident())
+        pid = new_profile_id(scope["path"])
+        status: Dict[str, int] = {}
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                message = {**message, "headers": list(message.get("headers", [])) + [(b"x-profile-id", pid.encode())]}
+            await send(message)
+
+        token = _active.set(prof)
+        prof.start()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            prof.stop()
+            _active.reset(token)
+            try:
+                save(pid, prof, scope.get("method", ""), scope["path"], status.get("code"))
+                metrics.incr("profiles_written")
+            except Exception as e:
+                log.warning("could not write profile %s: %s", pid, e)
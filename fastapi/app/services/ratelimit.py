@@ -0,0 +1,167 @@
+from __future__ import annotations
+
+import hashlib
+import math
+from dataclasses import dataclass
+from typing import Dict, List, Mapping, Optional
+
+from fastapi import HTTPException, Request
+from starlette.requests import HTTPConnection
+
+from app.config import RATE_LIMIT_ENABLED, RATE_LIMITS, RATE_LIMIT_TRUST_PROXY, redis_client
+from app.services import metrics
+
+# Token bucket per key, refilled continuously at capacity/period tokens per second. The whole
+# read-refill-take runs in one script on Redis' own clock, so every worker shares the same buckets.
+_BUCKET = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1])
+local ts = tonumber(state[2])
+if tokens == nil or ts == nil then
+  tokens = capacity
+  ts = now
+end
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+local wait = 0
+if tokens >= cost then
+  tokens = tokens - cost
+  allowed = 1
+else
+  wait = math.ceil((cost - tokens) / rate)
+end
+local full = math.ceil((capacity - tokens) / rate)
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', now)
+redis.call('PEXPIRE', KEYS[1], full + 1000)
+return {allowed, math.floor(tokens), wait, full}
+"""
+
+
+@dataclass
+class Decision:
+    bucket: str
+    allowed: bool
+    limit: int
+    remaining: int
+    reset_ms: int
+    retry_after_ms: int
+    period: float
+
+    def headers(self) -> dict:
+        h = {
+            "RateLimit-Limit": str(self.limit),
+            "RateLimit-Remaining": str(self.remaining),
+            "RateLimit-Reset": str(math.ceil(self.reset_ms / 1000)),
+            "RateLimit-Policy": f"{self.limit};w={int(self.period)}",
+        }
+        if not self.allowed:
+            h["Retry-After"] = str(max(1, math.ceil(self.retry_after_ms / 1000)))
+        return h
+
+
+def client_id(request: HTTPConnection) -> str:
+    """API key (hashed) if the client sends one, else its IP (first X-Forwarded-For hop behind a trusted proxy)."""
+    key = request.headers.get("x-api-key")
+    if key:
+        return "key:" + hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+    ip = None
+    if RATE_LIMIT_TRUST_PROXY:
+        fwd = request.headers.get("x-forwarded-for", "")
+        ip = fwd.split(",")[0].strip() or None
+    return "ip:" + (ip or (request.client.host if request.client else "unknown"))
+
+
+def check(bucket: str, ident: str, cost: int = 1) -> Optional[Decision]:
+    """Take `cost` tokens from bucket `bucket` for `ident`; None when the bucket is off or Redis is unavailable."""
+    cfg = RATE_LIMITS.get(bucket)
+    if not RATE_LIMIT_ENABLED or not cfg:
+        return None
+    capacity, period = cfg
+    try:
+        allowed, remaining, wait, full = redis_client.eval(
+            _BUCKET, 1, f"rl:{bucket}:{ident}", capacity, capacity / (period * 1000.0), cost)
+    except Exception:
+        metrics.incr("rate_limit_errors", bucket=bucket)
+        return None  # fail open: an outage of the limiter must not take the API down
+    return Decision(bucket=bucket, allowed=bool(allowed), limit=capacity, remaining=int(remaining),
+                    reset_ms=int(full), retry_after_ms=int(wait), period=period)
+
+
+def _within_capacity(bucket: str, cost: int) -> None:
+    """A cost above the bucket's capacity can never pass: 413, not a 429 whose Retry-After can't be met."""
+    cfg = RATE_LIMITS.get(bucket)
+    if RATE_LIMIT_ENABLED and cfg and cost > cfg[0]:
+        raise HTTPException(status_code=413, detail=f"{cost} turns exceed the {bucket} limit of {cfg[0]} "
+                                                    f"per {int(cfg[1])}s")
+
+
+def enforce(request: HTTPConnection, bucket: str, conversation_id: Optional[str] = None, cost: int = 1,
+            conversations: Optional[Mapping[str, int]] = None, conversation_bucket: Optional[str] = None) -> None:
+    """
+    Take `cost` tokens from the client bucket `bucket` and, per conversation, one token per turn from
+    `conversation_bucket` (default `<bucket>_conversation`): `conversation_id` is one turn,
+    `conversations` maps cid -> turns (batches).
+    The tightest result goes into the response's RateLimit-* headers (see RateLimitHeadersMiddleware);
+    a denied check raises 429 with Retry-After. Also takes a WebSocket (one call per turn).
+    """
+    turns: Dict[str, int] = dict(conversations or {})
+    if conversation_id:
+        turns[conversation_id] = turns.get(conversation_id, 0) + 1
+    conversation_bucket = conversation_bucket or f"{bucket}_conversation"
+    _within_capacity(bucket, cost)
+    for n in turns.values():
+        _within_capacity(conversation_bucket, n)
+
+    decisions: List[Decision] = []
+    d = check(bucket, client_id(request), cost)
+    if d is not None:
+        decisions.append(d)
+    for cid, n in turns.items():
+        if d is not None and not d.allowed:
+            break
+        d = check(conversation_bucket, cid, n)
+        if d is not None:
+            decisions.append(d)
+    if not decisions:
+        return
+    denied = next((x for x in decisions if not x.allowed), None)
+    chosen = denied or min(decisions, key=lambda x: x.remaining / max(1, x.limit))
+    request.scope["ratelimit_headers"] = chosen.headers()
+    if denied:
+        metrics.incr("rate_limited", bucket=denied.bucket)
+        raise HTTPException(status_code=429, detail=f"rate limit exceeded ({denied.bucket})",
+                            headers=denied.headers())
+
+
+def limit(bucket: str):
+    """Route dependency: enforce `bucket` for the client (and for {conversation_id} when the path has one)."""
+    def _dep(request: Request) -> None:
+        enforce(request, bucket, request.path_params.get("conversation_id"))
+    return _dep
+
+
+class RateLimitHeadersMiddleware:
+    """Copies the RateLimit-* headers chosen during the request onto the response."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start":
+                extra = scope.get("ratelimit_headers")
+                if extra:
+                    have = {k.lower() for k, _ in message.get("headers", [])}
+                    message = {**message, "headers": list(message.get("headers", [])) + [
+                        (k.lower().encode(), v.encode()) for k, v in extra.items() if k.lower().encode() not in have]}
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
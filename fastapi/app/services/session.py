@@ -0,0 +1,151 @@
+from __future__ import annotations
+
+import copy
+import logging
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from app.config import ASK_DEADLINE_SECONDS, WS_FLUSH_TURNS, WS_FLUSH_SECONDS
+from app.services import metrics
+from app.services.conversation import ConversationConflict, get_conversation, merge_turn, save_conversation
+from app.services.deadline import deadline_scope
+from app.services.turns import MAX_STORED_MESSAGES, TurnResult, run_turn
+
+log = logging.getLogger(__name__)
+
+class DebateSession:
+    """
+    Live conversation held in process memory for the lifetime of a WebSocket.
+    Turns mutate the in-memory state; Redis is written behind (every WS_FLUSH_TURNS turns or
+    WS_FLUSH_SECONDS after the last flush) and on close.
+    Flushes are versioned CAS saves; if an HTTP turn landed meanwhile, the pending turns are merged onto it
+    (the session's turns were already delivered, so reject/queue do not apply here).
+    A failed flush is logged and counted, never raised: the turns stay pending for the next one.
+    `turn_lock` serializes turns; `lock` guards the committed state and is only held to copy it, commit a
+    turn or flush, never across LLM calls, so /meta, /history5 and the flusher read the last committed turn.
+    """
+
+    def __init__(self, cid: Optional[str] = None, conv: Optional[dict] = None):
+        self.cid = cid
+        self.conv = conv
+        self.lock = threading.Lock()
+        self.turn_lock = threading.Lock()
+        self.dirty_turns = 0
+        self.last_flush = time.monotonic()
+        self.refs = 0
+        self.pending: list = []
+        self.base_meta = copy.deepcopy(conv["meta"]) if conv else {}
+
+    def turn(self, message: str, on_token: Optional[Callable[[str], None]] = None,
+             on_reset: Optional[Callable[[], None]] = None) -> TurnResult:
+        with self.turn_lock:
+            with self.lock:
+                cid, base = self.cid, self.conv
+                work = copy.deepcopy(base) if base is not None else None
+                start_meta = copy.deepcopy(work["meta"]) if work else {}
+            with deadline_scope(ASK_DEADLINE_SECONDS):
+                result = run_turn(cid, work, message, on_token=on_token, on_reset=on_reset)
+            with self.lock:
+                self._commit_locked(base, start_meta, result)
+                if self.dirty_turns >= WS_FLUSH_TURNS or result.created:
+                    self._flush_locked()
+        return result
+
+    def _commit_locked(self, base: Optional[dict], start_meta: dict, result: TurnResult) -> None:
+        if self.conv is not base:
+            # a flush merged a concurrent HTTP turn while ours ran: rebase ours onto it
+            result.conv = merge_turn(self.conv, result.conv, start_meta, result.new_messages, MAX_STORED_MESSAGES)
+        elif base is not None:
+            result.conv["version"] = base.get("version")  # a clean flush may have bumped it meanwhile
+        self.cid, self.conv = result.cid, result.conv
+        self.pending.extend(result.new_messages)
+        self.dirty_turns += 1
+        if result.created:
+            _register(self)
+
+    def snapshot(self) -> Optional[dict]:
+        with self.lock:
+            return copy.deepcopy(self.conv) if self.conv is not None else None
+
+    def flush(self) -> bool:
+        with self.lock:
+            return self._flush_locked()
+
+    def flush_if_due(self) -> None:
+        if self.dirty_turns and time.monotonic() - self.last_flush >= WS_FLUSH_SECONDS:
+            self.flush()
+
+    def _flush_locked(self) -> bool:
+        if not self.dirty_turns or not self.cid or self.conv is None:
+            return True
+        try:
+            try:
+                save_conversation(self.cid, self.conv)
+            except ConversationConflict:
+                metrics.incr("conv_conflicts", policy="ws_merge")
+                latest = get_conversation(self.cid) or {"meta": {}, "messages": []}
+                merged = merge_turn(latest, self.conv, self.base_meta, self.pending, MAX_STORED_MESSAGES)
+                save_conversation(self.cid, merged)
+                self.conv = merged
+        except Exception as e:
+            metrics.incr("ws_flush_errors", error=type(e).__name__)
+            log.warning("ws flush of %s failed (%d turns pending): %s", self.cid, self.dirty_turns, e)
+            return False
+        metrics.incr("ws_flushes")
+        metrics.incr("ws_turns_batched", self.dirty_turns)
+        self.dirty_turns = 0
+        self.pending = []
+        self.base_meta = copy.deepcopy(self.conv["meta"])
+        self.last_flush = time.monotonic()
+        return True
+
+
+_sessions: Dict[str, DebateSession] = {}
+_registry_lock = threading.Lock()
+
+
+def _register(session: DebateSession) -> None:
+    with _registry_lock:
+        session.refs = max(session.refs, 1)
+        _sessions[session.cid] = session
+
+
+def open_session(cid: str) -> Optional[DebateSession]:
+    """Attach to a live session for `cid` or resume it from Redis; None if the conversation does not exist."""
+    with _registry_lock:
+        live = _sessions.get(cid)
+        if live is not None:
+            live.refs += 1
+            return live
+    conv = get_conversation(cid)
+    if not conv:
+        return None
+    with _registry_lock:
+        session = _sessions.setdefault(cid, DebateSession(cid, conv))
+        session.refs += 1
+        return session
+
+
+def close_session(session: DebateSession) -> None:
+    """
+    Flush pending turns and drop the session once its last socket is gone. The session leaves the
+    registry even if that flush fails, so /meta and /history go back to Redis instead of stale memory.
+    """
+    try:
+        if not session.flush():
+            metrics.incr("ws_turns_lost", session.dirty_turns)
+            log.error("ws session %s closed with %d unsaved turns", session.cid, session.dirty_turns)
+    finally:
+        if session.cid:
+            with _registry_lock:
+                session.refs -= 1
+                if session.refs <= 0 and _sessions.get(session.cid) is session:
+                    del _sessions[session.cid]
+
+
+def live_conversation(cid: str) -> Optional[dict]:
+    """In-memory state of a live session (newer than Redis while writes are pending)."""
+    with _registry_lock:
+        session = _sessions.get(cid)
+    return session.snapshot() if session is not None else None
@@ -0,0 +1,137 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Optional
+
+from app.config import (
+    SINGLEFLIGHT_REDIS, SINGLEFLIGHT_LOCK_TTL, SINGLEFLIGHT_RESULT_TTL, redis_client,
+)
+from app.services import metrics
+from app.services.deadline import DeadlineExceeded, current_deadline
+from app.services.storage import release_lock
+
+_POLL_SECONDS = 0.05
+
+
+def request_key(**parts: Any) -> str:
+    """Stable hash of everything that determines a deterministic completion (model, messages, options)."""
+    blob = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class _Call:
+    __slots__ = ("event", "result", "error", "waiters")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result: Optional[str] = None
+        self.error: Optional[BaseException] = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesces identical in-flight calls: the first caller (leader) runs `fn`, concurrent callers with the
+    same key wait for its result (and run again if the leader only hit its own deadline). With
+    SINGLEFLIGHT_REDIS the leader also takes a Redis lock so leaders in other workers wait for a
+    short-lived shared result instead of calling the provider again.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+
+    def do(self, key: str, fn: Callable[[], str]) -> str:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                call.waiters += 1
+
+        if not leader:
+            call.event.wait(_wait_budget())
+            if call.event.is_set():
+                if isinstance(call.error, DeadlineExceeded):
+                    # the leader ran out of *its* budget, not the work: callers with time left try again
+                    # (coalescing among themselves under a new leader)
+                    metrics.incr("singleflight_leader_deadline")
+                    return self.do(key, fn)
+                if call.error is not None:
+                    raise call.error
+                metrics.incr("singleflight_saved", scope="local")
+                return call.result  # type: ignore[return-value]
+            return fn()
+
+        try:
+            call.result = self._lead(key, fn) if SINGLEFLIGHT_REDIS else fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+
+    def _lead(self, key: str, fn: Callable[[], str]) -> str:
+        lock_key, res_key = f"sf:lock:{key}", f"sf:res:{key}"
+        token = uuid.uuid4().hex
+        try:
+            cached = redis_client.get(res_key)
+            if cached is not None:
+                metrics.incr("singleflight_saved", scope="redis")
+                return cached
+            owner = bool(redis_client.set(lock_key, token, nx=True, px=int(SINGLEFLIGHT_LOCK_TTL * 1000)))
+        except Exception:
+            return fn()
+
+        if not owner:
+            waited = self._await_remote(lock_key, res_key)
+            if waited is not None:
+                metrics.incr("singleflight_saved", scope="redis")
+                return waited
+            return fn()
+
+        try:
+            result = fn()
+            try:
+                redis_client.set(res_key, result, px=int(SINGLEFLIGHT_RESULT_TTL * 1000))
+            except Exception:
+                pass
+            return result
+        finally:
+            try:
+                release_lock(redis_client, lock_key, token)
+            except Exception:
+                pass
+
+    @staticmethod
+    def _await_remote(lock_key: str, res_key: str) -> Optional[str]:
+        """Poll for another worker's result; None if its lock vanished without one or our budget ran out."""
+        until = time.monotonic() + _wait_budget()
+        while time.monotonic() < until:
+            try:
+                res = redis_client.get(res_key)
+                if res is not None:
+                    return res
+                if not redis_client.exists(lock_key):
+                    return redis_client.get(res_key)
+            except Exception:
+                return None
+            time.sleep(_POLL_SECONDS)
+        return None
+
+
+def _wait_budget() -> float:
+    dl = current_deadline()
+    left = dl.remaining() if dl is not None else float("inf")
+    return min(SINGLEFLIGHT_LOCK_TTL, left)
+
+
+singleflight = SingleFlight()
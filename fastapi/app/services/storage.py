@@ -0,0 +1,206 @@
+from __future__ import annotations
+
+import bisect
+import hashlib
+import random
+import threading
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import redis
+
+from app.config import (
+    REDIS_SHARDS, REDIS_CLUSTER, REDIS_HASH_TAGS, REDIS_SHARD_VNODES, REDIS_SOCKET_TIMEOUT, redis_client,
+)
+
+# Per-conversation key families; all of them live on the shard that owns the cid.
+CID_KEY_PREFIXES = ("conv", "align", "usage")
+# Global keys that share one of those prefixes (daily usage totals on REDIS_URL): never a conversation.
+GLOBAL_KEY_PREFIXES = ("usage:day:",)
+
+# Compare-and-set on the conversation document: write ARGV[2] only if the stored "version" (0 when the key
+# is missing or unversioned) equals ARGV[1]. Returns {1, version} on success, {0, current_version} on conflict.
+_CAS_SAVE = """
+local cur = redis.call('GET', KEYS[1])
+local v = 0
+if cur then
+  local ok, doc = pcall(cjson.decode, cur)
+  if ok and type(doc) == 'table' and tonumber(doc['version']) then v = tonumber(doc['version']) end
+end
+if v ~= tonumber(ARGV[1]) then return {0, v} end
+redis.call('SET', KEYS[1], ARGV[2])
+return {1, v}
+"""
+
+# Lock release for SET NX PX locks: only the holder's token deletes it (value check + DEL in one step).
+RELEASE_LOCK = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) else return 0 end"
+
+
+def release_lock(client, key: str, token: str) -> bool:
+    """Delete `key` if it still holds `token` (our lock, not one taken after ours expired)."""
+    return bool(client.eval(RELEASE_LOCK, 1, key, token))
+
+
+def cid_key(prefix: str, cid: str) -> str:
+    """`prefix:cid`, or `prefix:{cid}` with hash tags so Redis Cluster keeps a conversation's keys in one slot."""
+    return f"{prefix}:{{{cid}}}" if REDIS_HASH_TAGS or REDIS_CLUSTER else f"{prefix}:{cid}"
+
+
+def conv_key(cid: str) -> str:
+    return cid_key("conv", cid)
+
+
+def cid_from_key(key: str) -> Optional[str]:
+    """Inverse of cid_key for any known prefix (with or without hash tags); None for other keys."""
+    prefix, _, rest = key.partition(":")
+    if prefix not in CID_KEY_PREFIXES or not rest or key.startswith(GLOBAL_KEY_PREFIXES):
+        return None
+    return rest[1:-1] if rest.startswith("{") and rest.endswith("}") else rest
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.md5(value.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    """Consistent hashing with virtual nodes: adding a node only moves ~1/N of the cids."""
+
+    def __init__(self, nodes: Sequence[str], vnodes: int = REDIS_SHARD_VNODES):
+        self.nodes = list(nodes)
+        points: List[Tuple[int, str]] = []
+        for node in self.nodes:
+            for i in range(vnodes):
+                points.append((_hash(f"{node}#{i}"), node))
+        points.sort()
+        self._hashes = [h for h, _ in points]
+        self._owners = [n for _, n in points]
+
+    def node_for(self, cid: str) -> str:
+        if len(self.nodes) == 1:
+            return self.nodes[0]
+        i = bisect.bisect(self._hashes, _hash(cid)) % len(self._hashes)
+        return self._owners[i]
+
+
+class Shard:
+    __slots__ = ("name", "primary", "replicas")
+
+    def __init__(self, name: str, primary, replicas: Iterable = ()):
+        self.name = name
+        self.primary = primary
+        self.replicas = list(replicas)
+
+    def reader(self):
+        return random.choice(self.replicas) if self.replicas else self.primary
+
+
+def _client(url: str, decode: bool = True):
+    return redis.from_url(url, decode_responses=decode,
+                          socket_timeout=REDIS_SOCKET_TIMEOUT, socket_connect_timeout=REDIS_SOCKET_TIMEOUT)
+
+
+def parse_shards(spec: str) -> List[Tuple[str, List[str]]]:
+    """'redis://a|redis://a-ro,redis://b' -> [('redis://a', ['redis://a-ro']), ('redis://b', [])]"""
+    out = []
+    for part in (spec or "").split(","):
+        urls = [u.strip() for u in part.split("|") if u.strip()]
+        if urls:
+            out.append((urls[0], urls[1:]))
+    return out
+
+
+class ConversationStore:
+    """Routes per-conversation keys to the shard that owns the cid; read-only lookups may use replicas."""
+
+    def __init__(self, shards: Sequence[Shard]):
+        self.shards = {s.name: s for s in shards}
+        self.ring = HashRing([s.name for s in shards])
+
+    @classmethod
+    def from_config(cls) -> "ConversationStore":
+        if REDIS_CLUSTER:
+            return cls([Shard("cluster", redis_client.connect())])  # the shared RedisCluster client
+        spec = parse_shards(REDIS_SHARDS)
+        if not spec:
+            return cls([Shard("default", redis_client)])
+        return cls([Shard(url, _client(url), [_client(r) for r in replicas]) for url, replicas in spec])
+
+    @classmethod
+    def from_clients(cls, primaries: Sequence, replicas: Sequence[Sequence] = ()) -> "ConversationStore":
+        reps = list(replicas) + [()] * (len(primaries) - len(replicas))
+        return cls([Shard(f"shard{i}", c, reps[i]) for i, c in enumerate(primaries)])
+
+    def shard_for(self, cid: str) -> Shard:
+        return self.shards[self.ring.node_for(cid)]
+
+    def client_for(self, cid: str, readonly: bool = False):
+        shard = self.shard_for(cid)
+        return shard.reader() if readonly else shard.primary
+
+    def get(self, cid: str, readonly: bool = False) -> Optional[str]:
+        """Raw conversation JSON; replica misses fall back to the primary (replication lag on new cids)."""
+        shard = self.shard_for(cid)
+        if readonly and shard.replicas:
+            try:
+                raw = shard.reader().get(conv_key(cid))
+                if raw is not None:
+                    return raw
+            except redis.RedisError:
+                pass
+        return shard.primary.get(conv_key(cid))
+
+    def set(self, cid: str, raw: str) -> None:
+        self.shard_for(cid).primary.set(conv_key(cid), raw)
+
+    def cas(self, cid: str, raw: str, expected_version: int) -> Tuple[bool, int]:
+        """Atomic versioned write; (saved, stored_version_seen)."""
+        ok, current = self.shard_for(cid).primary.eval(_CAS_SAVE, 1, conv_key(cid), int(expected_version), raw)
+        return bool(int(ok)), int(current)
+
+
+    def _by_shard(self, cids: Iterable[str]) -> Dict[str, List[int]]:
+        groups: Dict[str, List[int]] = {}
+        for i, cid in enumerate(cids):
+            groups.setdefault(self.ring.node_for(cid), []).append(i)
+        return groups
+
+    def get_many(self, cids: Sequence[str]) -> List[Optional[str]]:
+        """Raw documents for `cids` (same order), one pipelined GET round trip per shard primary."""
+        out: List[Optional[str]] = [None] * len(cids)
+        for name, idx in self._by_shard(cids).items():
+            pipe = self.shards[name].primary.pipeline(transaction=False)
+            for i in idx:
+                pipe.get(conv_key(cids[i]))
+            for i, raw in zip(idx, pipe.execute()):
+                out[i] = raw
+        return out
+
+    def cas_many(self, items: Sequence[Tuple[str, str, int]]) -> List[Tuple[bool, int]]:
+        """cas() for many (cid, raw, expected_version) at once: one pipelined round trip per shard."""
+        out: List[Tuple[bool, int]] = [(False, 0)] * len(items)
+        for name, idx in self._by_shard([cid for cid, _, _ in items]).items():
+            pipe = self.shards[name].primary.pipeline(transaction=False)
+            for i in idx:
+                cid, raw, expected = items[i]
+                pipe.eval(_CAS_SAVE, 1, conv_key(cid), int(expected), raw)
+            for i, (ok, current) in zip(idx, pipe.execute()):
+                out[i] = (bool(int(ok)), int(current))
+        return out
+
+
+_store: Optional[ConversationStore] = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> ConversationStore:
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = ConversationStore.from_config()
+    return _store
+
+
+def set_store(store: Optional[ConversationStore]) -> None:
+    """Swap the process-wide store (tests, tools); None rebuilds it from config on next use."""
+    global _store
+    _store = store
@@ -0,0 +1,58 @@
+from __future__ import annotations
+
+import json
+import re
+from functools import lru_cache
+from typing import Any, Dict, Type, TypeVar
+
+from pydantic import BaseModel, ValidationError
+
+T = TypeVar("T", bound=BaseModel)
+
+_FENCE = re.compile(r"^```(?:json)?\s*|\s*```$", re.IGNORECASE)
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+_BARE_LITERALS = re.compile(r"\b(True|False|None)\b")
+_LITERAL_JSON = {"True": "true", "False": "false", "None": "null"}
+
+
+class StructuredOutputError(ValueError):
+    """The model output could not be validated against the schema, even after local repair."""
+
+
+@lru_cache(maxsize=None)
+def json_schema(schema: Type[BaseModel]) -> Dict[str, Any]:
+    """JSON schema for Ollama `format` / OpenAI `response_format` (cached per model class)."""
+    return schema.model_json_schema()
+
+
+def openai_response_format(schema: Type[BaseModel]) -> Dict[str, Any]:
+    return {"type": "json_schema", "json_schema": {"name": schema.__name__, "schema": json_schema(schema)}}
+
+
+def _repair(raw: str) -> Any:
+    """Single local repair pass: code fences, surrounding prose, single quotes, trailing commas, Python literals."""
+    text = _FENCE.sub("", (raw or "").strip())
+    i, j = text.find("{"), text.rfind("}")
+    if i == -1 or j == -1 or j < i:
+        raise StructuredOutputError(f"no JSON object in output: {raw[:120]!r}")
+    text = text[i:j + 1]
+    if '"' not in text:
+        text = text.replace("'", '"')
+    text = _TRAILING_COMMA.sub(r"\1", text)
+    text = _BARE_LITERALS.sub(lambda m: _LITERAL_JSON[m.group(1)], text)
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError as e:
+        raise StructuredOutputError(f"unrepairable JSON: {e}") from e
+
+
+def parse_structured(raw: str, schema: Type[T]) -> T:
+    """Validate `raw` as `schema`; on failure do one bounded local repair instead of another LLM call."""
+    try:
+        return schema.model_validate_json(raw)
+    except (ValidationError, ValueError):
+        pass
+    try:
+        return schema.model_validate(_repair(raw))
+    except ValidationError as e:
+        raise StructuredOutputError(str(e)) from e
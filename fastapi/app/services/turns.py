@@ -0,0 +1,175 @@
+from __future__ import annotations
+
+import copy
+import time
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional
+
+from app.config import USER_MSG_LIMIT, CONV_CONFLICT_POLICY, CONV_CAS_RETRIES
+from app.models import AskResponse, ChatMessage, ModelReply
+from app.services import metrics
+from app.services.personas import DEFAULT_PROFILE_ID
+from app.services.classifier import classify_topic_and_user_side_via_llm
+from app.services.conversation import (
+    new_cid, last_n, extract_profile_cmd, topic_change_requested, bot_side_for,
+    detect_user_agreement, record_misalignment, pop_misalignment,
+    get_conversation, save_conversation, merge_turn, ConversationConflict,
+)
+from app.services.guards import verify_alignment_async
+from app.services.llm import generate_reply
+from app.services.pregen import record_topic, take_opening
+from app.services.usage import usage_scope
+
+MAX_STORED_MESSAGES = 20
+
+
+class ConversationNotFound(LookupError):
+    pass
+
+
+@dataclass
+class TurnResult:
+    cid: str
+    conv: dict
+    reply: ModelReply
+    new_messages: List[dict] = field(default_factory=list)
+    created: bool = False
+
+
+def _topic_meta(topic: str, user_side: str) -> dict:
+    return {
+        "topic": topic,
+        "side": bot_side_for(topic, user_side),
+        "stance_type": "negative" if user_side == "affirmative" else "affirmative",
+        "initial_topic": topic,
+        "initial_user_side": user_side,
+        "locked_side": True,
+        "user_side": user_side,
+        "user_aligned": False,
+    }
+
+
+def run_turn(cid: Optional[str], conv: Optional[dict], message: str,
+             on_token: Optional[Callable[[str], None]] = None,
+             on_reset: Optional[Callable[[], None]] = None) -> TurnResult:
+    """
+    One debate turn on an in-memory conversation: topic/stance setup on the first turn (or on a
+    topic change), agreement detection, reply generation and history append.
+    `conv=None` starts a new conversation. Persisting `result.conv` is left to the caller
+    (HTTP saves once per turn, WebSocket sessions write behind).
+    `on_token` receives reply tokens as they stream; `on_reset` means "discard what was streamed so far".
+    LLM token usage of the turn is billed to (cid, profile) via usage_scope.
+    """
+    requested_profile, user_text = extract_profile_cmd(message)
+    cid = cid or new_cid()
+    profile_id = (requested_profile or (conv or {}).get("meta", {}).get("profile_id")
+                  or DEFAULT_PROFILE_ID)
+    with usage_scope(cid, profile_id):
+        return _run_turn(cid, conv, requested_profile, user_text, profile_id, on_token, on_reset)
+
+
+def _run_turn(cid: str, conv: Optional[dict], requested_profile: Optional[str], user_text: str, profile_id: str,
+              on_token: Optional[Callable[[str], None]], on_reset: Optional[Callable[[], None]]) -> TurnResult:
+    created = conv is None
+
+    if created:
+        topic, user_side = classify_topic_and_user_side_via_llm(user_text)
+        record_topic(topic)
+        conv = {"meta": {**_topic_meta(topic, user_side), "profile_id": profile_id}, "messages": []}
+    else:
+        if requested_profile:
+            conv["meta"]["profile_id"] = requested_profile
+
+        if not conv.get("messages"):
+            topic, user_side = classify_topic_and_user_side_via_llm(user_text)
+            record_topic(topic)
+            conv["meta"].update(_topic_meta(topic, user_side))
+        elif topic_change_requested(user_text):
+            topic, user_side = classify_topic_and_user_side_via_llm(user_text)
+            conv["meta"].update(_topic_meta(topic, user_side))
+
+    meta = conv["meta"]
+    history = [ChatMessage(**m) for m in conv.get("messages", [])]
+    first_turn = not history
+
+    if detect_user_agreement(user_text):
+        meta["user_aligned"] = True
+
+    user_text = user_text[:USER_MSG_LIMIT]
+    history.append(ChatMessage(role="user", message=user_text))
+
+    stance_hint = "pro" if meta.get("stance_type") == "affirmative" else "contra"
+    opening = (take_opening(meta.get("profile_id", ""), meta.get("topic", ""), stance_hint, user_text)
+               if first_turn else None)
+    if opening:
+        mr = ModelReply(stance=stance_hint, reply=opening)
+        if on_token:
+            on_token(opening)
+    else:
+        reinforce = bool(pop_misalignment(cid))
+        mr = generate_reply(history, user_text, stance_hint=stance_hint, topic=meta.get("topic"),
+                            reinforce=reinforce, on_token=on_token, on_reset=on_reset,
+                            profile_id=meta.get("profile_id"))
+    if mr.guard_verdict == "unsure":
+        verify_alignment_async(
+            meta.get("topic", ""), meta.get("stance_type", "affirmative"), mr.reply,
+            on_result=lambda ok, label: None if ok else record_misalignment(cid, label),
+        )
+
+    history.append(ChatMessage(role="assistant", message=mr.reply))
+    new_messages = [m.model_dump(by_alias=True) for m in history[-2:]]
+    conv["messages"] = [m.model_dump(by_alias=True) for m in history][-MAX_STORED_MESSAGES:]
+    return TurnResult(cid=cid, conv=conv, reply=mr, new_messages=new_messages, created=created)
+
+
+def ask_response(result: TurnResult, started: float) -> AskResponse:
+    """AskResponse for a finished turn (last 5 messages, latency since `started`)."""
+    return AskResponse(
+        conversation_id=result.cid,
+        message=last_n([ChatMessage(**m) for m in result.conv["messages"]], n=5),
+        latency_ms=int((time.time() - started) * 1000),
+        stance=result.reply.stance,
+    )
+
+
+def ask_turn(cid: Optional[str], message: str, started: float, new: bool = False) -> AskResponse:
+    """
+    Load, run and save one turn (the /ask path, shared by the HTTP handler and job workers).
+    `new=True` creates the conversation under a caller-assigned `cid` if it does not exist yet
+    (job mode hands the cid out up front; a retried job finds it already created).
+    The save is a versioned compare-and-set; a concurrent turn on the same conversation is handled
+    per CONV_CONFLICT_POLICY (merge | reject -> ConversationConflict | queue = re-run on the newer state).
+    """
+    attempt = 0
+    while True:
+        conv = get_conversation(cid) if cid else None
+        if cid and not conv and not new:
+            raise ConversationNotFound(cid)
+        base_meta = copy.deepcopy(conv["meta"]) if conv else {}
+        result = run_turn(cid, conv, message)
+        try:
+            save_conversation(result.cid, result.conv)
+            return ask_response(result, started)
+        except ConversationConflict:
+            metrics.incr("conv_conflicts", policy=CONV_CONFLICT_POLICY)
+            if CONV_CONFLICT_POLICY == "reject" or attempt >= CONV_CAS_RETRIES:
+                raise
+            if CONV_CONFLICT_POLICY == "merge":
+                result.conv = merge_save(result, base_meta)
+                return ask_response(result, started)
+            cid, attempt = result.cid, attempt + 1  # queue: run the turn again on top of the newer state
+
+
+def merge_save(result: TurnResult, base_meta: dict) -> dict:
+    """Append this turn to whatever is stored now, retrying the CAS while other turns keep landing."""
+    attempt = 0
+    while True:
+        latest = get_conversation(result.cid) or {"meta": {}, "messages": []}
+        merged = merge_turn(latest, result.conv, base_meta, result.new_messages, MAX_STORED_MESSAGES)
+        try:
+            save_conversation(result.cid, merged)
+            return merged
+        except ConversationConflict:
+            if attempt >= CONV_CAS_RETRIES:
+                raise
+            attempt += 1
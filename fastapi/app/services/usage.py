@@ -0,0 +1,126 @@
+from __future__ import annotations
+
+import contextvars
+import sys
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Tuple
+
+from app.config import USAGE_TRACKING, USAGE_DAY_TTL, redis_client
+from app.services import metrics
+from app.services.storage import cid_key, get_store
+
+# Who an LLM call is billed to: (conversation id, profile id); set around a turn by run_turn.
+_scope: contextvars.ContextVar[Optional[Tuple[Optional[str], Optional[str]]]] = contextvars.ContextVar(
+    "usage_scope", default=None)
+
+
+@contextmanager
+def usage_scope(cid: Optional[str], profile_id: Optional[str]) -> Iterator[None]:
+    token = _scope.set((cid, profile_id))
+    try:
+        yield
+    finally:
+        _scope.reset(token)
+
+
+def current_scope() -> Optional[Tuple[Optional[str], Optional[str]]]:
+    """Captured by background work (alignment checks) that runs after the turn's scope is gone."""
+    return _scope.get()
+
+
+def _day_key(ts: Optional[float] = None) -> str:
+    return "usage:day:" + time.strftime("%Y-%m-%d", time.gmtime(ts or time.time()))
+
+
+def cost_usd(model: str, provider: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """Price via LiteLLM's cost map for hosted models (only loaded if LiteLLM already is); local models are free."""
+    if provider in ("ollama", "mock") or (not prompt_tokens and not completion_tokens):
+        return 0.0
+    litellm = sys.modules.get("litellm")
+    if litellm is None:
+        return 0.0
+    try:
+        p, c = litellm.cost_per_token(model=model, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+        return float(p) + float(c)
+    except Exception:
+        return 0.0
+
+
+def record(task: str, model: str, provider: str, prompt_tokens: int, completion_tokens: int,
+           scope: Optional[Tuple[Optional[str], Optional[str]]] = None) -> None:
+    """
+    Account one LLM call: in-process counters (labels task/model/provider/profile) plus Redis running totals
+    per conversation (usage:<cid>, on the conversation's shard) and per UTC day (usage:day:YYYY-MM-DD).
+    """
+    if not USAGE_TRACKING:
+        return
+    cid, profile = scope or _scope.get() or (None, None)
+    prompt_tokens, completion_tokens = int(prompt_tokens or 0), int(completion_tokens or 0)
+    cost = cost_usd(model, provider, prompt_tokens, completion_tokens)
+    labels = dict(task=task, model=model, provider=provider, profile=profile)
+    metrics.incr("llm_prompt_tokens", prompt_tokens, **labels)
+    metrics.incr("llm_completion_tokens", completion_tokens, **labels)
+    if cost:
+        metrics.incr("llm_cost_usd", cost, **labels)
+
+    try:
+        if cid:
+            pipe = get_store().client_for(cid).pipeline(transaction=False)
+            key = cid_key("usage", cid)
+            _incr_fields(pipe, key, "", prompt_tokens, completion_tokens, cost)
+            _incr_fields(pipe, key, f"{task}:", prompt_tokens, completion_tokens, cost)
+            pipe.execute()
+        pipe = redis_client.pipeline(transaction=False)
+        day = _day_key()
+        _incr_fields(pipe, day, "", prompt_tokens, completion_tokens, cost)
+        _incr_fields(pipe, day, f"{provider}:{model}:", prompt_tokens, completion_tokens, cost)
+        if profile:
+            _incr_fields(pipe, day, f"profile:{profile}:", prompt_tokens, completion_tokens, cost)
+        pipe.expire(day, USAGE_DAY_TTL)
+        pipe.execute()
+    except Exception:
+        pass
+
+
+def _incr_fields(pipe, key: str, prefix: str, prompt_tokens: int, completion_tokens: int, cost: float) -> None:
+    pipe.hincrby(key, f"{prefix}prompt_tokens", prompt_tokens)
+    pipe.hincrby(key, f"{prefix}completion_tokens", completion_tokens)
+    pipe.hincrby(key, f"{prefix}calls", 1)
+    if cost:
+        pipe.hincrbyfloat(key, f"{prefix}cost_usd", cost)
+
+
+def _numbers(raw: Dict[str, str]) -> Dict[str, float]:
+    out: Dict[str, float] = {}
+    for k, v in (raw or {}).items():
+        try:
+            out[k] = float(v) if k.endswith("cost_usd") else int(v)
+        except (TypeError, ValueError):
+            continue
+    return out
+
+
+def conversation_usage(cid: str) -> Dict[str, float]:
+    """Running totals for one conversation (`prompt_tokens`, ..., and `<task>:prompt_tokens`, ...)."""
+    try:
+        return _numbers(get_store().client_for(cid, readonly=True).hgetall(cid_key("usage", cid)))
+    except Exception:
+        return {}
+
+
+def day_usage(ts: Optional[float] = None) -> Dict[str, float]:
+    try:
+        return _numbers(redis_client.hgetall(_day_key(ts)))
+    except Exception:
+        return {}
+
+
+def summary() -> dict:
+    """Totals for /metrics: this process since start (from counters) and today across all instances (Redis)."""
+    process = {
+        "prompt_tokens": metrics.counter_total("llm_prompt_tokens"),
+        "completion_tokens": metrics.counter_total("llm_completion_tokens"),
+        "cost_usd": round(metrics.counter_total("llm_cost_usd"), 6),
+    }
+    return {"process": process, "today": day_usage()}
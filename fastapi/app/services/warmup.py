@@ -0,0 +1,179 @@
+from __future__ import annotations
+
+import logging
+import re
+import threading
+import time
+from typing import Dict, Optional
+
+from app.config import (
+    OLLAMA_API_BASE, TASKS, WARMUP_PRELOAD, WARMUP_ACTIVE_WINDOW, WARMUP_REFRESH_MARGIN,
+    WARMUP_INTERVAL, WARMUP_TIMEOUT,
+)
+from app.services import metrics
+from app.services.ollama import get_ollama, ollama_model_name
+
+log = logging.getLogger(__name__)
+
+_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def keep_alive_seconds(value: Optional[str]) -> Optional[float]:
+    """Ollama keep_alive ('10m', '30s', '1h', '300', '-1') in seconds; None = stays loaded forever."""
+    v = (value or "").strip().lower()
+    if not v:
+        return 300.0  # Ollama's default
+    m = re.fullmatch(r"(-?\d+(?:\.\d+)?)(ms|s|m|h)?", v)
+    if not m:
+        return 300.0
+    seconds = float(m.group(1)) * _UNITS[m.group(2) or "s"]
+    return None if seconds < 0 else seconds
+
+
+def resident_models() -> Dict[str, str]:
+    """Ollama models configured in TASKS -> keep_alive (the longest one wins when tasks share a model)."""
+    out: Dict[str, str] = {}
+    for cfg in TASKS.values():
+        model = cfg["model"]
+        if not model.startswith("ollama/"):
+            continue
+        name = ollama_model_name(model)
+        ka = cfg["keep_alive"] or ""
+        cur = out.get(name)
+        if cur is None or _longer(ka, cur):
+            out[name] = ka
+    return out
+
+
+def _longer(a: str, b: str) -> bool:
+    sa, sb = keep_alive_seconds(a), keep_alive_seconds(b)
+    return sa is None or (sb is not None and sa > sb)
+
+
+class ModelWarmer:
+    """
+    Keeps the configured Ollama models in memory while the app has traffic:
+    - preloads each model with an empty /api/generate (loads weights, generates nothing) and its keep_alive;
+    - every WARMUP_INTERVAL s, re-sends that request for models about to expire (within
+      WARMUP_REFRESH_MARGIN s), but only if there was LLM traffic in the last WARMUP_ACTIVE_WINDOW s.
+    Idle apps stop refreshing, so Ollama unloads the models when keep_alive runs out.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state: Dict[str, dict] = {}
+        self._last_traffic = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # -- state --
+
+    def note_use(self, model: str) -> None:
+        """A real call kept `model` resident: push its expiry and mark the app as active."""
+        name = ollama_model_name(model)
+        now = time.time()
+        with self._lock:
+            self._last_traffic = now
+            st = self._state.get(name)
+            if st is not None:
+                ttl = st.get("keep_alive_s")
+                st.update(state="loaded", expires_at=None if ttl is None else now + ttl)
+
+    def states(self) -> Dict[str, dict]:
+        now = time.time()
+        with self._lock:
+            out = {}
+            for name, st in self._state.items():
+                view = {k: v for k, v in st.items() if k != "keep_alive_s"}
+                if st.get("state") == "loaded" and st.get("expires_at") and st["expires_at"] <= now:
+                    view["state"] = "expired"
+                out[name] = view
+            return out
+
+    # -- loading --
+
+    def preload(self, name: str, keep_alive: str) -> bool:
+        ttl = keep_alive_seconds(keep_alive)
+        with self._lock:
+            st = self._state.setdefault(name, {"state": "unknown"})
+            st.update(state="loading", keep_alive=keep_alive or None, keep_alive_s=ttl)
+        t0 = time.perf_counter()
+        try:
+            _, stats = get_ollama().generate(name, "", keep_alive=keep_alive or None, timeout=WARMUP_TIMEOUT)
+        except Exception as e:
+            with self._lock:
+                st.update(state="error", error=str(e))
+            metrics.incr("model_preload", model=name, outcome="error")
+            log.warning("preload of %s failed: %s", name, e)
+            return False
+        elapsed = time.perf_counter() - t0
+        now = time.time()
+        with self._lock:
+            st.update(state="loaded", error=None, loaded_at=now,
+                      expires_at=None if ttl is None else now + ttl,
+                      load_ms=round(stats.get("load_duration", 0) / 1e6, 1))
+        metrics.incr("model_preload", model=name, outcome="ok")
+        metrics.observe("model_preload_seconds", elapsed, model=name)
+        return True
+
+    def preload_all(self) -> None:
+        for name, ka in resident_models().items():
+            if keep_alive_seconds(ka) != 0:
+                self.preload(name, ka)
+
+    def refresh_due(self) -> int:
+        """Refresh models close to expiry if the app saw traffic recently; returns how many were refreshed."""
+        now = time.time()
+        with self._lock:
+            if now - self._last_traffic > WARMUP_ACTIVE_WINDOW:
+                return 0
+            due = [(n, st.get("keep_alive") or "") for n, st in self._state.items()
+                   if st.get("state") in ("loaded", "error")
+                   and (st.get("state") == "error"
+                        or (st.get("expires_at") is not None and st["expires_at"] - now <= WARMUP_REFRESH_MARGIN))]
+        refreshed = 0
+        for name, ka in due:
+            refreshed += self.preload(name, ka)
+        return refreshed
+
+    # -- scheduler --
+
+    def start(self) -> None:
+        if not WARMUP_PRELOAD or not OLLAMA_API_BASE or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="model-warmer", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        try:
+            self.preload_all()
+        except Exception as e:
+            log.warning("model preload failed: %s", e)
+        while not self._stop.wait(WARMUP_INTERVAL):
+            try:
+                self.refresh_due()
+            except Exception as e:
+                log.warning("model refresh failed: %s", e)
+
+
+warmer = ModelWarmer()
+
+
+def note_use(model: str) -> None:
+    warmer.note_use(model)
+
+
+def model_states() -> Dict[str, dict]:
+    return warmer.states()
+
+
+def start_warmer() -> None:
+    warmer.start()
+
+
+def stop_warmer() -> None:
+    warmer.stop()
@@ -0,0 +1,73 @@
+"""
+Bulk export of stored conversations as NDJSON (one conversation per line), shard by shard with
+incremental SCAN and pipelined GETs; memory stays flat whatever the dataset size.
+
+    python -m app.tools.export -o debates.ndjson.gz [--profile smart_shy] [--topic vaccines] \
+        [--since 2026-01-01] [--until 2026-02-01] [--cursor-file export.cursor]
+
+`.gz` outputs are gzip-compressed. With --cursor-file the position is saved after every batch and an
+interrupted run resumes from it (appending); the file is removed when the export completes.
+"""
+from __future__ import annotations
+
+import argparse
+import gzip
+import json
+import os
+import sys
+
+from app.config import EXPORT_BATCH
+from app.services.export import ExportFilter, iter_batches, parse_date
+
+
+def main(argv=None) -> None:
+    ap = argparse.ArgumentParser(description="Export conversations as NDJSON.")
+    ap.add_argument("-o", "--output", default="-", help="output file ('-' for stdout; '.gz' = gzip)")
+    ap.add_argument("--profile", default=None, help="only this profile_id")
+    ap.add_argument("--topic", default=None, help="topic contains (case-insensitive)")
+    ap.add_argument("--since", default=None, help="created at or after (ISO date/time, UTC)")
+    ap.add_argument("--until", default=None, help="created before (ISO date/time, UTC)")
+    ap.add_argument("--cursor", default=None, help="start from this cursor")
+    ap.add_argument("--cursor-file", default=None, help="save/resume the cursor here")
+    ap.add_argument("--gzip", action="store_true", help="gzip even if the name does not end in .gz")
+    ap.add_argument("--batch", type=int, default=EXPORT_BATCH, help="SCAN COUNT hint")
+    args = ap.parse_args(argv)
+
+    flt = ExportFilter(profile_id=args.profile, topic=args.topic,
+                       since=parse_date(args.since), until=parse_date(args.until))
+    cursor = args.cursor
+    resuming = False
+    if args.cursor_file and os.path.exists(args.cursor_file):
+        with open(args.cursor_file, encoding="utf-8") as fh:
+            cursor = fh.read().strip() or cursor
+        resuming = True
+
+    compress = args.gzip or args.output.endswith(".gz")
+    mode = "ab" if resuming else "wb"
+    if args.output == "-":
+        out = gzip.GzipFile(fileobj=sys.stdout.buffer, mode="wb") if compress else sys.stdout.buffer
+    else:
+        out = gzip.open(args.output, mode) if compress else open(args.output, mode)
+
+    exported = 0
+    try:
+        for records, next_cursor in iter_batches(flt, cursor, args.batch):
+            for r in records:
+                out.write((json.dumps(r, ensure_ascii=False) + "\n").encode("utf-8"))
+            exported += len(records)
+            out.flush()
+            if args.cursor_file:
+                if next_cursor is None:
+                    if os.path.exists(args.cursor_file):
+                        os.remove(args.cursor_file)
+                else:
+                    with open(args.cursor_file, "w", encoding="utf-8") as fh:
+                        fh.write(next_cursor)
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+    print(f"exported={exported}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Move per-conversation keys between Redis shard layouts (e.g. after adding a shard).
+
+    OLD=redis://redis-1:6379/0,redis://redis-2:6379/0
+    NEW=$OLD,redis://redis-3:6379/0
+    # 1) copy keys whose owner changes to their new node; the old copies keep serving traffic
+    python -m app.tools.rebalance --from $OLD --to $NEW
+    # 2) deploy with REDIS_SHARDS=$NEW
+    # 3) re-sync whatever changed on the old owners since step 1, then delete those copies
+    python -m app.tools.rebalance --from $OLD --to $NEW --purge
+
+`--from` defaults to the running config (REDIS_SHARDS / REDIS_URL) and `--add URL` is shorthand for
+`--to <from>,URL`. Keys are copied with DUMP/RESTORE so TTLs survive, and only when the source is newer:
+conversations compare their CAS "version", other keys are copied only if the owner does not have them.
+So re-running either step is safe and never overwrites a turn saved on the new owner after the deploy.
+Counters (align/usage) bumped on the old owner between steps 1 and 2 are not merged into an existing
+copy; stop writes for that window (or skip step 1 and run only step 3 right after the deploy) if they
+must be exact.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+from typing import Dict, List, Optional
+
+from app.config import REDIS_SHARDS, REDIS_URL, REDIS_SHARD_VNODES
+from app.services.storage import CID_KEY_PREFIXES, HashRing, _client, cid_from_key, parse_shards
+
+
+def _version(client, key) -> Optional[int]:
+    raw = client.get(key)
+    if raw is None:
+        return None
+    try:
+        return int(json.loads(raw).get("version") or 0)
+    except (ValueError, AttributeError):
+        return 0
+
+
+def _src_newer(src, dst, key: str, prefix: str) -> bool:
+    if prefix == "conv":
+        theirs = _version(dst, key)
+        return theirs is None or (_version(src, key) or 0) > theirs
+    return not dst.exists(key)
+
+
+def rebalance(old_nodes: List[str], new_nodes: List[str], clients: Dict[str, object],
+              purge: bool = False, dry_run: bool = False, batch: int = 500) -> Dict[str, int]:
+    """
+    Walk every per-conversation key on `old_nodes`; keys owned by another node under `new_nodes` are
+    copied there when the source is newer ("copied") or already up to date ("current"). With `purge`
+    the source copy is then deleted. Keys already on their owner count as "kept".
+    """
+    ring = HashRing(new_nodes, vnodes=REDIS_SHARD_VNODES)
+    stats = {"scanned": 0, "copied": 0, "current": 0, "purged": 0, "kept": 0}
+    for node in old_nodes:
+        src = clients[node]
+        for prefix in CID_KEY_PREFIXES:
+            for key in src.scan_iter(match=f"{prefix}:*", count=batch):
+                key = key.decode("utf-8") if isinstance(key, bytes) else key
+                cid = cid_from_key(key)
+                if not cid:
+                    continue
+                stats["scanned"] += 1
+                owner = ring.node_for(cid)
+                if owner == node:
+                    stats["kept"] += 1
+                    continue
+                dst = clients[owner]
+                if _src_newer(src, dst, key, prefix):
+                    payload, ttl = src.dump(key), src.pttl(key)
+                    if payload is None:
+                        continue  # expired/deleted while scanning
+                    if not dry_run:
+                        dst.restore(key, ttl if ttl and ttl > 0 else 0, payload, replace=True)
+                    stats["copied"] += 1
+                else:
+                    stats["current"] += 1
+                if purge:
+                    if not dry_run:
+                        src.delete(key)
+                    stats["purged"] += 1
+    return stats
+
+
+def _nodes(spec: str) -> List[str]:
+    return [url for url, _ in parse_shards(spec)]
+
+
+def main(argv=None) -> None:
+    ap = argparse.ArgumentParser(description="Rebalance conversation keys across Redis shards.")
+    ap.add_argument("--from", dest="from_", default=REDIS_SHARDS or REDIS_URL,
+                    help="current shard primaries, comma separated (default: REDIS_SHARDS / REDIS_URL)")
+    ap.add_argument("--to", default=None, help="target shard primaries, comma separated")
+    ap.add_argument("--add", action="append", default=[], help="shorthand: --to is --from plus this URL (repeatable)")
+    ap.add_argument("--purge", action="store_true", help="after syncing, delete keys from nodes that no longer own them")
+    ap.add_argument("--dry-run", action="store_true")
+    ap.add_argument("--batch", type=int, default=500, help="SCAN COUNT hint")
+    args = ap.parse_args(argv)
+
+    old_nodes = _nodes(args.from_)
+    new_nodes = _nodes(args.to) if args.to else old_nodes + [u for u in args.add if u not in old_nodes]
+    if not old_nodes or not new_nodes:
+        ap.error("both layouts need at least one node")
+    if new_nodes == old_nodes:
+        ap.error("nothing to do: --to is the same layout as --from")
+
+    # Raw byte clients: DUMP payloads are binary.
+    clients = {u: _client(u, decode=False) for u in dict.fromkeys(old_nodes + new_nodes)}
+    stats = rebalance(old_nodes, new_nodes, clients, purge=args.purge, dry_run=args.dry_run, batch=args.batch)
+    print(("[dry-run] " if args.dry_run else "") + " ".join(f"{k}={v}" for k, v in stats.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+"""
+Offline replay of a JSONL debate corpus through the real turn pipeline (classifier, intent, agreement,
+generate_reply, guards), without the HTTP server or Redis.
+
+    python -m app.tools.replay corpus.jsonl -o results.jsonl --processes 8 [--fake] [--limit N]
+
+Corpus lines: {"id": "c1", "turns": ["msg", ...], "expect": {"topic": "...", "user_side": "affirmative"}}
+("turns" items may also be {"message": "..."}; "expect" is optional).
+Output: one line per turn (latency, provider/model per LLM task, stance checks); summary on stderr.
+`--fake` uses the deterministic LLM_MOCK provider; otherwise the configured Ollama/OpenAI models are called.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from collections import Counter
+from typing import Dict, Iterator, List, Optional
+
+
+class _LocalKV:
+    """Process-local stand-in for the per-conversation Redis keys (misalignment flags)."""
+
+    def __init__(self):
+        self._data: Dict[str, str] = {}
+
+    def get(self, key):
+        return self._data.get(key)
+
+    def set(self, key, value, **kw):
+        self._data[key] = value
+        return True
+
+    def delete(self, *keys):
+        return sum(self._data.pop(k, None) is not None for k in keys)
+
+
+def _init_worker() -> None:
+    from app.services import storage
+    storage.set_store(storage.ConversationStore.from_clients([_LocalKV()]))
+
+
+def _turn_messages(item: dict) -> List[str]:
+    turns = item.get("turns") or item.get("messages") or []
+    return [t.get("message", "") if isinstance(t, dict) else str(t) for t in turns]
+
+
+def _llm_calls() -> Dict[str, Dict[str, str]]:
+    """Successful LLM calls since the last metrics reset: task -> {provider, model}."""
+    from app.services import metrics
+    out: Dict[str, Dict[str, str]] = {}
+    for t in metrics.snapshot()["timings"]:
+        lbl = t["labels"]
+        if t["name"] == "llm_call_seconds" and lbl.get("outcome") == "ok":
+            out[lbl.get("task", "?")] = {"provider": lbl.get("provider", "?"), "model": lbl.get("model", "?")}
+    return out
+
+
+def replay_conversation(item: dict) -> List[dict]:
+    """Run every turn of one corpus conversation in memory; one result record per turn."""
+    from app.config import ASK_DEADLINE_SECONDS
+    from app.services import metrics
+    from app.services.deadline import deadline_scope
+    from app.services.guards import detect_refusal_text, looks_off_topic_or_flip
+    from app.services.turns import run_turn
+
+    conv_id = str(item.get("id") or item.get("conversation_id") or "")
+    expect = item.get("expect") or {}
+    cid, conv, first_side = f"replay-{conv_id or os.getpid()}", None, None
+    records: List[dict] = []
+    for i, message in enumerate(_turn_messages(item)):
+        rec: dict = {"id": conv_id, "turn": i, "user": message}
+        metrics.reset()
+        t0 = time.perf_counter()
+        try:
+            with deadline_scope(ASK_DEADLINE_SECONDS):
+                result = run_turn(cid, conv, message)
+        except Exception as e:
+            rec.update(latency_ms=round((time.perf_counter() - t0) * 1000, 1), error=f"{type(e).__name__}: {e}",
+                       ok=False)
+            records.append(rec)
+            continue
+        rec["latency_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+        conv = result.conv
+        meta = conv["meta"]
+        expected_stance = "pro" if meta.get("stance_type") == "affirmative" else "contra"
+        first_side = first_side or meta.get("side")
+        checks = {
+            "stance_matches_meta": result.reply.stance == expected_stance,
+            "side_stable": meta.get("side") == first_side,
+            "no_refusal": not detect_refusal_text(result.reply.reply),
+            "on_topic": not looks_off_topic_or_flip(result.reply.reply, meta.get("topic", "")),
+        }
+        if i == 0 and expect.get("topic"):
+            checks["expected_topic"] = expect["topic"].strip().lower() in meta.get("topic", "").lower()
+        if i == 0 and expect.get("user_side"):
+            checks["expected_user_side"] = expect["user_side"] == meta.get("user_side")
+        rec.update(
+            reply=result.reply.reply, topic=meta.get("topic"), side=meta.get("side"),
+            stance=result.reply.stance, guard_verdict=result.reply.guard_verdict,
+            llm=_llm_calls(), checks=checks, ok=all(checks.values()),
+        )
+        records.append(rec)
+    return records
+
+
+def _read_corpus(path: str, limit: Optional[int]) -> Iterator[dict]:
+    with (sys.stdin if path == "-" else open(path, encoding="utf-8")) as fh:
+        n = 0
+        for line in fh:
+            line = line.strip()
+            if not line:
+                continue
+            yield json.loads(line)
+            n += 1
+            if limit and n >= limit:
+                return
+
+
+def _pct(vals: List[float], q: float) -> float:
+    if not vals:
+        return 0.0
+    return vals[min(len(vals) - 1, int(round(q * (len(vals) - 1))))]
+
+
+def summarize(records: List[dict], wall_seconds: float, conversations: int) -> dict:
+    lat = sorted(r["latency_ms"] for r in records if "latency_ms" in r)
+    providers = Counter(f"{task}:{c['provider']}" for r in records for task, c in (r.get("llm") or {}).items())
+    failed = Counter(k for r in records for k, ok in (r.get("checks") or {}).items() if not ok)
+    return {
+        "conversations": conversations,
+        "turns": len(records),
+        "errors": sum(1 for r in records if r.get("error")),
+        "failed_checks": dict(failed),
+        "wall_seconds": round(wall_seconds, 2),
+        "turns_per_second": round(len(records) / wall_seconds, 2) if wall_seconds > 0 else 0.0,
+        "latency_ms": {
+            "avg": round(sum(lat) / len(lat), 1) if lat else 0.0,
+            "p50": _pct(lat, 0.50), "p90": _pct(lat, 0.90), "p95": _pct(lat, 0.95), "p99": _pct(lat, 0.99),
+            "max": lat[-1] if lat else 0.0,
+        },
+        "providers": dict(providers),
+    }
+
+
+def main(argv=None) -> None:
+    ap = argparse.ArgumentParser(description="Replay a JSONL debate corpus through the turn pipeline.")
+    ap.add_argument("corpus", help="input JSONL ('-' for stdin)")
+    ap.add_argument("-o", "--output", default="-", help="per-turn results JSONL ('-' for stdout)")
+    ap.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--fake", action="store_true", help="deterministic offline provider (LLM_MOCK=1)")
+    ap.add_argument("--fake-latency", type=float, default=0.0, help="seconds added to each fake LLM call")
+    ap.add_argument("--limit", type=int, default=None, help="replay only the first N conversations")
+    ap.add_argument("--summary", default=None, help="also write the summary JSON to this file")
+    args = ap.parse_args(argv)
+
+    # Must be set before app.config is imported (here and in the pool workers).
+    if args.fake:
+        os.environ["LLM_MOCK"] = "1"
+        os.environ["LLM_MOCK_LATENCY"] = str(args.fake_latency)
+    os.environ["PREGEN_ENABLED"] = "0"
+    os.environ["SINGLEFLIGHT_REDIS"] = "0"
+    os.environ["USAGE_TRACKING"] = "0"
+
+    import app.services.turns  # noqa: F401  (loaded once here; forked workers inherit it)
+
+    out = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    records: List[dict] = []
+    conversations = 0
+    started = time.perf_counter()
+    corpus = _read_corpus(args.corpus, args.limit)
+    try:
+        if args.processes <= 1:
+            _init_worker()
+            results = map(replay_conversation, corpus)
+            pool = None
+        else:
+            pool = multiprocessing.Pool(args.processes, initializer=_init_worker)
+            results = pool.imap_unordered(replay_conversation, corpus)
+        for recs in results:
+            conversations += 1
+            for rec in recs:
+                out.write(json.dumps(rec, ensure_ascii=False) + "\n")
+                records.append({k: rec[k] for k in ("latency_ms", "error", "checks", "llm") if k in rec})
+            out.flush()
+        if pool is not None:
+            pool.close()
+            pool.join()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    summary = summarize(records, time.perf_counter() - started, conversations)
+    print(json.dumps(summary, indent=2), file=sys.stderr)
+    if args.summary:
+        with open(args.summary, "w", encoding="utf-8") as fh:
+            json.dump(summary, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
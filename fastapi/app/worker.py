@@ -0,0 +1,60 @@
+"""
+Job-mode worker pool: consumes /ask turns from the Redis Stream (see app.services.jobs).
+
+    python -m app.worker [--processes N] [--threads M]
+
+Scale it independently of the API (more processes/machines = more LLM throughput).
+"""
+from __future__ import annotations
+
+import argparse
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+
+from app.config import WORKER_PROCESSES, WORKER_THREADS
+from app.services.jobs import JobWorker
+
+
+def run_process(threads: int) -> None:
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    base = f"{socket.gethostname()}-{os.getpid()}"
+    workers = [threading.Thread(target=JobWorker(f"{base}-{i}").run, args=(stop,), daemon=True)
+               for i in range(max(1, threads))]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+
+
+def main(argv=None) -> None:
+    ap = argparse.ArgumentParser(description="Run /ask job workers.")
+    ap.add_argument("--processes", type=int, default=WORKER_PROCESSES)
+    ap.add_argument("--threads", type=int, default=WORKER_THREADS, help="consumers per process")
+    args = ap.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(processName)s %(levelname)s %(message)s")
+
+    if args.processes <= 1:
+        run_process(args.threads)
+        return
+    procs = [multiprocessing.Process(target=run_process, args=(args.threads,), name=f"worker-{i}")
+             for i in range(args.processes)]
+    for p in procs:
+        p.start()
+    try:
+        for p in procs:
+            p.join()
+    except KeyboardInterrupt:
+        for p in procs:
+            p.terminate()
+        for p in procs:
+            p.join()
+
+
+if __name__ == "__main__":
+    main()
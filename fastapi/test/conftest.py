@@ -1,4 +1,8 @@
+import fnmatch
+import json
+import math
 import os
+import time
 import sys
 import types
 import importlib
@@ -14,6 +18,7 @@ if str(ROOT) not in sys.path:
 
 os.environ.setdefault("OLLAMA_BASE_URL", "http://fake-ollama:11434")
 os.environ.setdefault("OPENAI_API_KEY", "test-key")
+os.environ.setdefault("RATE_LIMIT_ENABLED", "0")  # test_ratelimit turns it on for its own cases
 
 if "app.profiles" not in sys.modules:
     profiles_shim = types.ModuleType("app.profiles")
@@ -49,11 +54,150 @@ class FakeRedis:
         self._hash = {}
     def ping(self): return True
     def get(self, k): return self._kv.get(k)
-    def set(self, k, v): self._kv[k] = v; return True
+    def set(self, k, v, ex=None, px=None, nx=False):
+        if nx and k in self._kv: return None
+        self._kv[k] = v; return True
     def delete(self, k): self._kv.pop(k, None); self._hash.pop(k, None); return 1
     def hget(self, name, key): return self._hash.get(name, {}).get(key)
-    def hset(self, name, key, value):
-        self._hash.setdefault(name, {})[key] = value; return 1
+    def hset(self, name, key=None, value=None, mapping=None):
+        h = self._hash.setdefault(name, {})
+        items = dict(mapping or {}, **({key: value} if key is not None else {}))
+        h.update({k: str(v) for k, v in items.items()}); return len(items)
+    def scan(self, cursor=0, match=None, count=10):
+        keys = sorted(k for k in self._kv if match is None or fnmatch.fnmatchcase(k, match))
+        page = keys[int(cursor):int(cursor) + count]
+        nxt = int(cursor) + count
+        return (nxt if nxt < len(keys) else 0), page
+    def scan_iter(self, match=None, count=10):
+        return iter(sorted(k for k in list(self._kv) + list(self._hash) if match is None or fnmatch.fnmatchcase(k, match)))
+    # DUMP/RESTORE twins for the rebalance tool: the "payload" is just a copy of the value
+    def dump(self, k):
+        if k in self._kv: return ("kv", self._kv[k])
+        if k in self._hash: return ("hash", dict(self._hash[k]))
+        return None
+    def pttl(self, k): return -1 if k in self._kv or k in self._hash else -2
+    def restore(self, k, ttl, payload, replace=False):
+        kind, value = payload
+        self.delete(k)
+        (self._kv if kind == "kv" else self._hash)[k] = value
+        return True
+    def hdel(self, name, *keys):
+        h = self._hash.get(name, {}); return sum(h.pop(k, None) is not None for k in keys)
+    def publish(self, channel, message): return 0
+    def hgetall(self, name): return {k: str(v) for k, v in self._hash.get(name, {}).items()}
+    def hincrby(self, name, key, amount=1):
+        h = self._hash.setdefault(name, {}); h[key] = int(h.get(key, 0)) + amount; return h[key]
+    def hincrbyfloat(self, name, key, amount=1.0):
+        h = self._hash.setdefault(name, {}); h[key] = float(h.get(key, 0)) + amount; return h[key]
+    def expire(self, name, seconds): return True
+    def exists(self, k): return int(k in self._kv or k in self._hash)
+    # lists / sets / sorted sets live in _hash too (keyed by name), enough for the pool-style callers
+    def rpush(self, name, *values): self._hash.setdefault(name, []).extend(values); return len(self._hash[name])
+    def lpop(self, name):
+        lst = self._hash.get(name) or []; return lst.pop(0) if lst else None
+    def lindex(self, name, i):
+        lst = self._hash.get(name) or []; return lst[i] if -len(lst) <= i < len(lst) else None
+    def llen(self, name): return len(self._hash.get(name) or [])
+    def sadd(self, name, *values): s = self._hash.setdefault(name, set()); n = len(s); s.update(values); return len(s) - n
+    def srem(self, name, *values): s = self._hash.get(name, set()); n = len(s); s.difference_update(values); return n - len(s)
+    def smembers(self, name): return set(self._hash.get(name) or ())
+    def zincrby(self, name, amount, member):
+        z = self._hash.setdefault(name, {}); z[member] = z.get(member, 0) + amount; return z[member]
+    def zadd(self, name, mapping):
+        z = self._hash.setdefault(name, {}); z.update(mapping); return len(mapping)
+    def zrevrange(self, name, start, end):
+        z = self._hash.get(name) or {}; ranked = sorted(z, key=lambda m: -z[m]); return ranked[start:end + 1]
+    def pipeline(self, transaction=True): return FakePipeline(self)
+    def eval(self, script, numkeys, *args):
+        from app.services import ratelimit, storage
+        if script == ratelimit._BUCKET:
+            return self._bucket(*args)
+        from app.services import jobs
+        if script == jobs._PROMOTE:
+            delayed, stream, now, limit, maxlen = args
+            z = self._hash.get(delayed) or {}
+            due = sorted((m for m in z if z[m] <= float(now)), key=lambda m: z[m])[:int(limit)]
+            for raw in due:
+                del z[raw]
+                self.xadd(stream, json.loads(raw))
+            return len(due)
+        if script == storage.RELEASE_LOCK:
+            if self._kv.get(args[0]) != args[1]: return 0
+            del self._kv[args[0]]; return 1
+        # Otherwise the conversation compare-and-set script (storage._CAS_SAVE).
+        key, expected, raw = args[0], int(args[1]), args[2]
+        cur = self._kv.get(key)
+        version = int(json.loads(cur).get("version") or 0) if cur else 0
+        if version != expected:
+            return [0, version]
+        self._kv[key] = raw
+        return [1, version]
+
+
+    # Streams with one consumer-group emulation: enough for app.services.jobs. Idle times use `now_ms`.
+    def _now_ms(self):
+        return self.now_ms if getattr(self, "now_ms", None) is not None else int(time.time() * 1000)
+    def xgroup_create(self, name, group, id="0", mkstream=False):
+        st = self._hash.setdefault(name, {"entries": [], "groups": {}, "seq": 0})
+        if group in st["groups"]:
+            import redis
+            raise redis.ResponseError("BUSYGROUP Consumer Group name already exists")
+        st["groups"][group] = {"last": 0, "pending": {}}
+        return True
+    def xadd(self, name, fields, maxlen=None, approximate=True):
+        st = self._hash.setdefault(name, {"entries": [], "groups": {}, "seq": 0})
+        st["seq"] += 1
+        entry_id = f"{st['seq']}-0"
+        st["entries"].append((st["seq"], entry_id, {k: str(v) for k, v in fields.items()}))
+        return entry_id
+    def xreadgroup(self, group, consumer, streams, count=1, block=None):
+        out = []
+        for name in streams:
+            st = self._hash.get(name) or {"entries": [], "groups": {}}
+            g = st["groups"][group]
+            fresh = [e for e in st["entries"] if e[0] > g["last"]][:count]
+            for seq, entry_id, fields in fresh:
+                g["last"] = seq
+                g["pending"][entry_id] = {"consumer": consumer, "at": self._now_ms(), "fields": fields}
+            if fresh:
+                out.append([name, [(entry_id, fields) for _, entry_id, fields in fresh]])
+        return out
+    def xack(self, name, group, *ids):
+        g = self._hash[name]["groups"][group]
+        return sum(g["pending"].pop(i, None) is not None for i in ids)
+    def xautoclaim(self, name, group, consumer, min_idle_time, start_id="0-0", count=10):
+        g = self._hash[name]["groups"][group]
+        claimed = []
+        for entry_id, p in list(g["pending"].items())[:count]:
+            if self._now_ms() - p["at"] >= min_idle_time:
+                p.update(consumer=consumer, at=self._now_ms())
+                claimed.append((entry_id, p["fields"]))
+        return ["0-0", claimed, []]
+    def xlen(self, name): return len((self._hash.get(name) or {}).get("entries", []))
+
+    def _bucket(self, key, capacity, rate, cost):
+        # Python twin of ratelimit._BUCKET; `now_ms` can be pinned by tests.
+        now = self.now_ms if getattr(self, "now_ms", None) is not None else int(time.time() * 1000)
+        h = self._hash.setdefault(key, {})
+        tokens, ts = float(h.get("tokens", capacity)), int(h.get("ts", now))
+        tokens = min(capacity, tokens + max(0, now - ts) * rate)
+        allowed, wait = 0, 0
+        if tokens >= cost:
+            tokens, allowed = tokens - cost, 1
+        else:
+            wait = math.ceil((cost - tokens) / rate)
+        h.update(tokens=tokens, ts=now)
+        return [allowed, math.floor(tokens), wait, math.ceil((capacity - tokens) / rate)]
+
+
+class FakePipeline:
+    def __init__(self, r):
+        self._r, self._calls = r, []
+    def __getattr__(self, name):
+        return lambda *a, **kw: self._calls.append((name, a, kw)) or self
+    def execute(self):
+        calls, self._calls = self._calls, []
+        return [getattr(self._r, n)(*a, **kw) for n, a, kw in calls]
 
 
 @pytest.fixture(scope="session")
@@ -69,6 +213,12 @@ def client():
     except Exception:
         pass
 
+    try:
+        import app.services.storage as storage
+        storage.set_store(storage.ConversationStore.from_clients([fake]))
+    except Exception:
+        pass
+
     try:
         import app.api.v1.endpoints as endpoints
         endpoints.redis_client = fake
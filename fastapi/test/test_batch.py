@@ -0,0 +1,106 @@
+import json
+
+import pytest
+
+from conftest import FakeRedis
+
+
+@pytest.fixture
+def fake_turns(monkeypatch):
+    """Stand-in for run_turn: echoes the message and appends it to the in-memory conversation."""
+    from app.models import ModelReply
+    from app.services import batch, storage
+    from app.services.turns import TurnResult
+
+    r = FakeRedis()
+    monkeypatch.setattr(storage, "_store", storage.ConversationStore.from_clients([r, FakeRedis()]))
+
+    def run_turn(cid, conv, message):
+        if message == "boom":
+            raise RuntimeError("llm down")
+        created = conv is None
+        conv = conv or {"meta": {"profile_id": "smart_shy"}, "messages": []}
+        new = [{"role": "user", "message": message}, {"role": "assistant", "message": f"re: {message}"}]
+        conv["messages"] = conv["messages"] + new
+        return TurnResult(cid=cid or f"new-{message}", conv=conv, reply=ModelReply(stance="pro", reply=new[1]["message"]),
+                          new_messages=new, created=created)
+    monkeypatch.setattr(batch, "run_turn", run_turn)
+    return r
+
+
+def test_batch_runs_turns_and_saves_in_order(client, fake_turns):
+    from app.services.conversation import get_conversation, save_conversation
+    save_conversation("b1", {"meta": {"profile_id": "smart_shy"}, "messages": []})
+    items = [
+        {"conversation_id": "b1", "message": "one"},
+        {"message": "fresh"},
+        {"conversation_id": "b1", "message": "two"},
+        {"conversation_id": "missing", "message": "x"},
+        {"message": "boom"},
+    ]
+    r = client.post("/api/v1/ask/batch", json={"items": items})
+    assert r.status_code == 200
+    res = r.json()["results"]
+    assert [x["index"] for x in res] == [0, 1, 2, 3, 4]
+    assert [x["status"] for x in res] == [200, 200, 200, 404, 500]
+    assert res[1]["response"]["conversation_id"] == "new-fresh"
+
+    stored = get_conversation("b1")
+    assert [m["message"] for m in stored["messages"]] == ["one", "re: one", "two", "re: two"]
+    assert stored["version"] == 2  # both turns of b1 saved with a single CAS
+    assert get_conversation("new-fresh")["version"] == 1
+
+
+def test_batch_stream_and_limits(client, fake_turns, monkeypatch):
+    r = client.post("/api/v1/ask/batch?stream=true", json={"items": [{"message": "a"}, {"message": "b"}]})
+    lines = [json.loads(x) for x in r.text.splitlines()]
+    assert sorted(x["index"] for x in lines) == [0, 1] and all(x["status"] == 200 for x in lines)
+
+    import app.api.v1.endpoints as endpoints
+    monkeypatch.setattr(endpoints, "BATCH_MAX_ITEMS", 1)
+    assert client.post("/api/v1/ask/batch", json={"items": [{"message": "a"}, {"message": "b"}]}).status_code == 413
+    assert client.post("/api/v1/ask/batch", json={"items": []}).status_code == 422
+
+
+def test_batch_rate_limits(client, fake_turns, monkeypatch):
+    from app.services import ratelimit
+    from app.services.conversation import save_conversation
+    r = FakeRedis()
+    r.now_ms = 1_000_000
+    monkeypatch.setattr(ratelimit, "redis_client", r)
+    monkeypatch.setattr(ratelimit, "RATE_LIMIT_ENABLED", True)
+    monkeypatch.setattr(ratelimit, "RATE_LIMITS", {"ask": (2, 60), "ask_batch": (5, 60), "ask_conversation": (3, 60)})
+    save_conversation("rl1", {"meta": {"profile_id": "smart_shy"}, "messages": []})
+
+    # larger than the /ask bucket is fine: batches have their own
+    r1 = client.post("/api/v1/ask/batch", json={"items": [{"message": f"m{i}"} for i in range(4)]})
+    assert r1.status_code == 200 and r1.headers["RateLimit-Remaining"] == "1"
+    # a batch that can never fit the bucket is refused as too large, not told to retry
+    r2 = client.post("/api/v1/ask/batch", json={"items": [{"message": f"m{i}"} for i in range(6)]})
+    assert r2.status_code == 413 and "Retry-After" not in r2.headers
+
+    # every turn of a conversation takes one ask_conversation token
+    r.now_ms += 60_000
+    same = {"items": [{"conversation_id": "rl1", "message": "x"}] * 4}
+    assert client.post("/api/v1/ask/batch", json=same).status_code == 413
+    ratelimit.check("ask_conversation", "rl1", 2)
+    r3 = client.post("/api/v1/ask/batch", json={"items": [{"conversation_id": "rl1", "message": "x"}] * 2})
+    assert r3.status_code == 429 and "ask_conversation" in r3.json()["detail"]
+
+
+def test_each_turn_of_a_group_gets_its_own_deadline(client, fake_turns, monkeypatch):
+    import time
+    from app.services import batch
+    from app.services.conversation import save_conversation
+    from app.services.deadline import check_deadline
+    save_conversation("b9", {"meta": {"profile_id": "smart_shy"}, "messages": []})
+    echo = batch.run_turn
+
+    def slow(cid, conv, message):
+        time.sleep(0.4)
+        check_deadline("llm")
+        return echo(cid, conv, message)
+    monkeypatch.setattr(batch, "run_turn", slow)
+    monkeypatch.setattr(batch, "ASK_DEADLINE_SECONDS", 1.0)
+    r = client.post("/api/v1/ask/batch", json={"items": [{"conversation_id": "b9", "message": m} for m in "abc"]})
+    assert [x["status"] for x in r.json()["results"]] == [200, 200, 200]
@@ -0,0 +1,32 @@
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+# Cold `import app.main` must stay cheap: provider SDKs (LiteLLM) load lazily on first use.
+IMPORT_BUDGET_SECONDS = float(os.getenv("IMPORT_BUDGET_SECONDS", "2.5"))
+
+_PROBE = (
+    "import json, sys, time\n"
+    "t = time.perf_counter()\n"
+    "import app.main\n"
+    "print(json.dumps({'seconds': time.perf_counter() - t, 'litellm': 'litellm' in sys.modules}))\n"
+)
+
+
+def test_cold_import_of_app_main_is_within_budget():
+    root = Path(__file__).resolve().parents[1]
+    out = subprocess.run([sys.executable, "-c", _PROBE], cwd=root, capture_output=True, text=True,
+                         timeout=60, env={**os.environ, "PYTHONDONTWRITEBYTECODE": "1"})
+    assert out.returncode == 0, out.stderr
+    probe = json.loads(out.stdout.strip().splitlines()[-1])
+    assert not probe["litellm"], "litellm must not be imported by app.main"
+    assert probe["seconds"] < IMPORT_BUDGET_SECONDS, probe
+
+
+def test_live_and_ready_are_separate(client):
+    assert client.get("/api/v1/live").json() == {"status": "ok"}
+    r = client.get("/api/v1/ready")
+    assert r.status_code in (200, 503)
+    assert set(r.json()) == {"ready", "started", "redis", "llm"}
@@ -0,0 +1,63 @@
+import pytest
+
+import app.services.turns as turns
+from app.models import ModelReply
+from app.services import storage
+from app.services.conversation import ConversationConflict, get_conversation, save_conversation
+from conftest import FakeRedis
+
+
+def _fake_run_turn(interloper=None):
+    """run_turn stand-in: appends one exchange; `interloper` runs mid-turn (a concurrent request saving first)."""
+    def run(cid, conv, message, **kw):
+        if interloper:
+            interloper()
+        conv["messages"] = conv["messages"] + [{"role": "user", "message": message},
+                                               {"role": "assistant", "message": f"re: {message}"}]
+        return turns.TurnResult(cid=cid, conv=conv, reply=ModelReply(stance="pro", reply=f"re: {message}"),
+                                new_messages=conv["messages"][-2:])
+    return run
+
+
+@pytest.fixture
+def conv_store(monkeypatch):
+    monkeypatch.setattr(storage, "_store", storage.ConversationStore.from_clients([FakeRedis()]))
+    save_conversation("c1", {"meta": {"topic": "t"}, "messages": []})
+
+
+def _concurrent_save():
+    other = get_conversation("c1")
+    other["messages"].append({"role": "user", "message": "other"})
+    save_conversation("c1", other)
+
+
+def test_stale_save_is_rejected(conv_store):
+    stale = get_conversation("c1")
+    save_conversation("c1", get_conversation("c1"))
+    with pytest.raises(ConversationConflict):
+        save_conversation("c1", stale)
+
+
+def test_merge_policy_keeps_both_turns(conv_store, monkeypatch):
+    monkeypatch.setattr(turns, "CONV_CONFLICT_POLICY", "merge")
+    calls = []
+    monkeypatch.setattr(turns, "run_turn", _fake_run_turn(lambda: calls or calls.append(_concurrent_save())))
+
+    turns.ask_turn("c1", "mine", started=0.0)
+
+    stored = get_conversation("c1")
+    assert [m["message"] for m in stored["messages"]] == ["other", "mine", "re: mine"]
+    assert stored["version"] == 3
+
+
+def test_reject_and_queue_policies(conv_store, monkeypatch):
+    monkeypatch.setattr(turns, "CONV_CONFLICT_POLICY", "reject")
+    monkeypatch.setattr(turns, "run_turn", _fake_run_turn(_concurrent_save))
+    with pytest.raises(ConversationConflict):
+        turns.ask_turn("c1", "mine", started=0.0)
+
+    monkeypatch.setattr(turns, "CONV_CONFLICT_POLICY", "queue")
+    calls = []
+    monkeypatch.setattr(turns, "run_turn", _fake_run_turn(lambda: calls or calls.append(_concurrent_save())))
+    turns.ask_turn("c1", "queued", started=0.0)
+    assert [m["message"] for m in get_conversation("c1")["messages"]][-3:] == ["other", "queued", "re: queued"]
@@ -0,0 +1,53 @@
+from app.models import ChatMessage
+from app.services.guards import StreamGuard, guarded_generate, looks_off_topic_or_flip
+
+
+class _FakeLLM:
+    def __init__(self, tokens, rewrite="Rewritten firm reply."):
+        self.tokens = tokens
+        self.rewrite = rewrite
+        self.consumed = 0
+        self.chat_calls = []
+
+    def stream_chat(self, messages, max_tokens=None):
+        for t in self.tokens:
+            self.consumed += 1
+            yield t
+
+    def chat(self, messages, max_tokens=None):
+        self.chat_calls.append(messages)
+        return self.rewrite
+
+
+def test_stream_guard_catches_trigger_split_across_tokens():
+    g = StreamGuard("The Earth is flat")
+    assert g.feed("Well, I ca") is None
+    assert g.feed("n’t help") == "refusal"
+
+
+def test_stream_guard_verdicts():
+    g = StreamGuard("The Earth is flat")
+    g.feed("The Earth is round, and here is why.")
+    assert g.verdict() == "ok"
+
+    g = StreamGuard("The Earth is flat")
+    g.feed("Consider the following reasons.")
+    assert g.verdict() == "unsure"
+
+    g = StreamGuard("The Earth is flat")
+    g.feed("There are good points on both sides")
+    assert g.verdict() == "neutral"
+
+
+def test_guarded_generate_aborts_stream_and_rewrites():
+    llm = _FakeLLM(["As an", " AI I", " would", " rather", " not"] + ["x"] * 50)
+    msgs = [ChatMessage(role="system", message="sys"), ChatMessage(role="user", message="hi")]
+    text, verdict = guarded_generate(llm, msgs, "The Earth is flat", "pro")
+    assert verdict == "rewritten" and text == "Rewritten firm reply."
+    assert llm.consumed < 10
+    assert "SUPPORT" in llm.chat_calls[0][0].message
+
+
+def test_looks_off_topic_or_flip():
+    assert looks_off_topic_or_flip("On the one hand the Earth...", "The Earth is flat")
+    assert not looks_off_topic_or_flip("The Earth is clearly round.", "The Earth is flat")
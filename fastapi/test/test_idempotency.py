@@ -0,0 +1,68 @@
+import app.services.idempotency as idem
+import app.services.llm as llm
+from app.services import metrics
+from conftest import FakeRedis
+
+
+def _fake_llm(monkeypatch, calls):
+    def chat(self, messages, max_tokens=None, **kw):
+        calls.append("chat")
+        sysm = messages[0].message
+        if "information extractor" in sysm:
+            return '{"topic": "Cats are better than dogs", "user_side": "affirmative"}'
+        if "intent classifier" in sysm:
+            return '{"label": "continue_topic"}'
+        return "NO"
+
+    def stream_chat(self, messages, max_tokens=None, **kw):
+        calls.append("stream")
+        yield from ["Dogs ", "beat cats."]
+
+    monkeypatch.setattr(llm.LLMClient, "chat", chat)
+    monkeypatch.setattr(llm.LLMClient, "stream_chat", stream_chat)
+
+
+def test_retry_with_same_key_replays_without_llm_calls(client, monkeypatch):
+    monkeypatch.setattr(idem, "redis_client", FakeRedis())
+    calls = []
+    _fake_llm(monkeypatch, calls)
+    body = {"message": "Cats are better than dogs"}
+    before = metrics.counter_total("idempotent_replays", scope="ask")
+
+    first = client.post("/api/v1/ask", json=body, headers={"Idempotency-Key": "k-1"})
+    n_calls = len(calls)
+    second = client.post("/api/v1/ask", json=body, headers={"Idempotency-Key": "k-1"})
+
+    assert first.status_code == second.status_code == 200
+    assert first.headers["Idempotent-Replayed"] == "false" and second.headers["Idempotent-Replayed"] == "true"
+    assert second.json() == first.json()
+    assert len(calls) == n_calls
+    assert metrics.counter_total("idempotent_replays", scope="ask") - before == 1
+
+    reused = client.post("/api/v1/ask", json={"message": "something else"}, headers={"Idempotency-Key": "k-1"})
+    assert reused.status_code == 422
+
+
+def test_failed_request_is_not_stored(client, monkeypatch):
+    monkeypatch.setattr(idem, "redis_client", FakeRedis())
+    r = client.post("/api/v1/ask", json={"conversation_id": "missing", "message": "hi"},
+                    headers={"Idempotency-Key": "k-2"})
+    assert r.status_code == 404
+    assert idem.redis_client.get(idem._key("ask", "k-2")) is None
+
+
+def test_replays_do_not_take_rate_limit_tokens(client, monkeypatch):
+    from app.services import ratelimit
+    monkeypatch.setattr(idem, "redis_client", FakeRedis())
+    r = FakeRedis()
+    r.now_ms = 1_000_000
+    monkeypatch.setattr(ratelimit, "redis_client", r)
+    monkeypatch.setattr(ratelimit, "RATE_LIMIT_ENABLED", True)
+    monkeypatch.setattr(ratelimit, "RATE_LIMITS", {"ask": (1, 60)})
+    _fake_llm(monkeypatch, [])
+    body = {"message": "Cats are better than dogs"}
+
+    first = client.post("/api/v1/ask", json=body, headers={"Idempotency-Key": "k-rl"})
+    again = client.post("/api/v1/ask", json=body, headers={"Idempotency-Key": "k-rl"})
+    assert first.status_code == again.status_code == 200 and again.headers["Idempotent-Replayed"] == "true"
+    assert client.post("/api/v1/ask", json=body, headers={"Idempotency-Key": "k-new"}).status_code == 429
@@ -0,0 +1,129 @@
+import threading
+import time
+
+import pytest
+
+from conftest import FakeRedis
+from app.models import AskResponse
+from app.services import jobs
+from app.services.turns import ConversationNotFound
+
+
+@pytest.fixture
+def queue(monkeypatch):
+    """Jobs on a fresh FakeRedis with a pinned stream clock; ask_turn replaced by `calls` outcomes."""
+    r = FakeRedis()
+    r.now_ms = 1_000_000
+    monkeypatch.setattr(jobs, "redis_client", r)
+    monkeypatch.setattr(jobs, "LLM_BACKOFF_BASE", 0.0)
+    outcomes = []
+
+    def ask_turn(cid, message, started, new=False):
+        outcome = outcomes.pop(0) if outcomes else "ok"
+        if isinstance(outcome, Exception):
+            raise outcome
+        return AskResponse(conversation_id=cid, message=[], latency_ms=1, stance="pro")
+    monkeypatch.setattr(jobs, "ask_turn", ask_turn)
+    return r, outcomes
+
+
+def _worker(r, name="w1"):
+    w = jobs.JobWorker(name, client=r)
+    w.ensure_group()
+    return w
+
+
+def test_enqueue_claim_and_result(queue):
+    r, _ = queue
+    w = _worker(r)
+    job = jobs.enqueue_ask("c1", "hi", new=True)
+    assert jobs.get_job(job.job_id).status == "queued"
+    assert w.step() == 1
+    done = jobs.get_job(job.job_id)
+    assert done.status == "done" and done.attempts == 1 and done.result.conversation_id == "c1"
+    assert r._hash[jobs.JOB_STREAM]["groups"][jobs.JOB_GROUP]["pending"] == {}  # acked
+    assert w.step() == 0
+
+
+def test_failed_turn_is_scheduled_not_slept(queue, monkeypatch):
+    r, outcomes = queue
+    monkeypatch.setattr(jobs, "LLM_BACKOFF_BASE", 60.0)
+    w = _worker(r)
+    outcomes.append(RuntimeError("llm down"))
+    job = jobs.enqueue_ask("c1", "hi", new=True)
+    t0 = time.monotonic()
+    w.step()
+    assert time.monotonic() - t0 < 1  # the consumer is free again right away
+    state = jobs.get_job(job.job_id)
+    assert state.status == "retrying" and state.error == "llm down"
+    assert w.step() == 0  # not due yet
+
+    delayed = r._hash[jobs.DELAYED_KEY]
+    delayed.update({m: 0 for m in delayed})  # backoff elapsed
+    assert w.step() == 1  # any worker promotes the due retry and runs it
+    state = jobs.get_job(job.job_id)
+    assert state.status == "done" and state.attempts == 2
+
+
+def test_dead_letter(queue):
+    r, outcomes = queue
+    w = _worker(r)
+    outcomes.extend([RuntimeError("a"), RuntimeError("b"), RuntimeError("c")])
+    job = jobs.enqueue_ask("c1", "hi", new=True)
+    for _ in range(jobs.JOB_MAX_ATTEMPTS):
+        w.step()
+    state = jobs.get_job(job.job_id)
+    assert state.status == "failed" and state.error == "c"
+    assert r.xlen(jobs.DEAD_STREAM) == 1
+
+    outcomes.append(ConversationNotFound("gone"))
+    job = jobs.enqueue_ask("gone", "hi", new=False)
+    w.step()
+    assert jobs.get_job(job.job_id).error == "conversation_id not found"
+
+
+def test_crashed_worker_entries_are_reclaimed(queue):
+    r, _ = queue
+    crashed, healthy = _worker(r, "crashed"), _worker(r, "healthy")
+    job = jobs.enqueue_ask("c1", "hi", new=True)
+    r.xreadgroup(jobs.JOB_GROUP, crashed.consumer, {jobs.JOB_STREAM: ">"}, count=1)  # read, never acked
+    assert healthy.step() == 0
+    r.now_ms += int(jobs.JOB_CLAIM_IDLE * 1000)
+    healthy._last_claim = 0.0
+    assert healthy.step() == 1
+    assert jobs.get_job(job.job_id).status == "done"
+
+
+def test_worker_run_loop(queue):
+    r, _ = queue
+    stop = threading.Event()
+    w = jobs.JobWorker("loop", client=r)
+    w.block_ms = 10
+    t = threading.Thread(target=w.run, args=(stop,), daemon=True)
+    t.start()
+    job = jobs.enqueue_ask("c1", "hi", new=True)
+    for _ in range(100):
+        if jobs.get_job(job.job_id).status == "done":
+            break
+        time.sleep(0.01)
+    stop.set()
+    t.join(2)
+    assert jobs.get_job(job.job_id).status == "done" and not t.is_alive()
+
+
+def test_long_poll_and_events_are_async(client, queue):
+    import inspect
+    import app.api.v1.endpoints as endpoints
+    assert inspect.iscoroutinefunction(endpoints.get_job_status)
+    assert inspect.iscoroutinefunction(endpoints.job_events)
+
+    r, _ = queue
+    w = _worker(r)
+    job = jobs.enqueue_ask("c1", "hi", new=True)
+    threading.Timer(0.2, w.step).start()
+    res = client.get(f"/api/v1/jobs/{job.job_id}?wait=5")
+    assert res.status_code == 200 and res.json()["status"] == "done"
+
+    body = client.get(f"/api/v1/jobs/{job.job_id}/events").text
+    assert body.startswith("event: done\n")
+    assert client.get("/api/v1/jobs/nope?wait=1").status_code == 404
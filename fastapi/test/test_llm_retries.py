@@ -0,0 +1,82 @@
+import pytest
+from litellm.exceptions import APIConnectionError, AuthenticationError
+
+import app.services.llm as llm
+from app.models import ChatMessage
+from app.services.deadline import DeadlineExceeded, deadline_scope
+
+
+MSGS = [ChatMessage(role="user", message="hi")]
+
+
+@pytest.fixture(autouse=True)
+def _no_sleep(monkeypatch):
+    monkeypatch.setattr(llm, "_ollama_up", lambda: True)
+    monkeypatch.setattr(llm, "OLLAMA_API_BASE", "http://fake-ollama:11434")
+    monkeypatch.setattr(llm, "sleep_within_deadline", lambda delay: True)
+
+
+def test_retryable_error_is_retried_on_same_model(monkeypatch):
+    calls = []
+
+    def fake(self, model, messages, max_tokens, timeout=None, **kw):
+        calls.append(model)
+        if len(calls) == 1:
+            raise APIConnectionError("boom", "ollama", model)
+        return "ok"
+
+    monkeypatch.setattr(llm.LLMClient, "_try_completion", fake)
+    assert llm.LLMClient(model="ollama/tiny").chat(MSGS) == "ok"
+    assert calls == ["ollama/tiny", "ollama/tiny"]
+
+
+def test_fatal_error_moves_to_next_provider_without_retry(monkeypatch):
+    calls = []
+
+    def fake(self, model, messages, max_tokens, timeout=None, **kw):
+        calls.append(model)
+        if model.startswith("ollama/"):
+            raise AuthenticationError("bad key", "ollama", model)
+        return "fallback"
+
+    monkeypatch.setattr(llm.LLMClient, "_try_completion", fake)
+    assert llm.LLMClient(model="ollama/tiny").chat(MSGS) == "fallback"
+    assert calls[0] == "ollama/tiny" and calls.count("ollama/tiny") == 1
+
+
+def test_stage_timeout_is_bounded_by_deadline(monkeypatch):
+    seen = []
+
+    def fake(self, model, messages, max_tokens, timeout=None, **kw):
+        seen.append(timeout)
+        return "ok"
+
+    monkeypatch.setattr(llm.LLMClient, "_try_completion", fake)
+    with deadline_scope(2.0):
+        llm.LLMClient(model="ollama/tiny", timeout=20).chat(MSGS)
+    assert seen and seen[0] <= 2.0
+
+
+def test_spent_deadline_cancels_call(monkeypatch):
+    monkeypatch.setattr(llm.LLMClient, "_try_completion", lambda *a, **k: "never")
+    with deadline_scope(0.01):
+        with pytest.raises(DeadlineExceeded):
+            llm.LLMClient(model="ollama/tiny").chat(MSGS)
+
+
+def test_for_task_uses_task_settings(monkeypatch):
+    import app.config as cfg
+    from app.services import metrics
+
+    monkeypatch.setitem(cfg.TASKS, "intent", {**cfg.TASKS["intent"], "model": "ollama/tiny-cls", "num_predict": 8})
+    seen = {}
+
+    def fake(self, model, messages, max_tokens, timeout=None, **kw):
+        seen.update(self._completion_kwargs(model, messages, max_tokens, timeout))
+        return "continue_topic"
+
+    monkeypatch.setattr(llm.LLMClient, "_try_completion", fake)
+    client = llm.LLMClient.for_task("intent")
+    assert client.chat(MSGS) == "continue_topic"
+    assert seen["model"] == "ollama/tiny-cls" and seen["max_tokens"] == 8 and seen["temperature"] == 0.0
+    assert any(t["labels"].get("task") == "intent" for t in metrics.snapshot()["timings"])
@@ -0,0 +1,53 @@
+import json
+
+import httpx
+import pytest
+
+from app.services.ollama import OllamaClient, OllamaError
+
+
+def _client(handler) -> OllamaClient:
+    c = OllamaClient(base_url="http://fake-ollama:11434")
+    c._http = httpx.Client(base_url=c.base_url, transport=httpx.MockTransport(handler))
+    return c
+
+
+def test_chat_sends_native_options_and_returns_stats():
+    seen = {}
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        seen.update(json.loads(request.content))
+        return httpx.Response(200, json={
+            "message": {"role": "assistant", "content": "hello"},
+            "done": True, "prompt_eval_duration": 2_000_000, "eval_duration": 5_000_000, "eval_count": 3,
+        })
+
+    text, stats = _client(handler).chat("ollama/llama3.2:1b", [{"role": "user", "content": "hi"}],
+                                        options={"num_ctx": 512, "num_predict": None}, keep_alive="10m")
+    assert text == "hello"
+    assert stats["eval_duration"] == 5_000_000 and stats["eval_count"] == 3
+    assert seen["model"] == "llama3.2:1b" and seen["keep_alive"] == "10m"
+    assert seen["options"] == {"num_ctx": 512} and seen["stream"] is False
+
+
+def test_stream_chat_yields_pieces_and_final_stats():
+    lines = [
+        {"message": {"content": "Hel"}, "done": False},
+        {"message": {"content": "lo"}, "done": False},
+        {"message": {"content": ""}, "done": True, "prompt_eval_duration": 1_000, "eval_duration": 9_000},
+    ]
+    body = "\n".join(json.dumps(x) for x in lines).encode()
+    stats = {}
+    pieces = list(_client(lambda r: httpx.Response(200, content=body)).stream_chat(
+        "llama3.2:1b", [{"role": "user", "content": "hi"}], stats_out=stats))
+    assert pieces == ["Hel", "lo"]
+    assert stats == {"prompt_eval_duration": 1_000, "eval_duration": 9_000}
+
+
+def test_errors_are_classified():
+    with pytest.raises(OllamaError) as e:
+        _client(lambda r: httpx.Response(404, json={"error": "model not found"})).chat("x", [])
+    assert not e.value.retryable
+    with pytest.raises(OllamaError) as e:
+        _client(lambda r: httpx.Response(503, text="busy")).chat("x", [])
+    assert e.value.retryable
@@ -0,0 +1,66 @@
+import pytest
+
+from conftest import FakeRedis
+from app.services import personas
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    monkeypatch.setattr(personas, "redis_client", FakeRedis())
+    reg = personas.ProfileRegistry()
+    monkeypatch.setattr(personas, "registry", reg)
+    return reg
+
+
+def test_system_prompt_is_built_once_per_key(registry):
+    a = personas.system_message("smart_shy", "contra", "Cats are better than dogs")
+    assert a is personas.system_message("smart_shy", "contra", "Cats are better than dogs")
+    assert "CON stance" in a.message and '"Cats are better than dogs"' in a.message
+    assert personas.system_message("smart_shy", "pro", "Cats are better than dogs") is not a
+    assert personas.system_message("unknown", "contra", "x") is personas.system_message("smart_shy", "contra", "x")
+
+
+def test_stored_persona_overrides_builtin_and_invalidates(registry):
+    before = personas.system_message("smart_shy", "pro", "Tax sugar")
+    registry.put("smart_shy", {"name": "Athena", "system": "You are Athena v2."})
+    after = personas.system_message("smart_shy", "pro", "Tax sugar")
+    assert after is not before and after.message.startswith("You are Athena v2.")
+    assert personas.get_profile("smart_shy")["source"] == "redis"
+
+    registry.delete("smart_shy")
+    assert personas.get_profile("smart_shy")["source"] == "builtin"
+
+
+def test_other_worker_sees_change_after_invalidation(registry, monkeypatch):
+    other = personas.ProfileRegistry()
+    assert other.get("newbie") is None
+    registry.put("newbie", {"name": "Newbie", "system": "Be kind.", "style": {"temperature": 0.2}})
+    assert other.get("newbie") is None  # still cached until the pub/sub message arrives
+    other.invalidate()
+    assert other.get("newbie")["name"] == "Newbie"
+
+
+def test_generate_reply_uses_persona(registry, monkeypatch):
+    from app.services import llm
+    registry.put("newbie", {"name": "Newbie", "system": "Be kind.", "style": {"temperature": 0.2}})
+    seen = {}
+
+    def fake_chat(self, messages, max_tokens=None, schema=None):
+        seen.update(system=messages[0].message, temperature=self.temperature)
+        return "I support it."
+    monkeypatch.setattr(llm.LLMClient, "chat", fake_chat)
+    llm.generate_reply([], "hi", stance_hint="pro", profile_id="newbie")
+    assert seen["system"].startswith("Be kind.") and seen["temperature"] == 0.2
+
+
+def test_admin_api(client, registry, monkeypatch):
+    import app.api.v1.endpoints as endpoints
+    monkeypatch.setattr(endpoints, "ADMIN_TOKEN", "adm")
+    h = {"X-Admin-Token": "adm"}
+    assert client.put("/api/v1/admin/profiles/newbie", json={"name": "Newbie"}).status_code == 403
+    r = client.put("/api/v1/admin/profiles/newbie", json={"name": "Newbie", "system": "Be kind."}, headers=h)
+    assert r.status_code == 200 and r.json()["source"] == "redis"
+    assert "newbie" in [p["id"] for p in client.get("/api/v1/profiles").json()["profiles"]]
+    assert client.post("/api/v1/conversations/profile", json={"profile_id": "newbie"}).status_code == 200
+    assert client.delete("/api/v1/admin/profiles/newbie", headers=h).status_code == 200
+    assert client.delete("/api/v1/admin/profiles/newbie", headers=h).status_code == 404
@@ -0,0 +1,70 @@
+import json
+import time
+
+import pytest
+
+from conftest import FakeRedis
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    from app.services import pregen
+    r = FakeRedis()
+    generated = []
+
+    def fake_generate(profile_id, topic, stance, angle):
+        generated.append((profile_id, topic, stance))
+        return f"{stance} opening on {topic} #{len(generated)}"
+
+    monkeypatch.setattr(pregen, "redis_client", r)
+    monkeypatch.setattr(pregen, "PREGEN_ENABLED", True)
+    monkeypatch.setattr(pregen, "PREGEN_POOL_SIZE", 2)
+    monkeypatch.setattr(pregen, "list_profiles", lambda: [{"id": "smart_shy"}])
+    monkeypatch.setattr(pregen, "_generate_opening", fake_generate)
+    monkeypatch.setattr(pregen._pool, "wake", lambda: None)
+    return pregen, r, generated
+
+
+def test_refill_is_budgeted_and_round_robin(pool):
+    pregen, r, generated = pool
+    pregen.record_topic("Remote work is better than the office")
+    assert pregen.refill_once(budget=3) == 3
+    # one opening per pool first: the default topic and both stances of the recorded one
+    assert [g[2] for g in generated] == ["pro", "pro", "contra"]
+    assert generated[1][1] == "Remote work is better than the office"
+    assert pregen.refill_once(budget=10) == 3  # tops every pool up to PREGEN_POOL_SIZE
+    assert pregen.refill_once(budget=10) == 0
+
+
+def test_refill_only_runs_on_the_lock_holder(pool):
+    pregen, r, generated = pool
+    r.set(pregen._LOCK_KEY, "other-worker")
+    assert pregen.refill_once() == 0 and generated == []
+    r.delete(pregen._LOCK_KEY)
+    assert pregen.refill_once() > 0
+    assert r.get(pregen._LOCK_KEY) is None  # released after the cycle
+
+
+def test_hit_matches_reworded_topic(pool):
+    pregen, r, generated = pool
+    pregen.record_topic("Remote work is better than the office.")
+    pregen.refill_once(budget=10)
+    # the classifier words the topic differently on the live turn; the pool key still matches
+    reply = pregen.take_opening("smart_shy", "Is remote work better than offices?", "contra",
+                                "I think remote work is better")
+    assert reply and reply.startswith("contra opening on Remote work")
+
+
+def test_miss_for_specific_message_empty_pool_or_stale(pool, monkeypatch):
+    pregen, r, generated = pool
+    pregen.refill_once(budget=10)
+    topic = "The Earth is flat"
+    assert pregen.take_opening("smart_shy", topic, "pro",
+                               "The earth is flat because ships never vanish hull first over the horizon") is None
+    assert pregen.take_opening("smart_shy", "Cats versus dogs", "pro", "cats vs dogs") is None
+
+    key = pregen._pool_key("smart_shy", topic, "pro")
+    while r.lpop(key):
+        pass
+    r.rpush(key, json.dumps({"reply": "old", "ts": time.time() - pregen.PREGEN_MAX_AGE - 1}))
+    assert pregen.take_opening("smart_shy", topic, "pro", "the earth is flat") is None
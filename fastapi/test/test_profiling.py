@@ -0,0 +1,77 @@
+import time
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.services import profiling
+
+
+@pytest.fixture
+def enabled(monkeypatch, tmp_path):
+    monkeypatch.setattr(profiling, "PROFILING_TOKEN", "s3cret")
+    monkeypatch.setattr(profiling, "PROFILING_DIR", str(tmp_path))
+    monkeypatch.setattr(profiling, "_sample_rate", 0.0)
+    return tmp_path
+
+
+def _busy_handler_work():
+    until = time.perf_counter() + 0.15
+    n = 0
+    while time.perf_counter() < until:
+        n += 1
+    return n
+
+
+def _app():
+    app = FastAPI()
+
+    @app.get("/work")
+    def work():
+        profiling.attach_current_thread()
+        return {"n": _busy_handler_work()}
+
+    app.add_middleware(profiling.ProfilingMiddleware)
+    return TestClient(app)
+
+
+def test_only_token_or_sampled_requests_are_profiled(enabled):
+    c = _app()
+    assert "x-profile-id" not in c.get("/work").headers
+    assert "x-profile-id" not in c.get("/work", headers={"X-Profile": "wrong"}).headers
+
+    r = c.get("/work", headers={"X-Profile": "s3cret"})
+    pid = r.headers["x-profile-id"]
+    folded = (enabled / f"{pid}.folded").read_text()
+    assert "test_profiling:_busy_handler_work" in folded
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in folded.splitlines())
+
+    profiling.set_sample_rate(1.0)
+    assert "x-profile-id" in c.get("/work").headers
+    assert len(profiling.list_profiles()) == 2
+
+
+def test_admin_endpoints(client, enabled, monkeypatch):
+    import app.api.v1.endpoints as endpoints
+    monkeypatch.setattr(endpoints, "ADMIN_TOKEN", "adm")
+    assert client.get("/api/v1/admin/profiling").status_code == 403
+    # the admin API has one secret; the X-Profile value is not an admin token
+    assert client.get("/api/v1/admin/profiling", headers={"X-Admin-Token": "s3cret"}).status_code == 403
+    h = {"X-Admin-Token": "adm"}
+    assert client.get("/api/v1/admin/profiles", headers=h).status_code == 200
+    assert client.put("/api/v1/admin/profiling", json={"sample_rate": 0.25}, headers=h).json()["sample_rate"] == 0.25
+
+    pid = _app().get("/work", headers={"X-Profile": "s3cret"}).headers["x-profile-id"]
+    runs = client.get("/api/v1/admin/profiling", headers=h).json()["profiles"]
+    assert runs[0]["id"] == pid and runs[0]["samples"] > 0
+    assert "_busy_handler_work" in client.get(f"/api/v1/admin/profiling/{pid}", headers=h).text
+    assert client.get("/api/v1/admin/profiling/..%2Fetc", headers=h).status_code == 404
+
+
+def test_admin_endpoints_hidden_when_disabled(client, monkeypatch):
+    import app.api.v1.endpoints as endpoints
+    monkeypatch.setattr(endpoints, "ADMIN_TOKEN", "adm")
+    monkeypatch.setattr(profiling, "PROFILING_TOKEN", "")
+    assert client.get("/api/v1/admin/profiling", headers={"X-Admin-Token": "adm"}).status_code == 404
+    monkeypatch.setattr(endpoints, "ADMIN_TOKEN", "")
+    assert client.get("/api/v1/admin/profiling", headers={"X-Admin-Token": ""}).status_code == 404
@@ -0,0 +1,54 @@
+import pytest
+
+from conftest import FakeRedis
+from app.services import ratelimit
+
+
+@pytest.fixture
+def fake(monkeypatch):
+    r = FakeRedis()
+    r.now_ms = 1_000_000
+    monkeypatch.setattr(ratelimit, "redis_client", r)
+    monkeypatch.setattr(ratelimit, "RATE_LIMIT_ENABLED", True)
+    monkeypatch.setattr(ratelimit, "RATE_LIMITS", {
+        "ask": (100, 60), "ask_conversation": (2, 60), "read": (3, 30), "read_conversation": (100, 60)})
+    return r
+
+
+def test_token_bucket_refills_over_the_window(fake):
+    assert [ratelimit.check("read", "ip:a").allowed for _ in range(4)] == [True, True, True, False]
+    denied = ratelimit.check("read", "ip:a")
+    assert denied.retry_after_ms == 10_000 and denied.headers()["Retry-After"] == "10"
+    assert ratelimit.check("read", "ip:b").allowed  # separate client, separate bucket
+    fake.now_ms += 10_000
+    assert ratelimit.check("read", "ip:a").allowed
+    assert not ratelimit.check("read", "ip:a").allowed
+
+
+def test_cheap_endpoint_headers_and_429(client, fake):
+    r = client.get("/api/v1/profiles")
+    assert r.status_code == 200
+    assert r.headers["RateLimit-Limit"] == "3" and r.headers["RateLimit-Remaining"] == "2"
+    assert r.headers["RateLimit-Policy"] == "3;w=30"
+    client.get("/api/v1/profiles")
+    client.get("/api/v1/profiles")
+    r = client.get("/api/v1/profiles")
+    assert r.status_code == 429 and r.headers["Retry-After"] == "10"
+
+
+def test_ask_is_limited_per_conversation(client, fake):
+    cid = client.post("/api/v1/conversations/profile", json={"profile_id": "smart_shy"}).json()["conversation_id"]
+    ratelimit.check("ask_conversation", cid)
+    ratelimit.check("ask_conversation", cid)
+    r = client.post("/api/v1/ask", json={"conversation_id": cid, "message": "hello"})
+    assert r.status_code == 429 and "ask_conversation" in r.json()["detail"]
+    assert r.headers["RateLimit-Limit"] == "2"
+
+
+def test_limiter_fails_open(client, fake, monkeypatch):
+    def boom(*a, **kw):
+        raise ConnectionError("redis down")
+    monkeypatch.setattr(fake, "eval", boom)
+    for _ in range(5):
+        r = client.get("/api/v1/profiles")
+        assert r.status_code == 200 and "RateLimit-Limit" not in r.headers
@@ -0,0 +1,26 @@
+import app.services.guards as guards
+import app.services.llm as llm
+from app.services import storage
+from app.tools import replay
+
+
+def test_replay_with_mock_provider(monkeypatch):
+    monkeypatch.setattr(llm, "LLM_MOCK", True)
+    monkeypatch.setattr(guards, "LLM_MOCK", True)
+    monkeypatch.setattr(storage, "_store", storage._store)
+    replay._init_worker()
+
+    records = replay.replay_conversation({
+        "id": "t1",
+        "turns": ["Cats are better than dogs", {"message": "dogs are more loyal"}],
+        "expect": {"user_side": "affirmative"},
+    })
+
+    assert [r["turn"] for r in records] == [0, 1]
+    assert all(r["ok"] and not r.get("error") for r in records), records
+    assert records[0]["stance"] == "contra"
+    assert records[0]["llm"]["classify"]["provider"] == "mock"
+    assert records[1]["llm"]["reply"]["provider"] == "mock"
+
+    summary = replay.summarize(records, wall_seconds=1.0, conversations=1)
+    assert summary["turns"] == 2 and summary["errors"] == 0 and summary["failed_checks"] == {}
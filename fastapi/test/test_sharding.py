@@ -0,0 +1,116 @@
+import json
+
+import pytest
+import redis
+
+from conftest import FakeRedis
+from app.services import storage
+from app.services.storage import ConversationStore, HashRing, conv_key, parse_shards
+from app.tools import rebalance
+
+
+def _doc(version, *messages):
+    return json.dumps({"version": version, "meta": {}, "messages": list(messages)})
+
+
+def test_ring_placement_is_stable_and_moves_only_to_the_new_node():
+    cids = [f"c{i}" for i in range(2000)]
+    old = HashRing(["a", "b", "c"], vnodes=64)
+    assert [old.node_for(c) for c in cids] == [HashRing(["a", "b", "c"], vnodes=64).node_for(c) for c in cids]
+    counts = {n: sum(old.node_for(c) == n for c in cids) for n in "abc"}
+    assert min(counts.values()) > 400  # roughly even
+
+    new = HashRing(["a", "b", "c", "d"], vnodes=64)
+    moved = [c for c in cids if old.node_for(c) != new.node_for(c)]
+    assert all(new.node_for(c) == "d" for c in moved)
+    assert 0.15 < len(moved) / len(cids) < 0.35  # ~1/4 of the cids
+
+
+def test_parse_shards():
+    assert parse_shards("redis://a|redis://a-ro, redis://b") == [("redis://a", ["redis://a-ro"]), ("redis://b", [])]
+
+
+def test_replica_reads_fall_back_to_primary():
+    primary, replica = FakeRedis(), FakeRedis()
+    store = ConversationStore.from_clients([primary], [[replica]])
+    primary.set(conv_key("x"), _doc(2))
+    assert store.get("x", readonly=True) == _doc(2)  # replica lagging: primary answers
+    replica.set(conv_key("x"), _doc(1))
+    assert store.get("x", readonly=True) == _doc(1)
+    assert store.get("x") == _doc(2)  # writes and non-readonly reads always hit the primary
+
+    def down(k):
+        raise redis.ConnectionError("replica down")
+    replica.get = down
+    assert store.get("x", readonly=True) == _doc(2)
+
+
+@pytest.fixture
+def nodes(monkeypatch):
+    monkeypatch.setattr(rebalance, "REDIS_SHARD_VNODES", 64)
+    clients = {"r1": FakeRedis(), "r2": FakeRedis(), "r3": FakeRedis()}
+    old, new = ["r1", "r2"], ["r1", "r2", "r3"]
+    old_ring = HashRing(old, vnodes=64)
+    for i in range(60):
+        cid = f"c{i}"
+        owner = clients[old_ring.node_for(cid)]
+        owner.set(conv_key(cid), _doc(1, f"m{i}"))
+        owner.hset(f"align:{cid}", "count", 1)
+    return clients, old, new, HashRing(new, vnodes=64)
+
+
+def _moved(ring, old):
+    return [f"c{i}" for i in range(60) if ring.node_for(f"c{i}") not in old]
+
+
+def test_rebalance_copy_resync_and_purge(nodes):
+    clients, old, new, ring = nodes
+    moved = _moved(ring, old)
+    assert moved
+
+    stats = rebalance.rebalance(old, new, clients)
+    assert stats["copied"] == 2 * len(moved) and stats["purged"] == 0
+    assert all(clients["r3"].get(conv_key(c)) == _doc(1, f"m{c[1:]}") for c in moved)
+    assert rebalance.rebalance(old, new, clients)["copied"] == 0  # re-running is a no-op
+
+    # between the copy and the deploy a turn still lands on the old owner of moved[0]...
+    a, b = moved[0], moved[1]
+    old_owner = next(n for n in old if clients[n].get(conv_key(a)))
+    clients[old_owner].set(conv_key(a), _doc(2, "late write"))
+    # ...and after the deploy a turn lands on the new owner of moved[1]; purge must not undo it
+    clients["r3"].set(conv_key(b), _doc(2, "new owner"))
+
+    stats = rebalance.rebalance(old, new, clients, purge=True)
+    assert stats["copied"] == 1 and stats["purged"] == 2 * len(moved)
+    assert clients["r3"].get(conv_key(a)) == _doc(2, "late write")
+    assert clients["r3"].get(conv_key(b)) == _doc(2, "new owner")
+    for c in moved:
+        assert all(clients[n].get(conv_key(c)) is None and not clients[n].exists(f"align:{c}") for n in old)
+    kept = [f"c{i}" for i in range(60) if f"c{i}" not in moved]
+    assert all(clients[ring.node_for(c)].get(conv_key(c)) for c in kept)
+    assert storage.cid_from_key(f"align:{{{a}}}") == a
+
+
+def test_cli_accepts_explicit_layouts(nodes, monkeypatch, capsys):
+    clients, old, new, ring = nodes
+    monkeypatch.setattr(rebalance, "_client", lambda url, decode=True: clients[url])
+    rebalance.main(["--from", "r1,r2", "--to", "r1,r2,r3"])
+    rebalance.main(["--from", "r1,r2", "--to", "r1,r2,r3", "--purge"])  # step 3 works after the deploy
+    assert "purged=" in capsys.readouterr().out
+    assert all(clients["r3"].get(conv_key(c)) for c in _moved(ring, old))
+    with pytest.raises(SystemExit):
+        rebalance.main(["--from", "r1,r2", "--to", "r1,r2"])
+
+
+def test_cluster_mode_shares_one_cluster_client(monkeypatch):
+    from redis.cluster import RedisCluster
+    from app import config
+    made = []
+    monkeypatch.setattr(config, "REDIS_CLUSTER", True)
+    monkeypatch.setattr(RedisCluster, "from_url", classmethod(lambda cls, url, **kw: made.append(url) or FakeRedis()))
+    monkeypatch.setattr(storage, "REDIS_CLUSTER", True)
+    lazy = config.LazyRedis("redis://cluster:7000/0")
+    monkeypatch.setattr(storage, "redis_client", lazy)
+    # rate limits, jobs, locks... and conversations all go through the same RedisCluster client
+    assert ConversationStore.from_config().shards["cluster"].primary is lazy.connect()
+    assert made == ["redis://cluster:7000/0"]
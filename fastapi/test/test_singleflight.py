@@ -0,0 +1,69 @@
+import threading
+import time
+
+from app.services import metrics
+from app.services.singleflight import SingleFlight
+
+
+def test_concurrent_identical_calls_share_one_execution():
+    sf = SingleFlight()
+    calls = []
+    gate = threading.Event()
+
+    def slow():
+        calls.append(1)
+        gate.wait(2)
+        return "label"
+
+    before = metrics.counter_total("singleflight_saved", scope="local")
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(sf.do("k", slow))) for _ in range(5)]
+    for t in threads:
+        t.start()
+    time.sleep(0.1)
+    gate.set()
+    for t in threads:
+        t.join()
+
+    assert results == ["label"] * 5
+    assert len(calls) == 1
+    assert metrics.counter_total("singleflight_saved", scope="local") - before == 4
+
+
+def test_different_keys_do_not_coalesce():
+    sf = SingleFlight()
+    assert sf.do("a", lambda: "1") == "1"
+    assert sf.do("b", lambda: "2") == "2"
+
+
+def test_waiters_retry_when_the_leader_hits_its_own_deadline():
+    from app.services.deadline import DeadlineExceeded
+    sf = SingleFlight()
+    calls = []
+    gate = threading.Event()
+
+    def work():
+        calls.append(1)
+        if len(calls) == 1:  # the leader's request budget runs out mid-call
+            gate.wait(2)
+            raise DeadlineExceeded("leader budget spent")
+        return "label"
+
+    out = {}
+
+    def leader():
+        try:
+            sf.do("k", work)
+        except DeadlineExceeded as e:
+            out["leader"] = e
+    t1 = threading.Thread(target=leader)
+    t1.start()
+    time.sleep(0.05)
+    t2 = threading.Thread(target=lambda: out.setdefault("waiter", sf.do("k", work)))
+    t2.start()
+    time.sleep(0.05)
+    gate.set()
+    t1.join()
+    t2.join()
+    assert isinstance(out["leader"], DeadlineExceeded) and out["waiter"] == "label"
+    assert len(calls) == 2
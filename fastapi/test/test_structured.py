@@ -0,0 +1,49 @@
+import pytest
+
+import app.services.llm as llm
+from app.models import ChatMessage, IntentLabel, TopicSide
+from app.services.structured import StructuredOutputError, parse_structured
+
+
+def test_valid_json_parses_directly():
+    obj = parse_structured('{"topic": "Cats vs dogs", "user_side": "Affirmative"}', TopicSide)
+    assert obj.topic == "Cats vs dogs" and obj.user_side == "affirmative"
+
+
+@pytest.mark.parametrize("raw", [
+    '```json\n{"label": "greeting",}\n```',
+    "Sure! {'label': 'greeting'} hope that helps",
+])
+def test_local_repair(raw):
+    assert parse_structured(raw, IntentLabel).label == "greeting"
+
+
+def test_unrepairable_output_raises():
+    with pytest.raises(StructuredOutputError):
+        parse_structured("greeting", IntentLabel)
+    with pytest.raises(StructuredOutputError):
+        parse_structured('{"label": "dance"}', IntentLabel)
+
+
+def test_chat_json_requests_schema_once(monkeypatch):
+    calls = []
+
+    def fake(self, model, messages, max_tokens, timeout=None, schema=None):
+        calls.append(schema)
+        return '{"topic": "Remote work", "user_side": "negative",}'
+
+    monkeypatch.setattr(llm, "_ollama_up", lambda: True)
+    monkeypatch.setattr(llm.LLMClient, "_try_completion", fake)
+    obj = llm.LLMClient(model="ollama/tiny").chat_json([ChatMessage(role="user", message="x")], TopicSide)
+    assert (obj.topic, obj.user_side) == ("Remote work", "negative")
+    assert calls == [TopicSide]
+
+
+def test_invalid_side_keeps_topic(monkeypatch):
+    from app.services import classifier
+
+    monkeypatch.setattr(llm, "_ollama_up", lambda: True)
+    monkeypatch.setattr(llm.LLMClient, "_try_completion",
+                        lambda self, *a, **k: '{"topic": "School uniforms", "user_side": "neutral"}')
+    assert classifier.classify_topic_and_user_side_via_llm("uniforms?") == ("School uniforms", "negative")
+    assert parse_structured('{"topic": "Cats"}', TopicSide).user_side == "negative"
@@ -0,0 +1,83 @@
+from types import SimpleNamespace
+
+import pytest
+
+from conftest import FakeRedis
+
+
+@pytest.fixture
+def fake(monkeypatch):
+    from app.services import metrics, storage, usage
+    r = FakeRedis()
+    monkeypatch.setattr(usage, "redis_client", r)
+    monkeypatch.setattr(storage, "_store", storage.ConversationStore.from_clients([r]))
+    metrics.reset()
+    return r
+
+
+def test_litellm_usage_is_recorded_per_conversation_and_day(fake, monkeypatch):
+    from app.models import ChatMessage
+    from app.services import llm, usage
+
+    resp = SimpleNamespace(choices=[SimpleNamespace(message={"content": "hi"})],
+                           usage={"prompt_tokens": 7, "completion_tokens": 3})
+    monkeypatch.setattr(llm, "_get_litellm", lambda: SimpleNamespace(completion=lambda **kw: resp))
+    client = llm.LLMClient(task="reply")
+    with usage.usage_scope("c-usage", "smart_shy"):
+        for _ in range(2):
+            assert client._try_completion("openai/gpt-4o-mini", [ChatMessage(role="user", message="x")], None) == "hi"
+            client._observe("openai/gpt-4o-mini", 0.0, "ok")
+
+    conv = usage.conversation_usage("c-usage")
+    assert conv["prompt_tokens"] == 14 and conv["completion_tokens"] == 6 and conv["calls"] == 2
+    assert conv["reply:completion_tokens"] == 6
+    today = usage.summary()["today"]
+    assert today["openai:openai/gpt-4o-mini:prompt_tokens"] == 14
+    assert today["profile:smart_shy:calls"] == 2
+    assert usage.summary()["process"]["prompt_tokens"] == 14
+
+
+def test_usage_without_scope_only_counts_the_day(fake):
+    from app.services import usage
+    usage.record("classify", "ollama/llama3", "ollama", 5, 1)
+    assert usage.day_usage()["prompt_tokens"] == 5
+    assert usage.day_usage().get("cost_usd") is None  # local models are free
+    assert not any(k.startswith("usage:") and k != usage._day_key() for k in fake._hash)
+
+
+def test_meta_exposes_usage(client):
+    from app.services import usage
+    r = client.post("/api/v1/conversations/profile", json={"profile_id": "smart_shy"})
+    cid = r.json()["conversation_id"]
+    usage.record("reply", "mock/x", "mock", 4, 2, scope=(cid, "smart_shy"))
+    body = client.get(f"/api/v1/conversations/{cid}/meta").json()
+    assert body["usage"]["prompt_tokens"] == 4 and body["usage"]["reply:calls"] == 1
+
+
+def test_aborted_stream_is_billed_with_an_estimate(fake, monkeypatch):
+    from app.models import ChatMessage
+    from app.services import llm, usage
+
+    def stream(self, model, messages, max_tokens, timeout=None):
+        self.last_usage = (0, 0)
+        yield "abcdefgh"
+        yield "never read"
+        self.last_usage = (99, 99)  # the provider's final usage chunk, which an abort never reaches
+
+    monkeypatch.setattr(llm.LLMClient, "_try_stream", stream)
+    monkeypatch.setattr(llm.LLMClient, "_provider_order", lambda self: ["openai/gpt-4o-mini"])
+    client = llm.LLMClient(task="reply")
+    with usage.usage_scope("c-abort", "smart_shy"):
+        gen = client.stream_chat([ChatMessage(role="user", message="x" * 40)])
+        assert next(gen) == "abcdefgh"
+        gen.close()  # what the guard does on an early abort
+
+    conv = usage.conversation_usage("c-abort")
+    assert (conv["prompt_tokens"], conv["completion_tokens"], conv["calls"]) == (10, 2, 1)
+    assert usage.day_usage()["completion_tokens"] == 2
+
+
+def test_day_totals_are_not_conversation_keys():
+    from app.services.storage import cid_from_key
+    assert cid_from_key("usage:day:2026-10-19") is None
+    assert cid_from_key("usage:c1") == "c1" and cid_from_key("usage:{c1}") == "c1"
@@ -0,0 +1,46 @@
+import json
+import time
+
+import httpx
+
+from app.services import warmup
+from app.services.ollama import OllamaClient
+
+
+def test_keep_alive_parsing():
+    assert warmup.keep_alive_seconds("10m") == 600
+    assert warmup.keep_alive_seconds("30s") == 30
+    assert warmup.keep_alive_seconds("300") == 300
+    assert warmup.keep_alive_seconds("-1") is None
+    assert warmup.keep_alive_seconds("0") == 0
+
+
+def test_preload_and_refresh_only_while_active(monkeypatch):
+    calls = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(json.loads(request.content))
+        return httpx.Response(200, json={"response": "", "done": True, "load_duration": 1_500_000_000})
+
+    client = OllamaClient(base_url="http://fake-ollama:11434")
+    client._http = httpx.Client(base_url=client.base_url, transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(warmup, "get_ollama", lambda: client)
+    monkeypatch.setattr(warmup, "WARMUP_REFRESH_MARGIN", 60)
+    w = warmup.ModelWarmer()
+
+    assert w.preload("llama3.2:1b", "10m")
+    assert calls[-1] == {"model": "llama3.2:1b", "prompt": "", "stream": False, "keep_alive": "10m"}
+    st = w.states()["llama3.2:1b"]
+    assert st["state"] == "loaded" and st["load_ms"] == 1500.0
+
+    # Idle app: nothing is refreshed even when the model is about to expire.
+    w._state["llama3.2:1b"]["expires_at"] = time.time() + 10
+    assert w.refresh_due() == 0
+
+    # Recent traffic on another model keeps this one resident.
+    w.note_use("ollama/other:7b")
+    assert w.refresh_due() == 1 and len(calls) == 2
+
+    # Real calls push the expiry, so no redundant refresh.
+    w.note_use("ollama/llama3.2:1b")
+    assert w.refresh_due() == 0
@@ -0,0 +1,119 @@
+import pytest
+
+from conftest import FakeRedis
+
+
+@pytest.fixture
+def ws_env(monkeypatch):
+    """Fresh store, no live sessions, flush every 2 turns, and a run_turn that echoes without an LLM."""
+    from app.models import ModelReply
+    from app.services import session, storage
+    from app.services.turns import TurnResult
+
+    monkeypatch.setattr(storage, "_store", storage.ConversationStore.from_clients([FakeRedis()]))
+    monkeypatch.setattr(session, "_sessions", {})
+    monkeypatch.setattr(session, "WS_FLUSH_TURNS", 2)
+
+    def run_turn(cid, conv, message, on_token=None, on_reset=None):
+        created = conv is None
+        conv = conv or {"meta": {"profile_id": "smart_shy"}, "messages": []}
+        new = [{"role": "user", "message": message}, {"role": "assistant", "message": f"re: {message}"}]
+        conv["messages"] = conv["messages"] + new
+        if on_token:
+            on_token(new[1]["message"])
+        return TurnResult(cid=cid or "ws-new", conv=conv, reply=ModelReply(stance="pro", reply=new[1]["message"]),
+                          new_messages=new, created=created)
+    monkeypatch.setattr(session, "run_turn", run_turn)
+    return session
+
+
+def _turn(ws, message):
+    ws.send_json({"message": message})
+    frames = []
+    while True:
+        frames.append(ws.receive_json())
+        if frames[-1]["type"] in ("done", "error"):
+            return frames
+
+
+def _stored(cid):
+    from app.services.conversation import get_conversation
+    return [m["message"] for m in (get_conversation(cid) or {}).get("messages", [])]
+
+
+def test_turns_are_flushed_in_batches(client, ws_env):
+    with client.websocket_connect("/api/v1/ws/debate") as ws:
+        frames = _turn(ws, "one")
+        assert frames[0] == {"type": "token", "text": "re: one"} and frames[-1]["conversation_id"] == "ws-new"
+        assert _stored("ws-new") == ["one", "re: one"]  # a new conversation is saved right away
+        _turn(ws, "two")
+        assert _stored("ws-new") == ["one", "re: one"]  # pending, but served from memory
+        assert len(ws_env.live_conversation("ws-new")["messages"]) == 4
+        _turn(ws, "three")
+        assert len(_stored("ws-new")) == 6
+    assert ws_env.live_conversation("ws-new") is None
+
+
+def test_close_merges_onto_a_concurrent_http_turn(client, ws_env):
+    from app.services.conversation import get_conversation, save_conversation
+    save_conversation("w1", {"meta": {"profile_id": "smart_shy"}, "messages": []})
+    with client.websocket_connect("/api/v1/ws/debate?conversation_id=w1") as ws:
+        assert ws.receive_json()["resumed"] is True
+        _turn(ws, "from ws")
+        conv = get_conversation("w1")  # an /ask lands while the session still holds its turn
+        conv["messages"] += [{"role": "user", "message": "from http"}, {"role": "assistant", "message": "ok"}]
+        save_conversation("w1", conv)
+    assert _stored("w1") == ["from http", "ok", "from ws", "re: from ws"]
+
+
+def test_failed_flush_still_releases_the_session(client, ws_env, monkeypatch):
+    from app.services import metrics
+
+    def down(*a, **kw):
+        raise ConnectionError("redis down")
+    monkeypatch.setattr(ws_env, "save_conversation", down)
+    before = metrics.counter_total("ws_flush_errors")
+    with client.websocket_connect("/api/v1/ws/debate") as ws:
+        assert _turn(ws, "one")[-1]["type"] == "done"  # the reply was delivered; only the save failed
+        assert ws_env.live_conversation("ws-new") is not None
+    assert ws_env.live_conversation("ws-new") is None
+    assert metrics.counter_total("ws_flush_errors") - before == 2
+
+
+def test_ws_turns_are_rate_limited(client, ws_env, monkeypatch):
+    from app.services import ratelimit
+    r = FakeRedis()
+    r.now_ms = 1_000_000
+    monkeypatch.setattr(ratelimit, "redis_client", r)
+    monkeypatch.setattr(ratelimit, "RATE_LIMIT_ENABLED", True)
+    monkeypatch.setattr(ratelimit, "RATE_LIMITS", {"ask": (100, 60), "ask_conversation": (1, 60)})
+    with client.websocket_connect("/api/v1/ws/debate") as ws:
+        assert _turn(ws, "one")[-1]["type"] == "done"  # no conversation yet: only the client bucket
+        assert _turn(ws, "two")[-1]["type"] == "done"
+        err = _turn(ws, "three")[-1]
+        assert err["status"] == 429 and err["retry_after"] == 60
+
+
+def test_reads_do_not_wait_for_a_running_turn(ws_env, monkeypatch):
+    import threading
+    from app.services.conversation import save_conversation
+    save_conversation("w2", {"meta": {"profile_id": "smart_shy"}, "messages": []})
+    session = ws_env.open_session("w2")
+    started, release = threading.Event(), threading.Event()
+    echo = ws_env.run_turn
+
+    def slow_turn(cid, conv, message, on_token=None, on_reset=None):
+        started.set()
+        release.wait(5)
+        return echo(cid, conv, message)
+    monkeypatch.setattr(ws_env, "run_turn", slow_turn)
+
+    t = threading.Thread(target=session.turn, args=("slow",))
+    t.start()
+    assert started.wait(5)
+    assert ws_env.live_conversation("w2")["messages"] == []  # last committed state, without blocking
+    session.flush_if_due()
+    release.set()
+    t.join(5)
+    assert [m["message"] for m in ws_env.live_conversation("w2")["messages"]] == ["slow", "re: slow"]
+    ws_env.close_session(session)